@@ -20,10 +20,12 @@ import pprint
 
 
 # Set according to environment
-os.environ['NUMEXPR_MAX_THREADS'] = '8'
+os.environ['NUMEXPR_MAX_THREADS'] = str(os.cpu_count())
 
 # Get experiment details
-hash = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).strip().decode("utf-8")
+def git_hash():
+    return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).strip().decode("utf-8")
+
 now = datetime.datetime.now()
 
 # Set the number of simulation timesteps, with a maximum of `len(debt_market_df) - 1`
@@ -70,7 +72,7 @@ def run_experiment(results_id=None, output_directory=None, experiment_metrics=No
             backend=Backend.PATHOS,
             raise_exceptions=False,
             deepcopy=False,
-            processes=8,
+            processes=os.cpu_count(),
             drop_substeps=True,
         )
         if save_file:
@@ -88,11 +90,11 @@ def run_experiment(results_id=None, output_directory=None, experiment_metrics=No
         experiment_time = end - start
         logging.info(f"Experiment completed in {experiment_time} seconds")
 
-        #update_experiment_run_log(output_directory, passed, results_id, hash, exceptions, experiment_metrics, experiment_time, now)
+        #update_experiment_run_log(output_directory, passed, results_id, git_hash(), exceptions, experiment_metrics, experiment_time, now)
         return pd.DataFrame(experiment.results)
     except AssertionError as e:
         pass
         #logging.info("Experiment failed")
         #logging.error(e)
 
-        #update_experiment_run_log(output_directory, passed, results_id, hash, exceptions, experiment_metrics, experiment_time, now)
+        #update_experiment_run_log(output_directory, passed, results_id, git_hash(), exceptions, experiment_metrics, experiment_time, now)
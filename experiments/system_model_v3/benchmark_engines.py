@@ -0,0 +1,52 @@
+"""
+Steps per second of the radcad, bounded and lean engines on the recommended_params experiment, in a single process:
+
+    python -m experiments.system_model_v3.benchmark_engines [timesteps]
+"""
+from radcad import Model, Simulation, Experiment
+from radcad.engine import Engine, Backend
+
+import experiments.system_model_v3.engine as bounded_engine
+import experiments.system_model_v3.lean_engine as lean_engine
+from experiments.system_model_v3.recommended_params import params
+
+from models.system_model_v3.model.partial_state_update_blocks import partial_state_update_blocks
+from models.system_model_v3.model.state_variables.init import state_variables
+
+import copy
+import sys
+import time
+
+
+def run_radcad(timesteps):
+    model = Model(initial_state=copy.deepcopy(state_variables), state_update_blocks=partial_state_update_blocks, params=params)
+    experiment = Experiment([Simulation(model=model, timesteps=timesteps, runs=1)])
+    experiment.engine = Engine(backend=Backend.SINGLE_PROCESS, raise_exceptions=False, deepcopy=False, drop_substeps=True)
+    experiment.run()
+    return experiment.results
+
+def run_single_process(engine, timesteps):
+    results, _ = engine.run(state_variables, partial_state_update_blocks, params, timesteps)
+    return results
+
+def scalars(results):
+    return [{key: value for key, value in row.items() if isinstance(value, (int, float))} for row in results]
+
+if __name__ == '__main__':
+    timesteps = int(sys.argv[1]) if len(sys.argv) > 1 else 24 * 30
+    subsets = len(bounded_engine.generate_parameter_sweep(params))
+
+    engines = {
+        'radcad': run_radcad,
+        'bounded': lambda timesteps: run_single_process(bounded_engine, timesteps),
+        'lean': lambda timesteps: run_single_process(lean_engine, timesteps),
+    }
+    results = {}
+    for name, run in engines.items():
+        start = time.time()
+        results[name] = run(timesteps)
+        elapsed = time.time() - start
+        print(f'{name:10} {subsets * timesteps / elapsed:10.1f} steps/s')
+
+    for name in ['bounded', 'lean']:
+        assert scalars(results[name]) == scalars(results['radcad']), f'{name} results differ from radcad'
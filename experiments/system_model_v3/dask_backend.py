@@ -0,0 +1,59 @@
+"""
+Run the (subset, run) jobs of an experiment on a Dask `distributed` cluster, e.g. a LocalCluster or a multi-node cluster.
+
+The model (initial state, blocks and parameter sweep) and the exogenous DataFrames are scattered to every worker once,
+and each job returns its results as a DataFrame partition.
+The model's random streams and caches are per process, so the workers should be processes with one thread each.
+"""
+
+from experiments.system_model_v3.engine import generate_parameter_sweep, run_job, exception_record
+from experiments.system_model_v3.lean_engine import single_run as lean_single_run
+from models.system_model_v3.model.parts.exogenous import ExogenousSeries
+
+from distributed import as_completed
+import importlib
+import logging
+import pandas as pd
+
+
+def exogenous_data(param_sweep):
+    '''
+    The DataFrames of the ExogenousSeries in the parameter sweep, by (module, name)
+    '''
+    return {(value.module, value.name): value.df
+            for param_set in param_sweep for value in param_set.values() if isinstance(value, ExogenousSeries)}
+
+def _install_exogenous_data(data):
+    # Set as module attributes, which the worker's ExogenousSeries look up instead of loading the data files
+    for (module, name), df in data.items():
+        module = importlib.import_module(module)
+        if name not in vars(module):
+            setattr(module, name, df)
+
+def _run_job(model, data, subset, run, timesteps, record, single_run, stop_conditions):
+    initial_state, state_update_blocks, param_sweep = model
+    _install_exogenous_data(data)
+    results, exception, trace = run_job(single_run, timesteps, run, subset, initial_state, state_update_blocks, param_sweep[subset],
+                                        record, stop_conditions=stop_conditions, picklable=True)
+    return subset, run, pd.DataFrame(results), exception, trace
+
+def run(client, initial_state, state_update_blocks, params, timesteps, runs=1, raise_exceptions=False, record=True,
+        single_run=lean_single_run, stop_conditions=()):
+    '''
+    Run all parameter subsets and Monte Carlo runs on the `client`'s cluster,
+    returning the results as one DataFrame per (subset, run), and the exceptions, in the order of engine.run()
+    '''
+    param_sweep = generate_parameter_sweep(params)
+    [model] = client.scatter([(initial_state, state_update_blocks, param_sweep)], broadcast=True)
+    [data] = client.scatter([exogenous_data(param_sweep)], broadcast=True)
+
+    futures = [client.submit(_run_job, model, data, subset, run, timesteps, record, single_run, stop_conditions, pure=False)
+               for run in range(runs) for subset in range(len(param_sweep))]
+    frames = {}
+    exceptions = {}
+    for _, (subset, run, frame, exception, trace) in as_completed(futures, with_results=True):
+        exceptions[(run, subset)] = exception_record(exception, trace, run, subset, timesteps, param_sweep[subset], initial_state,
+                                                     raise_exceptions)
+        frames[(run, subset)] = frame
+    logging.info(f'Ran {len(futures)} jobs on {len(client.scheduler_info()["workers"])} Dask workers')
+    return [frames[key] for key in sorted(frames)], [exceptions[key] for key in sorted(exceptions)]
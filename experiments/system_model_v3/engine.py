@@ -0,0 +1,192 @@
+"""
+A single-process runner with the same semantics as radcad's engine (`deepcopy=False`, `drop_substeps=True`),
+that passes policies and state updates a bounded StateHistory instead of every previous timestep.
+
+The history depth is the largest `history` declared by the partial state update blocks,
+so memory per run doesn't grow with the number of timesteps, apart from the recorded results.
+"""
+
+from experiments.system_model_v3.recording import recorder
+from experiments.system_model_v3.stop_conditions import RunStopped, stop_exceptions, stop_reason
+from models.system_model_v3.model.parts.state_history import StateHistory, history_depth
+from models.utils import random_streams
+
+from functools import reduce
+import copy
+import logging
+import pickle
+import traceback
+
+
+def generate_parameter_sweep(params):
+    '''
+    Parameter subsets from the params dict of lists, with the last value repeated for shorter lists (as radcad).
+    '''
+    max_len = max((len(value) for value in params.values()), default=0)
+    return [
+        {key: value[index] if index < len(value) else value[-1] for key, value in params.items()}
+        for index in range(max_len)
+    ]
+
+def _add_signals(acc, policy_result):
+    for key, value in policy_result.items():
+        if acc.get(key, None):
+            acc[key] += value
+        else:
+            acc[key] = value
+    return acc
+
+def reduce_signals(params, substep, state_history, substate, psub):
+    policy_results = [policy(params, substep, state_history, substate) for policy in psub['policies'].values()]
+    if len(policy_results) == 0:
+        return {}
+    elif len(policy_results) == 1:
+        return pickle.loads(pickle.dumps(policy_results[0], -1))
+    else:
+        return reduce(_add_signals, policy_results, {})
+
+def _update_state(initial_state, params, substep, state_history, substate, signals, key, function):
+    if key not in initial_state:
+        raise KeyError('Invalid state key in partial state update block')
+    state_key, state_value = function(params, substep, state_history, substate, signals)
+    if state_key != key:
+        raise KeyError(f'PSU state key {key} doesn\'t match function state key {state_key}')
+    return state_key, state_value
+
+def _single_run(results, simulation, timesteps, run, subset, initial_state, state_update_blocks, params, record, checkpoint=None,
+                stop_conditions=()):
+    initial_state['simulation'] = simulation
+    initial_state['subset'] = subset
+    initial_state['run'] = run + 1
+    initial_state['substep'] = 0
+    initial_state['timestep'] = 0
+
+    state_history = StateHistory([initial_state], history_depth(state_update_blocks))
+    state_recorder = recorder(record, results)
+    run_checkpoint = None if checkpoint is None else checkpoint.run_checkpoint(simulation, subset, run + 1)
+    resumed = None if run_checkpoint is None else run_checkpoint.load(state_recorder)
+    if resumed is None:
+        start = 0
+        stop_memory = {}
+        state_recorder.append(initial_state)
+    else:
+        start, state_history, stop_memory = resumed
+
+    stopping_exceptions = stop_exceptions(stop_conditions)
+    # Replaying a timestep, e.g. when resuming from a checkpoint in the same process, gets the same random draws
+    random_streams.reset()
+
+    for timestep in range(start, timesteps):
+        previous_state = state_history[-1][-1]
+        try:
+            for substep, psub in enumerate(state_update_blocks):
+                substate = previous_state.copy()
+                substate_copy = substate.copy()
+                substate['substep'] = substep + 1
+
+                signals = reduce_signals(params, substep, state_history, substate_copy, psub)
+                substate.update(
+                    _update_state(initial_state, params, substep, state_history, substate_copy, signals, key, function)
+                    for key, function in psub['variables'].items()
+                )
+                substate['timestep'] = timestep + 1
+                previous_state = substate
+        except stopping_exceptions as error:
+            state_recorder.flush()
+            raise RunStopped(f'{type(error).__name__}: {error}', timestep + 1, state_history[-1][-1]) from error
+
+        state_history.append([previous_state])
+        state_recorder.append(previous_state)
+        # A stopped run isn't checkpointed at the timestep it stops, so that it stops there again when resumed
+        reason = stop_reason(stop_conditions, previous_state, stop_memory)
+        if reason is not None:
+            state_recorder.flush()
+            raise RunStopped(reason, timestep + 1, previous_state)
+        if run_checkpoint is not None and run_checkpoint.due(timestep + 1, timesteps):
+            run_checkpoint.save(timestep + 1, state_history, state_recorder, stop_memory)
+
+    state_recorder.flush()
+    return results
+
+def single_run(simulation, timesteps, run, subset, initial_state, state_update_blocks, params, record=True, checkpoint=None,
+               stop_conditions=()):
+    '''
+    Run one subset of a simulation, returning (results, exception, traceback) as radcad's `core.single_run`.
+
+    With `record=False` only the initial and final states are returned,
+    and with a RecordingSpec the keys and timesteps it selects, see recording.py.
+    With a checkpoint.Checkpointer, the run is checkpointed as it runs and resumed from its latest checkpoint.
+    With `stop_conditions` (see stop_conditions.py), the run stops at the first condition met,
+    returning the results up to the last complete timestep and a RunStopped exception without a traceback.
+    '''
+    results = []
+    try:
+        return _single_run(results, simulation, timesteps, run, subset, initial_state, state_update_blocks, params, record,
+                           checkpoint, stop_conditions), None, None
+    except RunStopped as stop:
+        logging.info(f'Simulation {simulation} / run {run} / subset {subset} stopped: {stop}')
+        return results, stop, None
+    except Exception as error:
+        trace = traceback.format_exc()
+        print(trace)
+        logging.warning(f'Simulation {simulation} / run {run} / subset {subset} failed! Returning partial results.')
+        return results, error, trace
+
+def run_job(single_run, timesteps, run, subset, initial_state, state_update_blocks, param_set, record=True, checkpoint=None,
+            stop_conditions=(), picklable=False):
+    '''
+    Run one (subset, run) job of an experiment with `single_run` on a copy of the initial state,
+    returning (results, exception, traceback) as single_run().
+    With `picklable`, e.g. to return it from a worker process, an exception that can't be pickled is replaced by a RuntimeError.
+    '''
+    results, exception, trace = single_run(0, timesteps, run, subset, copy.deepcopy(initial_state), state_update_blocks, param_set,
+                                           record, checkpoint, stop_conditions)
+    if picklable:
+        try:
+            pickle.dumps(exception)
+        except Exception:
+            exception = RuntimeError(repr(exception))
+    return results, exception, trace
+
+def exception_record(exception, trace, run, subset, timesteps, param_set, initial_state, raise_exceptions=False):
+    '''
+    The entry of a (subset, run) job in the experiment's exceptions, in the format of radcad's `experiment.exceptions`.
+    With `raise_exceptions` the exception of a failed run is raised instead, but not the RunStopped of a stopped run.
+    '''
+    if raise_exceptions and exception and not isinstance(exception, RunStopped):
+        raise exception
+    return {
+        'exception': exception,
+        'traceback': trace,
+        'simulation': 0,
+        'run': run,
+        'subset': subset,
+        'timesteps': timesteps,
+        'parameters': param_set,
+        'initial_state': initial_state,
+    }
+
+def run(initial_state, state_update_blocks, params, timesteps, runs=1, raise_exceptions=False, record=True, single_run=single_run,
+        sink=None, checkpoint=None, stop_conditions=()):
+    '''
+    Run all parameter subsets and Monte Carlo runs of a simulation,
+    returning the results and exceptions in the format of radcad's `experiment.results` and `experiment.exceptions`.
+    `single_run` runs one subset, e.g. lean_engine.single_run.
+    `record` selects the recorded results, True, False or a RecordingSpec, see single_run().
+    With a `sink`, e.g. parquet_sink.ParquetSink, the results of each run are passed to `sink.write()` instead of being returned.
+    With a `checkpoint`, a checkpoint.Checkpointer, runs are checkpointed and resumed, see single_run().
+    With `stop_conditions`, runs stop early with a RunStopped exception, which `raise_exceptions` doesn't raise, see single_run().
+    '''
+    results = []
+    exceptions = []
+    for run_index in range(runs):
+        for subset_index, param_set in enumerate(generate_parameter_sweep(params)):
+            run_results, exception, trace = run_job(single_run, timesteps, run_index, subset_index, initial_state,
+                                                    state_update_blocks, param_set, record, checkpoint, stop_conditions)
+            exceptions.append(exception_record(exception, trace, run_index, subset_index, timesteps, param_set, initial_state,
+                                               raise_exceptions))
+            if sink is None:
+                results.extend(run_results)
+            else:
+                sink.write(run_results)
+    return results, exceptions
@@ -0,0 +1,158 @@
+"""
+A single-process runner with the same results as radcad's engine (`deepcopy=False`, `drop_substeps=True`),
+specialised for running one model many times.
+
+The partial state update blocks are prepared once per run as tuples of policy and state update functions,
+and the state is a single dict updated in place, copied only for the end of timestep results.
+Policies and state updates are passed this dict, so they must not assign to `state`.
+
+With `compile_blocks=True`, the blocks are compiled into fewer substeps first, see model/parts/block_compiler.py.
+"""
+
+from experiments.system_model_v3.engine import _add_signals, run as _run
+from experiments.system_model_v3.recording import RecordingSpec, recorder, result_keys
+from experiments.system_model_v3.stop_conditions import RunStopped, stop_exceptions, stop_reason
+from models.system_model_v3.model.parts.state_history import StateHistory, history_depth
+from models.utils import random_streams
+from models.system_model_v3.model.types import immutable_types
+import models.system_model_v3.model.parts.block_compiler as block_compiler
+
+from functools import reduce
+import logging
+import pickle
+import traceback
+
+
+def prepare_blocks(initial_state, state_update_blocks):
+    '''
+    The blocks as (policies, state updates) tuples, with the state update keys checked against the initial state
+    '''
+    prepared_blocks = []
+    for psub in state_update_blocks:
+        for key in psub['variables']:
+            if key not in initial_state:
+                raise KeyError('Invalid state key in partial state update block')
+        prepared_blocks.append((tuple(psub['policies'].values()), tuple(psub['variables'].items())))
+    return prepared_blocks
+
+def live_keys(record, stop_conditions=()):
+    '''
+    The state keys recorded by `record` (see recording.recorder()) or read by the stop conditions,
+    or None if every key is recorded or they can't be determined
+    '''
+    if not isinstance(record, RecordingSpec) or record.keys is None:
+        return None
+    keys = {*result_keys, *record.keys, *record.reducers}
+    for condition in stop_conditions:
+        condition_keys = condition.state_keys()
+        if condition_keys is None:
+            return None
+        keys |= condition_keys
+    return keys
+
+def copy_signals(signals):
+    '''
+    radcad copies the signals of a single policy through pickle, which isn't needed for immutable values (see model/types.py)
+    '''
+    if all(type(value) in immutable_types for value in signals.values()):
+        return signals.copy()
+    return pickle.loads(pickle.dumps(signals, -1))
+
+def _single_run(results, simulation, timesteps, run, subset, initial_state, state_update_blocks, params, record, checkpoint=None,
+                stop_conditions=()):
+    initial_state['simulation'] = simulation
+    initial_state['subset'] = subset
+    initial_state['run'] = run + 1
+    initial_state['substep'] = 0
+    initial_state['timestep'] = 0
+
+    state_history = StateHistory([initial_state], history_depth(state_update_blocks))
+    state_recorder = recorder(record, results)
+    run_checkpoint = None if checkpoint is None else checkpoint.run_checkpoint(simulation, subset, run + 1)
+    resumed = None if run_checkpoint is None else run_checkpoint.load(state_recorder)
+    if resumed is None:
+        start = 0
+        stop_memory = {}
+        state_recorder.append(initial_state)
+    else:
+        start, state_history, stop_memory = resumed
+
+    stopping_exceptions = stop_exceptions(stop_conditions)
+    # Replaying a timestep, e.g. when resuming from a checkpoint in the same process, gets the same random draws
+    random_streams.reset()
+
+    prepared_blocks = prepare_blocks(initial_state, state_update_blocks)
+    state = state_history[-1][-1].copy()
+    for timestep in range(start + 1, timesteps + 1):
+        try:
+            for substep, (policies, updates) in enumerate(prepared_blocks):
+                if not policies:
+                    signals = {}
+                elif len(policies) == 1:
+                    signals = copy_signals(policies[0](params, substep, state_history, state))
+                else:
+                    signals = reduce(_add_signals, [policy(params, substep, state_history, state) for policy in policies], {})
+
+                # All state updates of the block see the state before the block
+                values = [function(params, substep, state_history, state, signals) for _, function in updates]
+                for (key, _), (state_key, value) in zip(updates, values):
+                    if state_key != key:
+                        raise KeyError(f'PSU state key {key} doesn\'t match function state key {state_key}')
+                    state[key] = value
+                state['substep'] = substep + 1
+                state['timestep'] = timestep
+        except stopping_exceptions as error:
+            # The state is part way through the timestep, so the run stops with the previous one
+            state_recorder.flush()
+            raise RunStopped(f'{type(error).__name__}: {error}', timestep, state_history[-1][-1]) from error
+
+        final_state = state.copy()
+        state_history.append([final_state])
+        state_recorder.append(final_state)
+        # A stopped run isn't checkpointed at the timestep it stops, so that it stops there again when resumed
+        reason = stop_reason(stop_conditions, final_state, stop_memory)
+        if reason is not None:
+            state_recorder.flush()
+            raise RunStopped(reason, timestep, final_state)
+        if run_checkpoint is not None and run_checkpoint.due(timestep, timesteps):
+            run_checkpoint.save(timestep, state_history, state_recorder, stop_memory)
+
+    state_recorder.flush()
+    return results
+
+def single_run(simulation, timesteps, run, subset, initial_state, state_update_blocks, params, record=True, checkpoint=None,
+               stop_conditions=()):
+    '''
+    Run one subset of a simulation, returning (results, exception, traceback) as radcad's `core.single_run`.
+
+    With `record=False` only the initial and final states are returned,
+    and with a RecordingSpec the keys and timesteps it selects, see recording.py.
+    With a checkpoint.Checkpointer, the run is checkpointed as it runs and resumed from its latest checkpoint.
+    With `stop_conditions` (see stop_conditions.py), the run stops at the first condition met,
+    returning the results up to the last complete timestep and a RunStopped exception without a traceback.
+    '''
+    results = []
+    try:
+        return _single_run(results, simulation, timesteps, run, subset, initial_state, state_update_blocks, params, record,
+                           checkpoint, stop_conditions), None, None
+    except RunStopped as stop:
+        logging.info(f'Simulation {simulation} / run {run} / subset {subset} stopped: {stop}')
+        return results, stop, None
+    except Exception as error:
+        trace = traceback.format_exc()
+        print(trace)
+        logging.warning(f'Simulation {simulation} / run {run} / subset {subset} failed! Returning partial results.')
+        return results, error, trace
+
+def run(initial_state, state_update_blocks, params, timesteps, runs=1, raise_exceptions=False, record=True, sink=None,
+        checkpoint=None, stop_conditions=(), compile_blocks=False):
+    '''
+    Run all parameter subsets and Monte Carlo runs of a simulation, see engine.run().
+    With `compile_blocks`, the blocks are compiled into fewer substeps, dropping the updates of keys that aren't recorded or read,
+    see block_compiler.compile_blocks(). The results are then the same, apart from the substep.
+    This only saves time with a RecordingSpec of some keys, from about 1000 timesteps in all.
+    '''
+    if compile_blocks:
+        state_update_blocks = block_compiler.compile_blocks(state_update_blocks, initial_state, live_keys(record, stop_conditions))
+    return _run(initial_state, state_update_blocks, params, timesteps, runs, raise_exceptions, record, single_run=single_run, sink=sink,
+                checkpoint=checkpoint, stop_conditions=stop_conditions)
@@ -0,0 +1,105 @@
+"""
+A results sink writing each run to a Parquet dataset as the simulation runs, instead of keeping every run in memory.
+
+Scalar state keys are written as the columns of the `results` table, and nested state
+(the CDP ledger, trader populations, dicts and other objects) as side tables named after the state key,
+with the `timestep` and the `item` index of each row within the timestep.
+Every table is partitioned by subset and run, `<directory>/<table>/subset=<subset>/run=<run>/part-0.parquet`,
+so that load_results() reads only the runs and columns requested.
+"""
+
+import datetime
+import json
+import numbers
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+results_table = 'results'
+
+def is_scalar(value):
+    return value is None or isinstance(value, (numbers.Number, str, datetime.datetime, np.generic))
+
+def side_table(value):
+    '''
+    The rows of a nested state value as a DataFrame
+    '''
+    if hasattr(value, 'to_dataframe'):
+        return value.to_dataframe()
+    if hasattr(value, 'fields'):
+        return pd.DataFrame({field: getattr(value, field) for field in value.fields})
+    if isinstance(value, dict):
+        return pd.json_normalize(value) if value else pd.DataFrame()
+    if isinstance(value, (list, tuple)):
+        return pd.DataFrame(list(value))
+    attributes = getattr(value, '__slots__', None) or vars(value)
+    return pd.DataFrame([{key: getattr(value, key) for key in attributes if is_scalar(getattr(value, key))}])
+
+
+class ParquetSink():
+    '''
+    Writes the results of each (subset, run) to the Parquet dataset in `directory`, see engine.run(sink=...)
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _write_table(self, table, subset, run, df):
+        path = os.path.join(self.directory, table, f'subset={subset}', f'run={run}')
+        os.makedirs(path, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), os.path.join(path, 'part-0.parquet'))
+
+    def write(self, run_results):
+        '''
+        Write the results of one (subset, run)
+        '''
+        if not run_results:
+            return
+        subset, run = run_results[0]['subset'], run_results[0]['run']
+        nested_keys = {key for row in run_results for key, value in row.items() if not is_scalar(value)}
+
+        scalars = pd.DataFrame([{key: value for key, value in row.items() if key not in nested_keys} for row in run_results])
+        self._write_table(results_table, subset, run, scalars.drop(columns=['subset', 'run']))
+
+        for key in sorted(nested_keys):
+            frames = []
+            for row in run_results:
+                frame = side_table(row[key])
+                frame.insert(0, 'item', np.arange(len(frame)))
+                frame.insert(0, 'timestep', row['timestep'])
+                frames.append(frame)
+            self._write_table(key, subset, run, pd.concat(frames, ignore_index=True))
+
+    def write_exceptions(self, exceptions):
+        '''
+        Write the exceptions of engine.run(), with the exception and parameters as strings
+        '''
+        df = pd.DataFrame([{
+            'subset': exception['subset'],
+            'run': exception['run'],
+            'exception': None if exception['exception'] is None else repr(exception['exception']),
+            'traceback': exception['traceback'],
+            'parameters': json.dumps(exception['parameters'], default=str),
+        } for exception in exceptions])
+        os.makedirs(self.directory, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), os.path.join(self.directory, 'exceptions.parquet'))
+
+
+def load_results(directory, table=results_table, subsets=None, runs=None, columns=None):
+    '''
+    Load a table of a ParquetSink dataset as a DataFrame,
+    reading only the `subsets` and `runs` and the `columns` (with subset, run and timestep) given
+    '''
+    dataset = ds.dataset(os.path.join(directory, table), format='parquet', partitioning='hive')
+    condition = None
+    for key, values in (('subset', subsets), ('run', runs)):
+        if values is not None:
+            key_condition = ds.field(key).isin(list(values))
+            condition = key_condition if condition is None else condition & key_condition
+    if columns is not None:
+        columns = ['subset', 'run', 'timestep', *(column for column in columns if column not in ('subset', 'run', 'timestep'))]
+    df = dataset.to_table(columns=columns, filter=condition).to_pandas()
+    return df.sort_values(['subset', 'run', 'timestep'], kind='stable').reset_index(drop=True)
@@ -35,9 +35,10 @@ def eth_leverager_balances(row):
     rp = row['target_price']
     safes = row['cdps'] # SAFEs are initialized in timestep 1
     
-    df = safes.query(f"open == 1 and owner == 'leverager'")
-    total_collateral = df['locked'].sum() - df['freed'].sum() - df['v_bitten'].sum()
-    total_debt = df['drawn'].sum() - df['wiped'].sum() - df['u_bitten'].sum()
+    indices = safes.select(open=1, owner='leverager')
+    counts = safes['count'][indices]
+    total_collateral = (safes.collateral(indices) * counts).sum()
+    total_debt = (safes.debt(indices) * counts).sum()
     debt_base = total_debt * rp
     collateral_base = total_collateral * eth_price
     total_base = collateral_base - debt_base
@@ -233,7 +234,8 @@ def cdp_profit(df, owner, run):
     start_collateral_base = 0
     start_debt = 0
     start_debt_base = 0
-    for index, cdp in start_safes.query(f"open == 1 and owner == '{owner}'").iterrows():
+    for index in start_safes.select(open=1, owner=owner):
+        cdp = start_safes.cdp(index)
         locked = cdp["locked"]
         freed = cdp["freed"]
         drawn = cdp["drawn"]
@@ -242,9 +244,10 @@ def cdp_profit(df, owner, run):
         v_bitten = cdp["v_bitten"]
         u_bitten = cdp["u_bitten"]
         w_bitten = cdp["w_bitten"]
+        count = cdp["count"]
         
-        collateral = locked - freed - v_bitten
-        debt = drawn - wiped - u_bitten
+        collateral = (locked - freed - v_bitten) * count
+        debt = (drawn - wiped - u_bitten) * count
         
         start_collateral += collateral
         start_debt += debt
@@ -263,7 +266,8 @@ def cdp_profit(df, owner, run):
     final_collateral_base = 0
     final_debt = 0
     final_debt_base = 0
-    for index, cdp in final_safes.query(f"open == 1 and owner == '{owner}'").iterrows():
+    for index in final_safes.select(open=1, owner=owner):
+        cdp = final_safes.cdp(index)
         locked = cdp["locked"]
         freed = cdp["freed"]
         drawn = cdp["drawn"]
@@ -272,9 +276,10 @@ def cdp_profit(df, owner, run):
         v_bitten = cdp["v_bitten"]
         u_bitten = cdp["u_bitten"]
         w_bitten = cdp["w_bitten"]
+        count = cdp["count"]
         
-        collateral = locked - freed - v_bitten
-        debt = drawn - wiped - u_bitten 
+        collateral = (locked - freed - v_bitten) * count
+        debt = (drawn - wiped - u_bitten) * count
         
         final_collateral += collateral
         final_debt += debt
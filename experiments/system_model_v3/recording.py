@@ -0,0 +1,103 @@
+"""
+Selective, decimated recording of the simulation results, applied by the bounded and lean engines as they run.
+"""
+
+import math
+
+# State keys identifying each result row, always recorded
+result_keys = ['simulation', 'subset', 'run', 'substep', 'timestep']
+
+reducer_names = ['last', 'mean', 'min', 'max']
+
+
+class RecordingSpec():
+    '''
+    Record the state `keys` (or all keys if None) every `every` timesteps,
+    and the `reducers` of state keys over the timesteps since the previous recorded row,
+    e.g. `RecordingSpec(['target_price'], every=24, reducers={'market_price': ['mean', 'min', 'max']})`
+    records the target price every day, with the daily mean, minimum and maximum market price
+    as `market_price_mean`, `market_price_min` and `market_price_max`.
+
+    The initial state and the final timestep are always recorded, so `every=math.inf` records only those.
+    '''
+    def __init__(self, keys=None, every=1, reducers=None):
+        assert every >= 1
+        reducers = {key: [names] if isinstance(names, str) else list(names) for key, names in dict(reducers or {}).items()}
+        for names in reducers.values():
+            for name in names:
+                if name not in reducer_names:
+                    raise ValueError(f'Unknown reducer {name}, expected one of {reducer_names}')
+
+        self.keys = keys
+        self.every = every
+        self.reducers = reducers
+
+    def recorder(self, results):
+        return Recorder(self, results)
+
+
+def recorder(record, results):
+    '''
+    The Recorder for the engines' `record` argument:
+    a RecordingSpec, True to record every timestep, or False to record only the initial and final states
+    '''
+    if isinstance(record, RecordingSpec):
+        return record.recorder(results)
+    return RecordingSpec(every=1 if record else math.inf).recorder(results)
+
+
+class Recorder():
+    '''
+    Records the end of timestep states of one run into `results`, see RecordingSpec
+    '''
+    def __init__(self, spec, results):
+        self.spec = spec
+        self.results = results
+        self.window = None
+        self.last_state = None
+
+    def _row(self, state):
+        if self.spec.keys is None:
+            row = dict(state) if self.spec.reducers else state
+        else:
+            row = {key: state[key] for key in result_keys}
+            row.update((key, state[key]) for key in self.spec.keys)
+        for key, names in self.spec.reducers.items():
+            for name in names:
+                if name == 'last':
+                    row[f'{key}_last'] = state[key]
+                elif name == 'mean':
+                    row[f'{key}_mean'] = self.window[key]['sum'] / self.window[key]['count']
+                else:
+                    row[f'{key}_{name}'] = self.window[key][name]
+        return row
+
+    def _add_to_window(self, state):
+        if self.window is None:
+            self.window = {key: {'sum': 0.0, 'count': 0, 'min': state[key], 'max': state[key]} for key in self.spec.reducers}
+        for key, window in self.window.items():
+            value = state[key]
+            window['sum'] += value
+            window['count'] += 1
+            window['min'] = min(window['min'], value)
+            window['max'] = max(window['max'], value)
+
+    def append(self, state):
+        '''
+        Add the state at the end of a timestep
+        '''
+        self._add_to_window(state)
+        self.last_state = state
+        if state['timestep'] % self.spec.every == 0:
+            self.results.append(self._row(state))
+            self.window = None
+            self.last_state = None
+
+    def flush(self):
+        '''
+        Record the final timestep, if it isn't at the end of a window
+        '''
+        if self.last_state is not None:
+            self.results.append(self._row(self.last_state))
+            self.window = None
+            self.last_state = None
@@ -3,12 +3,17 @@ from experiments.utils import save_to_HDF5, update_experiment_run_log
 from radcad import Model, Simulation, Experiment
 from radcad.engine import Engine, Backend
 
+import experiments.system_model_v3.engine as bounded_engine
+import experiments.system_model_v3.lean_engine as lean_engine
+import experiments.system_model_v3.warm_up as warm_up
+from experiments.system_model_v3.worker_pool import WorkerPool
+from experiments.system_model_v3.parquet_sink import ParquetSink
+from experiments.system_model_v3.checkpoint import Checkpointer
+
 from models.system_model_v3.model.partial_state_update_blocks import partial_state_update_blocks
 from models.system_model_v3.model.params.init import params
 from models.system_model_v3.model.state_variables.init import state_variables
 
-from models.system_model_v3.model.params.init import eth_price_df
-
 import logging
 import datetime
 import subprocess
@@ -17,13 +22,16 @@ import os
 import dill
 import pandas as pd
 import pprint
+from types import SimpleNamespace
 
 
 # Set according to environment
-os.environ['NUMEXPR_MAX_THREADS'] = '8'
+os.environ['NUMEXPR_MAX_THREADS'] = str(os.cpu_count())
 
 # Get experiment details
-hash = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).strip().decode("utf-8")
+def git_hash():
+    return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"]).strip().decode("utf-8")
+
 now = datetime.datetime.now()
 
 # Set the number of simulation timesteps, with a maximum of `len(debt_market_df) - 1`
@@ -42,7 +50,45 @@ def configure_logging(output_directory, date):
 def run_experiment(results_id=None, output_directory=None, experiment_metrics=None, timesteps=24*30*12,
                    runs=1, params=params, initial_state=state_variables,
                    state_update_blocks=partial_state_update_blocks,
-                   save_file=False, save_logs=False):
+                   save_file=False, save_logs=False, engine='radcad', recording=None,
+                   parquet_directory=None, checkpoint_directory=None, warm_up_timesteps=None, expected_cost=None,
+                   dask_address=None, stop_conditions=None, raise_exceptions=False, compile_blocks=False):
+    '''
+    Run the experiment with radcad, or with `engine='bounded'` with the single-process runner in engine.py,
+    which only keeps the state history declared by the partial state update blocks,
+    or with `engine='lean'` with the runner in lean_engine.py, which also prepares the blocks once per run and updates the state in place,
+    or with `engine='pool'` with the lean runner on a pool of one worker per CPU (see worker_pool.py),
+    running the jobs with the largest `expected_cost(param_set, run)` first,
+    or with `engine='dask'` with the lean runner on the Dask cluster at `dask_address`, or a LocalCluster (see dask_backend.py).
+
+    With the bounded, lean, pool and dask engines, `recording` is a RecordingSpec selecting the state keys and timesteps to record
+    (see recording.py), and except with dask, with a `parquet_directory` each run is written to a Parquet dataset there as it completes
+    instead of being returned (see parquet_sink.py).
+    With a `checkpoint_directory` runs are checkpointed there, and resumed from their latest checkpoint (see checkpoint.py).
+    With `warm_up_timesteps`, the subsets that don't read the parameters they differ in during those timesteps
+    share one simulation of them (see warm_up.py). This only helps sweeps of parameters such as `ki`, `kd` or `control_period`:
+    sweeps of `kp` or `alpha` don't share a warm-up, because the model reads them before the controller is enabled.
+    With `stop_conditions` runs stop at the first failure mode or guardrail they meet,
+    with a RunStopped exception in the experiment's exceptions (see stop_conditions.py).
+    With `raise_exceptions`, the first run that fails raises its exception instead of returning partial results.
+    With `compile_blocks`, the lean and pool engines run the blocks compiled into fewer substeps,
+    dropping the updates of keys that aren't recorded or read (see model/parts/block_compiler.py),
+    which only saves time with a `recording` of some keys, from about 1000 timesteps in all.
+    '''
+
+    if recording is not None and engine not in ('bounded', 'lean', 'pool', 'dask'):
+        raise ValueError(f"recording is supported by the bounded, lean, pool and dask engines, not {engine}")
+    if parquet_directory is not None and engine not in ('bounded', 'lean', 'pool'):
+        raise ValueError(f"parquet_directory is supported by the bounded, lean and pool engines, not {engine}")
+    if (checkpoint_directory is not None or warm_up_timesteps is not None) and engine not in ('bounded', 'lean'):
+        raise ValueError(f"checkpoint_directory and warm_up_timesteps are supported by the bounded and lean engines, not {engine}")
+    if checkpoint_directory is not None and warm_up_timesteps is not None:
+        raise ValueError("checkpoint_directory and warm_up_timesteps can't be combined")
+    if stop_conditions is not None and engine == 'radcad':
+        raise ValueError("stop_conditions are supported by the bounded, lean, pool and dask engines, not radcad")
+    if compile_blocks and (engine not in ('lean', 'pool') or warm_up_timesteps is not None):
+        raise ValueError(f"compile_blocks is supported by the lean and pool engines without warm_up_timesteps, not {engine}")
+    stop_conditions = stop_conditions or ()
 
     if save_logs:
         configure_logging(output_directory + '/logs', now)
@@ -58,27 +104,68 @@ def run_experiment(results_id=None, output_directory=None, experiment_metrics=No
         logging.debug(experiment_metrics)
         logging.info(pprint.pformat(params))
 
-        # Run cadCAD simulation
-        model = Model(
-            initial_state=state_variables,
-            state_update_blocks=partial_state_update_blocks,
-            params=params
-        )
-        simulation = Simulation(model=model, timesteps=timesteps, runs=runs)
-        experiment = Experiment([simulation])
-        experiment.engine = Engine(
-            backend=Backend.PATHOS,
-            raise_exceptions=False,
-            deepcopy=False,
-            processes=8,
-            drop_substeps=True,
-        )
+        sink = None if parquet_directory is None else ParquetSink(parquet_directory)
+        record = True if recording is None else recording
+        if engine == 'dask':
+            # Imported here, so that the other engines don't need dask
+            from distributed import Client, LocalCluster
+            import experiments.system_model_v3.dask_backend as dask_backend
+
+            cluster = LocalCluster(threads_per_worker=1) if dask_address is None else None
+            try:
+                with Client(dask_address or cluster) as client:
+                    frames, exceptions = dask_backend.run(client, initial_state, state_update_blocks, params, timesteps, runs,
+                                                          raise_exceptions, record=record, stop_conditions=stop_conditions)
+            finally:
+                if cluster is not None:
+                    cluster.close()
+            results = pd.concat(frames, ignore_index=True)
+        elif engine == 'pool':
+            with WorkerPool(initial_state, state_update_blocks, params, compile_blocks=compile_blocks) as pool:
+                results, exceptions = pool.run(timesteps, runs, raise_exceptions, record=record, sink=sink,
+                                               expected_cost=expected_cost, stop_conditions=stop_conditions)
+        elif engine in ('bounded', 'lean'):
+            single_process_engine = bounded_engine if engine == 'bounded' else lean_engine
+            if warm_up_timesteps is not None:
+                results, exceptions = warm_up.run(initial_state, state_update_blocks, params, timesteps, warm_up_timesteps, runs,
+                                                  raise_exceptions, record=record, sink=sink, single_run=single_process_engine.single_run,
+                                                  stop_conditions=stop_conditions)
+            else:
+                checkpoint = None if checkpoint_directory is None else Checkpointer(checkpoint_directory)
+                if compile_blocks:
+                    results, exceptions = lean_engine.run(initial_state, state_update_blocks, params, timesteps, runs,
+                                                          raise_exceptions, record=record, sink=sink, checkpoint=checkpoint,
+                                                          stop_conditions=stop_conditions, compile_blocks=True)
+                else:
+                    results, exceptions = single_process_engine.run(initial_state, state_update_blocks, params, timesteps, runs,
+                                                                     raise_exceptions, record=record, sink=sink, checkpoint=checkpoint,
+                                                                     stop_conditions=stop_conditions)
+        else:
+            # Run cadCAD simulation
+            model = Model(
+                initial_state=state_variables,
+                state_update_blocks=partial_state_update_blocks,
+                params=params
+            )
+            simulation = Simulation(model=model, timesteps=timesteps, runs=runs)
+            radcad_experiment = Experiment([simulation])
+            radcad_experiment.engine = Engine(
+                backend=Backend.PATHOS,
+                raise_exceptions=raise_exceptions,
+                deepcopy=False,
+                processes=os.cpu_count(),
+                drop_substeps=True,
+            )
+            radcad_experiment.run()
+            results, exceptions = radcad_experiment.results, radcad_experiment.exceptions
+
+        if sink is not None:
+            sink.write_exceptions(exceptions)
+        experiment = SimpleNamespace(results=results, exceptions=exceptions)
         if save_file:
-            experiment.after_experiment = lambda experiment: save_to_HDF5(experiment,
-                    output_directory + '/experiment_results.hdf5', results_id, now)
-        experiment.run()
-        
-        exceptions = pd.DataFrame(experiment.exceptions)
+            save_to_HDF5(experiment, output_directory + '/experiment_results.hdf5', results_id, now)
+
+        exceptions = pd.DataFrame(exceptions)
         
         logging.debug(exceptions)
         #print(exceptions)
@@ -88,11 +175,11 @@ def run_experiment(results_id=None, output_directory=None, experiment_metrics=No
         experiment_time = end - start
         logging.info(f"Experiment completed in {experiment_time} seconds")
 
-        #update_experiment_run_log(output_directory, passed, results_id, hash, exceptions, experiment_metrics, experiment_time, now)
-        return pd.DataFrame(experiment.results)
+        #update_experiment_run_log(output_directory, passed, results_id, git_hash(), exceptions, experiment_metrics, experiment_time, now)
+        return pd.DataFrame(results)
     except AssertionError as e:
         pass
         #logging.info("Experiment failed")
         #logging.error(e)
 
-        #update_experiment_run_log(output_directory, passed, results_id, hash, exceptions, experiment_metrics, experiment_time, now)
+        #update_experiment_run_log(output_directory, passed, results_id, git_hash(), exceptions, experiment_metrics, experiment_time, now)
@@ -0,0 +1,140 @@
+"""
+Declarative conditions that stop a run early, checked by the bounded and lean engines at the end of every timestep.
+
+For example, stopping runs on the model's failure modes, on an absurd redemption rate,
+or when the market price TWAP stays more than 50% from the redemption price for a day:
+
+    stop_conditions = [
+        OnException(failure.NegativeBalanceException, failure.ControllerTargetOverflowException),
+        OutOfBounds(redemption_apy, -99, 1e4),
+        OutOfBounds('target_price', 0.01, 100),
+        Diverges('market_price_twap', 'target_price', 0.5, 24),
+    ]
+
+A stopped run ends with a RunStopped exception in the experiment's exceptions,
+with the reason, the timestep and the state at the end of the last timestep.
+
+The stop conditions are shared by the runs, so what a condition keeps between timesteps, e.g. the streak of Diverges,
+is kept in the run's stop memory, which is saved with its checkpoints and forked from its warm-up.
+"""
+
+from models.system_model_v3.model.parts.block_compiler import state_reads
+from models.system_model_v3.model.parts.utils import target_rate_to_apy
+
+import inspect
+import math
+
+
+class RunStopped(Exception):
+    '''
+    A run stopped by a stop condition in `timestep`, with the `state` at the end of the last complete timestep
+    '''
+    def __init__(self, reason, timestep, state):
+        super().__init__(reason, timestep, state)
+        self.reason = reason
+        self.timestep = timestep
+        self.state = state
+
+    def __str__(self):
+        return f'{self.reason} at timestep {self.timestep}'
+
+    def __repr__(self):
+        # Without the state, e.g. for the exceptions of a ParquetSink
+        return f'{type(self).__name__}({self.reason!r}, {self.timestep})'
+
+
+class StopCondition():
+    '''
+    A condition stopping a run when one of its `exceptions` is raised,
+    or at the end of a timestep when `reason(state, memory)` isn't None,
+    with `memory` a dict the condition keeps between the timesteps of a run, empty at its start
+    '''
+    exceptions = ()
+
+    def reason(self, state, memory):
+        return None
+
+    def state_keys(self):
+        '''
+        The state keys read by `reason()`, or None if they can't be determined
+        '''
+        return set()
+
+
+class OnException(StopCondition):
+    '''
+    Stop the run when a policy or state update raises one of the `exceptions`, e.g. failure_modes.NegativeBalanceException
+    '''
+    def __init__(self, *exceptions):
+        self.exceptions = exceptions
+
+
+class OutOfBounds(StopCondition):
+    '''
+    Stop the run when the state `key` (or a function of the state) is outside [lower, upper], or NaN
+    '''
+    def __init__(self, key, lower=-math.inf, upper=math.inf):
+        self.key = key
+        self.lower = lower
+        self.upper = upper
+
+    def reason(self, state, memory):
+        value = self.key(state) if callable(self.key) else state[self.key]
+        if not self.lower <= value <= self.upper:
+            name = getattr(self.key, '__name__', self.key)
+            return f'{name} {value} outside [{self.lower}, {self.upper}]'
+        return None
+
+    def state_keys(self):
+        if callable(self.key):
+            return state_reads(self.key, next(iter(inspect.signature(self.key).parameters)))
+        return {self.key}
+
+
+class Diverges(StopCondition):
+    '''
+    Stop the run when the state `key` differs from the state `reference` by more than `tolerance` (relative to the reference)
+    for `timesteps` timesteps in a row, counted from the start of the run, including before it was resumed from a checkpoint or warm-up
+    '''
+    def __init__(self, key, reference, tolerance, timesteps=1):
+        self.key = key
+        self.reference = reference
+        self.tolerance = tolerance
+        self.timesteps = timesteps
+
+    def reason(self, state, memory):
+        value, reference = state[self.key], state[self.reference]
+        if abs(value - reference) > self.tolerance * abs(reference):
+            memory['diverged'] = memory.get('diverged', 0) + 1
+        else:
+            memory['diverged'] = 0
+        if memory['diverged'] >= self.timesteps:
+            return f'{self.key} diverged from {self.reference} by more than {self.tolerance:.0%} for {memory["diverged"]} timesteps'
+        return None
+
+    def state_keys(self):
+        return {self.key, self.reference}
+
+
+def redemption_apy(state):
+    '''
+    The redemption rate as an APY in percent, for OutOfBounds()
+    '''
+    return target_rate_to_apy(state['target_rate'])
+
+def stop_exceptions(stop_conditions):
+    '''
+    The exceptions that stop a run rather than fail it
+    '''
+    return tuple(exception for condition in stop_conditions for exception in condition.exceptions)
+
+def stop_reason(stop_conditions, state, stop_memory):
+    '''
+    The reason of the first stop condition met by the state at the end of a timestep, or None,
+    with `stop_memory` the run's memory of each condition by its index, a dict that starts empty
+    '''
+    for index, condition in enumerate(stop_conditions):
+        reason = condition.reason(state, stop_memory.setdefault(index, {}))
+        if reason is not None:
+            return reason
+    return None
@@ -0,0 +1,172 @@
+"""
+Parameter sweeps that simulate a warm-up shared by several parameter subsets once, and fork the subsets from it.
+
+The warm-up of a run is simulated with the parameters of one subset, recording the parameter keys read.
+The other subsets of the run that only differ in keys that weren't read (e.g. the controller's `ki`, `kd` and `control_period`
+before `enable_controller_time`) would simulate the same warm-up, so they continue from a copy of its final state.
+The v3 model reads `kp` (CDP rebalancing) and `alpha` (the leaky error integral) on every timestep,
+so sweeps of those don't share a warm-up.
+The warm-up is simulated as the first subset of the group, so the forked subsets share its random draws (see random_stream() in
+models/system_model_v3/model/parts/utils.py) until the end of the warm-up, and then draw with their own subset.
+Their results differ from runs without a warm-up by those draws only.
+The global random states aren't forked, and apart from random_stream() policies and state updates must not read the state's `subset`.
+"""
+
+from experiments.system_model_v3.engine import generate_parameter_sweep, run_job, exception_record
+from experiments.system_model_v3.lean_engine import single_run as lean_single_run
+from models.system_model_v3.model.parts.state_history import StateHistory
+
+from collections import deque
+import copy
+import logging
+
+
+class TracedParams(dict):
+    '''
+    A parameter subset that records the keys read, where iterating over it reads every key
+    '''
+    def __init__(self, params):
+        super().__init__(params)
+        self.reads = set()
+
+    def __getitem__(self, key):
+        self.reads.add(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.reads.add(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self.reads.add(key)
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self.reads.update(super().keys())
+        return super().__iter__()
+
+    def keys(self):
+        self.reads.update(super().keys())
+        return super().keys()
+
+    def values(self):
+        self.reads.update(super().keys())
+        return super().values()
+
+    def items(self):
+        self.reads.update(super().keys())
+        return super().items()
+
+    def copy(self):
+        self.reads.update(super().keys())
+        return dict(self)
+
+def _same_value(a, b):
+    if a is b:
+        return True
+    try:
+        return type(a) == type(b) and bool(a == b)
+    except (TypeError, ValueError):
+        # e.g. arrays and DataFrames, which are only the same value if they are the same object
+        return False
+
+def shares_warm_up(param_set, other_param_set, reads):
+    '''
+    Whether `other_param_set` has the same values as `param_set` (or neither has the key) for the keys read during its warm-up
+    '''
+    return all((key in param_set) == (key in other_param_set)
+               and (key not in param_set or _same_value(param_set[key], other_param_set[key])) for key in reads)
+
+
+class WarmUp():
+    '''
+    A run at the end of its warm-up, saved and restored through the engines' checkpoint interface (see checkpoint.py)
+    '''
+    def __init__(self):
+        self.saved = None
+        self.subset = None
+
+    def run_checkpoint(self, simulation, subset, run):
+        self.subset = subset
+        return self
+
+    def due(self, timestep, timesteps):
+        # Only the end of the warm-up is saved, not the end of the runs forked from it
+        return self.saved is None and timestep == timesteps
+
+    def save(self, timestep, state_history, state_recorder, stop_memory):
+        window = copy.deepcopy(state_recorder.window)
+        self.saved = (timestep, state_history, window, state_recorder.last_state, list(state_recorder.results),
+                      copy.deepcopy(stop_memory))
+
+    def _fork_state(self, state):
+        return None if state is None else dict(state, subset=self.subset)
+
+    def load(self, state_recorder):
+        '''
+        Restore a copy of the warm-up into the run of `self.subset`, returning the (timestep, state_history, stop_memory)
+        to continue from, or None while the warm-up is simulated
+        '''
+        if self.saved is None:
+            return None
+        timestep, state_history, window, last_state, results, stop_memory = self.saved
+        forked_history = StateHistory([self._fork_state(state) for state in state_history.initial_substates], state_history.depth)
+        forked_history.recent = deque(([self._fork_state(state) for state in substates] for substates in state_history.recent),
+                                      state_history.depth)
+        forked_history.length = state_history.length
+
+        state_recorder.results.extend(self._fork_state(row) for row in results)
+        state_recorder.window = copy.deepcopy(window)
+        state_recorder.last_state = self._fork_state(last_state)
+        return timestep, forked_history, copy.deepcopy(stop_memory)
+
+
+def run(initial_state, state_update_blocks, params, timesteps, warm_up_timesteps, runs=1, raise_exceptions=False,
+        record=True, sink=None, single_run=lean_single_run, stop_conditions=()):
+    '''
+    Run all parameter subsets and Monte Carlo runs of a simulation as engine.run(),
+    simulating the first `warm_up_timesteps` once for each group of subsets that share them
+    '''
+    results = []
+    exceptions = []
+    param_sweep = generate_parameter_sweep(params)
+    warm_up_timesteps = min(warm_up_timesteps, timesteps)
+    simulated_warm_ups = 0
+    for run_index in range(runs):
+        run_results = {}
+        run_exceptions = {}
+        remaining = list(range(len(param_sweep)))
+        while remaining:
+            subset_index = remaining[0]
+            traced_params = TracedParams(param_sweep[subset_index])
+            warm_up = WarmUp()
+            _, exception, _ = run_job(single_run, warm_up_timesteps, run_index, subset_index, initial_state,
+                                      state_update_blocks, traced_params, record, warm_up, stop_conditions)
+            simulated_warm_ups += 1
+            if exception is None:
+                group = [index for index in remaining
+                         if shares_warm_up(param_sweep[subset_index], param_sweep[index], traced_params.reads)]
+            else:
+                # The subsets are run without a warm-up, to report their own exceptions or stop conditions
+                group = [subset_index]
+                warm_up = None
+
+            for index in group:
+                remaining.remove(index)
+                subset_results, exception, trace = run_job(single_run, timesteps, run_index, index, initial_state,
+                                                           state_update_blocks, param_sweep[index], record, warm_up,
+                                                           stop_conditions)
+                run_exceptions[index] = exception_record(exception, trace, run_index, index, timesteps, param_sweep[index],
+                                                         initial_state, raise_exceptions)
+                if sink is None:
+                    run_results[index] = subset_results
+                else:
+                    sink.write(subset_results)
+
+        for index in range(len(param_sweep)):
+            results.extend(run_results.get(index, []))
+            exceptions.append(run_exceptions[index])
+
+    logging.info(f'Simulated {simulated_warm_ups} warm-ups of {warm_up_timesteps} timesteps '
+                 f'for {runs * len(param_sweep)} runs of {timesteps} timesteps')
+    return results, exceptions
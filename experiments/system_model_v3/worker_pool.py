@@ -0,0 +1,111 @@
+"""
+A pool of persistent worker processes running the (subset, run) jobs of experiments.
+
+The workers are forked with the model (initial state, blocks and parameter sweep) once,
+so jobs only send their subset and run index, and each worker loads the exogenous data once.
+Jobs are taken from a shared queue in order of decreasing expected cost, so that long runs don't finish last on one worker,
+and the pool reports how much of the experiment each worker spent running jobs.
+"""
+
+from experiments.system_model_v3.engine import generate_parameter_sweep, run_job, exception_record
+from experiments.system_model_v3.lean_engine import live_keys, single_run as lean_single_run
+from models.system_model_v3.model.parts.block_compiler import compile_blocks as _compile_blocks
+
+import logging
+import multiprocessing
+import os
+import time
+
+
+# The model of the worker process, set by _init_worker()
+_worker = {}
+
+def _init_worker(initial_state, state_update_blocks, param_sweep, single_run, compile_blocks):
+    _worker.update(initial_state=initial_state, state_update_blocks=state_update_blocks,
+                   param_sweep=param_sweep, single_run=single_run, compile_blocks=compile_blocks, compiled_blocks={})
+
+def _worker_blocks(record, stop_conditions):
+    # The blocks, compiled once per worker for the keys the jobs record, see lean_engine.run()
+    if not _worker['compile_blocks']:
+        return _worker['state_update_blocks']
+    keys = live_keys(record, stop_conditions)
+    keys = None if keys is None else frozenset(keys)
+    if keys not in _worker['compiled_blocks']:
+        _worker['compiled_blocks'][keys] = _compile_blocks(_worker['state_update_blocks'], _worker['initial_state'], keys)
+    return _worker['compiled_blocks'][keys]
+
+def _run_job(job):
+    subset, run, timesteps, record, stop_conditions = job
+    start = time.time()
+    results, exception, trace = run_job(_worker['single_run'], timesteps, run, subset, _worker['initial_state'],
+                                        _worker_blocks(record, stop_conditions), _worker['param_sweep'][subset], record,
+                                        stop_conditions=stop_conditions, picklable=True)
+    return subset, run, results, exception, trace, os.getpid(), start, time.time()
+
+def job_order(param_sweep, runs, expected_cost=None):
+    '''
+    The (subset, run) jobs, longest expected first for an `expected_cost(param_set, run)`, otherwise in sweep order
+    '''
+    jobs = [(subset, run) for run in range(runs) for subset in range(len(param_sweep))]
+    if expected_cost is None:
+        return jobs
+    return sorted(jobs, key=lambda job: -expected_cost(param_sweep[job[0]], job[1]))
+
+
+class WorkerPool():
+    '''
+    Persistent worker processes for the model, `processes` of them or one per CPU,
+    running each job with `single_run` (e.g. engine.single_run, by default lean_engine.single_run),
+    and with `compile_blocks` on the blocks compiled into fewer substeps, see lean_engine.run().
+
+    The workers are forked, so the model isn't pickled, which isn't supported where processes can't be forked (Windows).
+    '''
+    def __init__(self, initial_state, state_update_blocks, params, processes=None, single_run=lean_single_run, compile_blocks=False):
+        self.processes = processes or os.cpu_count()
+        self.param_sweep = generate_parameter_sweep(params)
+        self.initial_state = initial_state
+        self.utilisation = {}
+        self.pool = multiprocessing.get_context('fork').Pool(
+            self.processes, initializer=_init_worker,
+            initargs=(initial_state, state_update_blocks, self.param_sweep, single_run, compile_blocks))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def run(self, timesteps, runs=1, raise_exceptions=False, record=True, sink=None, expected_cost=None, chunksize=1,
+            stop_conditions=()):
+        '''
+        Run all parameter subsets and Monte Carlo runs, returning the results and exceptions in the order of engine.run().
+        With a `sink` the results of each run are passed to `sink.write()` as they complete instead of being returned.
+        `self.utilisation` is then the fraction of the time each worker that ran jobs spent running them.
+        With `stop_conditions`, runs stop early with a RunStopped exception, see engine.single_run().
+        '''
+        jobs = [(subset, run, timesteps, record, stop_conditions) for subset, run in job_order(self.param_sweep, runs, expected_cost)]
+        results = {}
+        exceptions = {}
+        busy = {}
+        start = time.time()
+        for subset, run, run_results, exception, trace, worker, job_start, job_end in \
+                self.pool.imap_unordered(_run_job, jobs, chunksize):
+            exceptions[(run, subset)] = exception_record(exception, trace, run, subset, timesteps, self.param_sweep[subset],
+                                                         self.initial_state, raise_exceptions)
+            if sink is None:
+                results[(run, subset)] = run_results
+            else:
+                sink.write(run_results)
+            busy[worker] = busy.get(worker, 0) + job_end - job_start
+        elapsed = time.time() - start
+
+        self.utilisation = {worker: worker_busy / elapsed for worker, worker_busy in busy.items()}
+        logging.info(f'Ran {len(jobs)} jobs in {elapsed:.1f} seconds on {self.processes} workers, '
+                     f'{sum(busy.values()) / (elapsed * self.processes):.0%} utilisation: '
+                     + ', '.join(f'{worker}: {utilisation:.0%}' for worker, utilisation in sorted(self.utilisation.items())))
+        return ([row for key in sorted(results) for row in results[key]],
+                [exceptions[key] for key in sorted(exceptions)])
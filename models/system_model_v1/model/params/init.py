@@ -29,5 +29,6 @@ params = {
     options.IntegralType.__name__: [options.IntegralType.LEAKY.value],
     options.MarketPriceSource.__name__: [options.MarketPriceSource.DEFAULT.value],
     'controller_enabled': [True],
-    'delta_output': [lambda state, timestep: 0]
+    'delta_output': [lambda state, timestep: 0],
+    'rng_seed': [0], # seed of the random number streams, see models/utils/random_streams.py
 }
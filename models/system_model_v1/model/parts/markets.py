@@ -3,6 +3,7 @@ import datetime as dt
 import numpy as np
 
 import models.options as options
+from models.utils.random_streams import generator
 
 
 def resolve_time_passed(params, substep, state_history, state):
@@ -15,7 +16,7 @@ def resolve_time_passed(params, substep, state_history, state):
     else:
         offset = params['minumum_control_period'](state['timestep'])
         expected_lag = params['expected_control_delay'](state['timestep'])
-        seconds = int(sts.expon.rvs(loc=offset, scale=expected_lag, random_state=np.random.RandomState(seed=int(f'{state["run"]}' + f'{state["timestep"]}'))))
+        seconds = int(sts.expon.rvs(loc=offset, scale=expected_lag, random_state=generator(params['rng_seed'], state['subset'], state['run'], 'time_process', state['timestep'])))
 
     return {'seconds_passed': seconds}
 
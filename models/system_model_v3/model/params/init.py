@@ -1,12 +1,9 @@
-import numpy as np
-import pandas as pd
-
 import models.options as options
 from models.constants import SPY, RAY
 
 from models.system_model_v3.model.state_variables.system import stability_fee
-from models.system_model_v3.model.state_variables.historical_state import eth_price_df
-from models.system_model_v3.model.state_variables.historical_state import liquidity_demand_pct_df, token_swap_pct_df
+import models.system_model_v3.model.state_variables.historical_state as historical_state
+from models.system_model_v3.model.parts.exogenous import exogenous_series
 
 
 '''
@@ -18,16 +15,17 @@ params = {
     'debug': [False], # Print debug messages (see APT model)
     'raise_on_assert': [True], # See assert_log() in utils.py
     'free_memory_states': [['events', 'uniswap_oracle']],
+    'rng_seed': [0], # Seed of the random number streams, see models/utils/random_streams.py
 
     # Configuration options
     options.IntegralType.__name__: [options.IntegralType.LEAKY.value],
 
     # Exogenous states, loaded as parameter at every timestep - these are lambda functions, and have to be called
     'eth_trend': [0],
-    'eth_price': [lambda run, timestep, trend, df=eth_price_df: 
-                  df[str(run-1)].iloc[timestep] + (timestep/len(df[str(run-1)]) * (trend * df[str(run-1)].iloc[-1]))],
-    'liquidity_demand_pct_events': [lambda run, timestep, df=liquidity_demand_pct_df: df[str(run-1)].iloc[timestep]],
-    'token_swap_pct_events': [lambda run, timestep, df=token_swap_pct_df: df[str(run-1)].iloc[timestep]],
+    # ETH price series, plus a linear trend of `eth_trend` times the final ETH price
+    'eth_price': [exogenous_series(historical_state.__name__, 'eth_price_df')],
+    'liquidity_demand_pct_events': [exogenous_series(historical_state.__name__, 'liquidity_demand_pct_df')],
+    'token_swap_pct_events': [exogenous_series(historical_state.__name__, 'token_swap_pct_df')],
     'seconds_passed': [lambda timestep, df=None: 3600],
     
     'liquidity_demand_enabled': [False],
@@ -53,6 +51,8 @@ params = {
     # APT model
     'arbitrageur_considers_liquidation_ratio': [True],
     'interest_rate': [1.03], # Real-world expected interest rate, for determining profitable arbitrage opportunities
+    'apt_moments_window': [None], # Number of previous timesteps in the ETH and market price means, or None for all of them
+    'apt_moments_alpha': [None], # Smoothing factor for exponentially weighted ETH and market price means, or None
     
 
     # APT OLS model
@@ -97,6 +97,7 @@ params = {
     'price_trader_mean_pct': [5],
     'price_trader_min_pct': [2],
     'price_trader_std_pct': [2 * (5-2)],
+    'price_trader_random_order': [False], # Trade the price traders one by one in random order instead of together in order of their bounds
 
     #malicous pricing fixing whale parameters
     'malicious_whale_pump_percent': [1.05], #pump the price by 5%
@@ -118,3 +119,10 @@ params = {
     'rai_lender_max_APY_diff': [5]
 
 }
+
+
+def __getattr__(name):
+    # The exogenous DataFrames, e.g. `from models.system_model_v3.model.params.init import eth_price_df`, are loaded on first access
+    if name in historical_state.data_files:
+        return getattr(historical_state, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
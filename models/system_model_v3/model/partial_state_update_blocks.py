@@ -18,9 +18,9 @@ from .parts.moneymarket_agents import p_rai_lender, s_store_rai_lender_state, p_
 partial_state_update_blocks_unprocessed = [
     {
         'enabled': True,
+        'history': 2, # number of previous timesteps read from state_history by the block, see parts/state_history.py
         'policies': {
             'free_memory': p_free_memory,
-            'random_seed': init.initialize_seed,
         },
         'variables': {
             'target_price': init.initialize_target_price,
@@ -32,6 +32,7 @@ partial_state_update_blocks_unprocessed = [
             This block observes (or samples from data) the amount of time passed between events
         ''',
         'enabled': True,
+        'history': 0,
         'policies': {
             'time_process': resolve_time_passed
         },
@@ -47,6 +48,7 @@ partial_state_update_blocks_unprocessed = [
             Exogenous ETH price process
         ''',
         'enabled': True,
+        'history': 1,
         'policies': {
             'exogenous_eth_process': p_resolve_eth_price,
         },
@@ -57,11 +59,28 @@ partial_state_update_blocks_unprocessed = [
         }
     },
     #################################################################
+    {
+        'details': '''
+            APT model: expected market price, from the running means of the ETH and market prices
+        ''',
+        'enabled': False,
+        'history': 1,
+        'policies': {
+            'expected_market_price': p_resolve_expected_market_price,
+        },
+        'variables': {
+            'expected_market_price': s_store_expected_market_price,
+            'eth_price_moments': s_store_eth_price_moments,
+            'market_price_moments': s_store_market_price_moments,
+        }
+    },
+    #################################################################
     {   
         'details': '''
             Exogenous u,v activity: liquidate CDPs
         ''',
         'enabled': False,
+        'history': 0,
         'policies': {
             'liquidate_cdps': p_liquidate_cdps
         },
@@ -75,6 +94,7 @@ partial_state_update_blocks_unprocessed = [
             Exogenous liquidity demand process
         ''',
         'enabled': False,
+        'history': 0,
         'policies': {
             'liquidity_demand': markets.p_liquidity_demand
         },
@@ -93,6 +113,7 @@ partial_state_update_blocks_unprocessed = [
             General Agents 
         """,
         'enabled': False,
+        'history': 0,
         'policies': {
             'trade_rate': p_trade_rate
         },
@@ -110,6 +131,7 @@ partial_state_update_blocks_unprocessed = [
         Rebalance CDPs using wipes and draws 
         """,
         'enabled': True,
+        'history': 0,
         'policies': {
             'rebalance_cdps': p_rebalance_cdps,
         },
@@ -126,6 +148,7 @@ partial_state_update_blocks_unprocessed = [
             rate trading model
         """,
         'enabled': True,
+        'history': 0,
         'policies': {
             'trade_rate': p_trade_rate
         },
@@ -143,6 +166,7 @@ partial_state_update_blocks_unprocessed = [
             price trading model
         """,
         'enabled': False,
+        'history': 0,
         'policies': {
             'trade_price': p_trade_price
         },
@@ -159,6 +183,7 @@ partial_state_update_blocks_unprocessed = [
             Malicius whale agent
         """,
         'enabled': False,
+        'history': 0,
         'policies': {
             'arbitrage': p_constant_price_agent
         },
@@ -177,6 +202,7 @@ partial_state_update_blocks_unprocessed = [
             RAI Borrower
         """,
         'enabled': False,
+        'history': 0,
         'policies': {
             'arbitrage': p_rai_borrower,
         },
@@ -192,6 +218,7 @@ partial_state_update_blocks_unprocessed = [
             RAI Lender
         """,
         'enabled': False,
+        'history': 0,
         'policies': {
             'arbitrage': p_rai_lender
         },
@@ -207,6 +234,7 @@ partial_state_update_blocks_unprocessed = [
             Base rate trader
         """,
         'enabled': False,
+        'history': 0,
         'policies': {
             'arbitrage': p_base_rate_trader
         },
@@ -222,6 +250,7 @@ partial_state_update_blocks_unprocessed = [
             Malicious RAI Trader External Funding
         """,
         'enabled': False,
+        'history': 0,
         'policies': {
             'arbitrage': p_malicious_rai_trader_external_funding
         },
@@ -238,6 +267,7 @@ partial_state_update_blocks_unprocessed = [
             eth leverager
         """,
         'enabled': False,
+        'history': 0,
         'policies': {
             'arbitrage': p_leverage_eth
         },
@@ -254,6 +284,7 @@ partial_state_update_blocks_unprocessed = [
             Endogenous w activity
         ''',
         'enabled': True,
+        'history': 0,
         'policies': {},
         'variables': {
             'accrued_interest': s_update_accrued_interest,
@@ -266,6 +297,7 @@ partial_state_update_blocks_unprocessed = [
         Get all spot market prices 
         """,
         'enabled': True,
+        'history': 0,
         'policies': {
             'spot_market_price': markets.p_spot_market_price
         },
@@ -279,6 +311,7 @@ partial_state_update_blocks_unprocessed = [
         Update Chainlink feed 
         """,
         'enabled': True,
+        'history': 0,
         'policies': {
             'market_price': markets.p_market_price
         },
@@ -293,6 +326,7 @@ partial_state_update_blocks_unprocessed = [
         Update Chainlink TWAP
         """,
         'enabled': True,
+        'history': 0,
         'policies': {
             'market_price_twap': markets.p_market_price_twap
         },
@@ -308,6 +342,7 @@ partial_state_update_blocks_unprocessed = [
         required to compute the various control actions
         """,
         'enabled': True,
+        'history': 4,
         'policies': {
             'observe': observe_errors
         },
@@ -323,6 +358,7 @@ partial_state_update_blocks_unprocessed = [
         This block computes the stability control action 
         """,
         'enabled': True,
+        'history': 0,
         'policies': {
             'governance': p_enable_controller,
         },
@@ -336,6 +372,7 @@ partial_state_update_blocks_unprocessed = [
         This block updates the target price based on stability control action 
         """,
         'enabled': True,
+        'history': 0,
         'policies': {},
         'variables': {
             'target_price': update_target_price,
@@ -347,6 +384,7 @@ partial_state_update_blocks_unprocessed = [
            Aggregate interest activity
         """,
         'enabled': True,
+        'history': 1,
         'policies': {},
         'variables': {
             'w_1': s_aggregate_w_1,
@@ -360,6 +398,7 @@ partial_state_update_blocks_unprocessed = [
             Update debt market state
         ''',
         'enabled': True,
+        'history': 0,
         'policies': {},
         'variables': {
             'eth_collateral': s_update_eth_collateral,
@@ -373,6 +412,7 @@ partial_state_update_blocks_unprocessed = [
             Aggregate states
         ''',
         'enabled': True,
+        'history': 0,
         'policies': {},
         'variables': {
             'eth_locked': s_update_eth_locked,
@@ -391,6 +431,7 @@ partial_state_update_blocks_unprocessed = [
             Update cdp metrics 
         ''',
         'enabled': True,
+        'history': 0,
         'policies': {},
         'variables': {
             'cdp_metrics': s_update_cdp_metrics,
@@ -2,8 +2,6 @@ import math
 import numpy as np
 import time
 import logging
-import pandas as pd
-import statistics
 
 """Arbitrage pricing theory (APT) Model created by BlockScience"""
 
@@ -12,7 +10,7 @@ from .debt_market import open_cdp_draw, open_cdp_lock, draw_to_liquidation_ratio
 from .uniswap import get_output_price, get_input_price
 import models.system_model_v3.model.parts.failure_modes as failure
 from models.system_model_v3.model.parts.debt_market import open_cdp_lock
-import models.system_model_v3.model.state_variables.liquidity as liquidity
+from models.system_model_v3.model.parts.running_moments import RunningMoments
 
 def p_resolve_expected_market_price(params, substep, state_history, state):
     '''
@@ -34,12 +32,11 @@ def p_resolve_expected_market_price(params, substep, state_history, state):
         logging.exception(e)
         eth_price = state['eth_price']
 
-    # Mean and Rate Parameters
-    eth_price_data = [state[-1]['eth_price'] for state in state_history]
-    eth_price_mean = statistics.mean(eth_price_data) # mean value from stochastic process of ETH price
-
-    market_price_data = [state[-1]['market_price'] for state in state_history]
-    market_price_mean = statistics.mean(market_price_data)
+    # Mean and Rate Parameters, over the final states of previous timesteps (see update_price_moments)
+    eth_price_moments = update_price_moments(params, state_history, state, 'eth_price')
+    market_price_moments = update_price_moments(params, state_history, state, 'market_price')
+    eth_price_mean = eth_price_moments.mean # mean value from stochastic process of ETH price
+    market_price_mean = market_price_moments.mean
 
     # NOTE Convention on liquidity:
     # Liquidity here means the net transfer in or out of RAI tokens in the ETH-RAI pool,
@@ -56,11 +53,31 @@ def p_resolve_expected_market_price(params, substep, state_history, state):
     expected_market_price = market_price * (interest_rate + beta_1 * (eth_price_mean - eth_price * interest_rate)
                         + beta_2 * (liquidity_demand_mean - liquidity_demand * interest_rate))
 
-    return {'expected_market_price': expected_market_price}
+    return {
+        'expected_market_price': expected_market_price,
+        'eth_price_moments': eth_price_moments,
+        'market_price_moments': market_price_moments,
+    }
 
 def s_store_expected_market_price(params, substep, state_history, state, policy_input):
     return 'expected_market_price', policy_input['expected_market_price']
 
+def update_price_moments(params, state_history, state, key):
+    '''
+    Add the final value of `key` in the previous timestep to its running moments.
+    Updated once per timestep by the APT block, so the moments cover the same states as the full state history.
+    '''
+    moments = state[f'{key}_moments']
+    if moments.count == 0:
+        moments = RunningMoments(window=params['apt_moments_window'], alpha=params['apt_moments_alpha'])
+    return moments.update(state_history[-1][-1][key])
+
+def s_store_eth_price_moments(params, substep, state_history, state, policy_input):
+    return 'eth_price_moments', policy_input['eth_price_moments']
+
+def s_store_market_price_moments(params, substep, state_history, state, policy_input):
+    return 'market_price_moments', policy_input['market_price_moments']
+
 def p_arbitrageur_model(params, substep, state_history, state):
     debug = params['debug']
     if debug:
@@ -72,8 +89,8 @@ def p_arbitrageur_model(params, substep, state_history, state):
         'UNI_delta': 0,
     }
 
-    cdps = state['cdps']
-    cdps_copy = cdps.copy()
+    cdps_copy = state['cdps']
+    cdps = cdps_copy.copy()
 
     if state["timestep"] == 1:
         if debug:
@@ -82,8 +99,7 @@ def p_arbitrageur_model(params, substep, state_history, state):
                                     state['target_price'], params['liquidation_ratio']),
                                     'arbitrage': 1,'owner': 'apt_model' }]
 
-        new_apt_cdp = pd.DataFrame(apt_cdp)
-        cdps = pd.concat((cdps, new_apt_cdp), ignore_index=True)
+        cdps.extend(apt_cdp)
 
         if debug:
             cdp_update = validate_updated_cdp_state(cdps, cdps_copy)
@@ -119,8 +135,8 @@ def p_arbitrageur_model(params, substep, state_history, state):
     def g2(RAI_balance, ETH_balance, uniswap_fee, liquidation_ratio, redemption_price):
         return (RAI_balance * ETH_balance * (1 - uniswap_fee) * liquidation_ratio * (redemption_price / eth_price)) ** 0.5
 
-    aggregate_arbitrageur_cdp_index = cdps.query("arbitrage == 1").index[0]
-    aggregate_arbitrageur_cdp = cdps.loc[aggregate_arbitrageur_cdp_index]
+    aggregate_arbitrageur_cdp_index = cdps.select(arbitrage=1)[0]
+    aggregate_arbitrageur_cdp = cdps_copy.cdp(aggregate_arbitrageur_cdp_index)
     
     total_borrowed = aggregate_arbitrageur_cdp['drawn'] - aggregate_arbitrageur_cdp['wiped'] - aggregate_arbitrageur_cdp['u_bitten']
     total_deposited = aggregate_arbitrageur_cdp['locked'] - aggregate_arbitrageur_cdp['freed'] - aggregate_arbitrageur_cdp['v_bitten']
@@ -180,14 +196,11 @@ def p_arbitrageur_model(params, substep, state_history, state):
             if profit > 0:
                 print(f"{state['timestamp']} Performing arb. CDP -> UNI for profit {profit}")
 
-                borrowed = cdps.at[aggregate_arbitrageur_cdp_index, "drawn"]
-                deposited = cdps.at[aggregate_arbitrageur_cdp_index, "locked"]
-
                 if not d_borrow >= 0: raise failure.ArbitrageConditionException(f'{d_borrow=}')
                 if not q_deposit >= 0: raise failure.ArbitrageConditionException(f'{q_deposit=}')
                 
-                cdps.at[aggregate_arbitrageur_cdp_index, "drawn"] = borrowed + d_borrow
-                cdps.at[aggregate_arbitrageur_cdp_index, "locked"] = deposited + q_deposit
+                cdps.draw(aggregate_arbitrageur_cdp_index, d_borrow)
+                cdps.lock(aggregate_arbitrageur_cdp_index, q_deposit)
 
                 RAI_delta = d_borrow
                 if not RAI_delta >= 0: raise failure.ArbitrageConditionException(f'{RAI_delta=}')
@@ -220,9 +233,6 @@ def p_arbitrageur_model(params, substep, state_history, state):
         if profit > 0:
             print(f"{state['timestamp']} Performing arb. UNI -> CDP for profit {profit}")
 
-            repayed = cdps.at[aggregate_arbitrageur_cdp_index, "wiped"]
-            withdrawn = cdps.at[aggregate_arbitrageur_cdp_index, "freed"]
-
             if not q_withdraw <= total_deposited: raise failure.ArbitrageConditionException(
                 f"{d_repay=} {q_withdraw=} {_g2=} {RAI_balance=} {ETH_balance=} {total_borrowed=} {total_deposited=} {z=} {eth_price=} {redemption_price=} {market_price=}"
             )
@@ -233,8 +243,8 @@ def p_arbitrageur_model(params, substep, state_history, state):
             if not d_repay >= 0: raise failure.ArbitrageConditionException(f'{d_repay=}')
             if not q_withdraw >= 0: raise failure.ArbitrageConditionException(f'{q_withdraw=}')
             
-            cdps.at[aggregate_arbitrageur_cdp_index, "wiped"] = repayed + d_repay
-            cdps.at[aggregate_arbitrageur_cdp_index, "freed"] = withdrawn + q_withdraw
+            cdps.wipe(aggregate_arbitrageur_cdp_index, d_repay)
+            cdps.free(aggregate_arbitrageur_cdp_index, q_withdraw)
 
             # Deposit ETH, get RAI
             ETH_delta, _ = get_output_price(d_repay, ETH_balance, RAI_balance, uniswap_fee)
@@ -258,10 +268,10 @@ def p_arbitrageur_model(params, substep, state_history, state):
     return {**cdp_update, **uniswap_state_delta}
 
 def validate_updated_cdp_state(cdps, previous_cdps, raise_on_assert=True):
-    u_1 = cdps["drawn"].sum() - previous_cdps["drawn"].sum()
-    u_2 = cdps["wiped"].sum() - previous_cdps["wiped"].sum()
-    v_1 = cdps["locked"].sum() - previous_cdps["locked"].sum()
-    v_2 = cdps["freed"].sum() - previous_cdps["freed"].sum()
+    u_1 = cdps.total("drawn") - previous_cdps.total("drawn")
+    u_2 = cdps.total("wiped") - previous_cdps.total("wiped")
+    v_1 = cdps.total("locked") - previous_cdps.total("locked")
+    v_2 = cdps.total("freed") - previous_cdps.total("freed")
 
     if not u_1 >= 0: raise failure.InvalidCDPStateException(f'{u_1}')
     if not u_2 >= 0: raise failure.InvalidCDPStateException(f'{u_2}')
@@ -269,14 +279,14 @@ def validate_updated_cdp_state(cdps, previous_cdps, raise_on_assert=True):
     if not v_2 >= 0: raise failure.InvalidCDPStateException(f'{v_2}')
 
     if not approx_greater_equal_zero(
-        cdps["drawn"].sum() - cdps["wiped"].sum() - cdps["u_bitten"].sum(),
+        cdps.total("drawn") - cdps.total("wiped") - cdps.total("u_bitten"),
         abs_tol=1e-2,
-    ): raise failure.InvalidCDPStateException(f'{cdps["drawn"].sum()=} {cdps["wiped"].sum()=} {cdps["u_bitten"].sum()=}')
+    ): raise failure.InvalidCDPStateException(f'{cdps.total("drawn")=} {cdps.total("wiped")=} {cdps.total("u_bitten")=}')
 
     if not approx_greater_equal_zero(
-        cdps["locked"].sum() - cdps["freed"].sum() - cdps["v_bitten"].sum(),
+        cdps.total("locked") - cdps.total("freed") - cdps.total("v_bitten"),
         abs_tol=1e-2,
-    ): raise failure.InvalidCDPStateException(f'{cdps["locked"].sum()=} {cdps["freed"].sum()=} {cdps["v_bitten"].sum()=}')
+    ): raise failure.InvalidCDPStateException(f'{cdps.total("locked")=} {cdps.total("freed")=} {cdps.total("v_bitten")=}')
 
     return {
         "cdps": cdps,
@@ -1,9 +1,19 @@
-from collections import namedtuple, deque
+from collections import namedtuple
 import math
 
+from models.system_model_v3.model.parts.observations import Observations
+
 ChainlinkObservation = namedtuple('ChainlinkObservation', ['timestamp', 'time_adjusted_price', 'price'])
 
 class ChainlinkTWAP():
+    '''
+    Immutable: `update_result()` returns the updated TWAP, sharing the observation buffer with this one,
+    so the TWAP can be stored in the state without copying it.
+    '''
+    __slots__ = ('default_amount_in', 'target_token', 'denomination_token', 'granularity', 'window_size', 'max_window_size',
+                 'last_update_time', 'updates', 'period_size', 'median_price', 'chainlink_observations',
+                 'converter_price_cumulative', 'price_0_cumulative', 'price_1_cumulative', 'link_aggregator_timestamp')
+
     def __init__(self, granularity=3, window_size=24*3600, max_window_size=4*24*3600):
         self.default_amount_in = 1
         self.target_token = 'rai'
@@ -18,7 +28,7 @@ class ChainlinkTWAP():
         self.period_size = window_size / granularity
         self.median_price = 0
         
-        self.chainlink_observations = deque([], granularity)
+        self.chainlink_observations = Observations(granularity)
         self.converter_price_cumulative = 0
 
         self.price_0_cumulative = 0
@@ -38,22 +48,29 @@ class ChainlinkTWAP():
         else:
             return self.updates - int(self.granularity)
 
+    def _replace(self, **changes):
+        twap = ChainlinkTWAP.__new__(ChainlinkTWAP)
+        for key in ChainlinkTWAP.__slots__:
+            setattr(twap, key, changes[key] if key in changes else getattr(self, key))
+        return twap
+
     def update_observations(self, state, time_elapsed_since_latest, new_result):
         now = state['cumulative_time']
         new_time_adjusted_price = new_result * time_elapsed_since_latest
         #print(f"update_obs() {new_result=}, {time_elapsed_since_latest=}, {new_time_adjusted_price=}")
 
-        self.converter_price_cumulative += new_time_adjusted_price
+        converter_price_cumulative = self.converter_price_cumulative + new_time_adjusted_price
 
         #if self.updates >= self.granularity: # if len(self.chainlink_observations) >= self.granularity: ?????
         if len(self.chainlink_observations) >= self.granularity:
             #print(f"update_obs() subtracting {self.chainlink_observations[0].time_adjusted_price}")
-            self.converter_price_cumulative -= self.chainlink_observations[0].time_adjusted_price
-            
-        self.chainlink_observations.append(
+            converter_price_cumulative -= self.chainlink_observations[0].time_adjusted_price
+
+        chainlink_observations = self.chainlink_observations.append(
             ChainlinkObservation(now, new_time_adjusted_price, new_result)
         )
-        #print(f"update_obs() final {self.converter_price_cumulative=}")
+        #print(f"update_obs() final {converter_price_cumulative=}")
+        return chainlink_observations, converter_price_cumulative
 
     def update_result(self, state):
         #print(f"update_result() {state}")
@@ -63,7 +80,7 @@ class ChainlinkTWAP():
         elapsed_time = self.period_size if len(self.chainlink_observations) == 0 else now - self.chainlink_observations[-1].timestamp
         
         if len(self.chainlink_observations) > 0 and not elapsed_time >= self.period_size:
-            return
+            return self
 
         aggregator_result = state['market_price']
         aggregator_timestamp = state['market_price_timestamp']
@@ -74,13 +91,17 @@ class ChainlinkTWAP():
 
         #require(both(aggregatorTimestamp > 0, aggregatorTimestamp > linkAggregatorTimestamp), "ChainlinkTWAP/invalid-timestamp");
         if aggregator_timestamp <= self.link_aggregator_timestamp:
-            return
+            return self
 
         time_since_first = now - self.last_update_time if len(self.chainlink_observations) == 0 else now - self.chainlink_observations[0].timestamp
 
-        self.update_observations(state, elapsed_time, aggregator_result)
+        chainlink_observations, converter_price_cumulative = self.update_observations(state, elapsed_time, aggregator_result)
 
-        self.median_price = self.converter_price_cumulative / time_since_first
-        self.last_update_time = now
-        self.updates += 1
-        self.link_aggregator_timestamp = aggregator_timestamp
+        return self._replace(
+            chainlink_observations=chainlink_observations,
+            converter_price_cumulative=converter_price_cumulative,
+            median_price=converter_price_cumulative / time_since_first,
+            last_update_time=now,
+            updates=self.updates + 1,
+            link_aggregator_timestamp=aggregator_timestamp,
+        )
@@ -9,6 +9,10 @@ def update_target_rated(params, substep, state_history, state, policy_input):
     Calculate the PI controller target rate rate using the Kp, Ki and Kd constants and the error states.
     """
 
+    # The controller parameters aren't read until the controller is enabled
+    if not policy_input["controller_enabled"]:
+        return "target_rate", 0
+
     if state['cumulative_time'] % params['control_period'] == 0:
         error = state["error_star"]  # unit BASE
         prev_error = state["prev_error_star"]  # unit BASE
@@ -16,10 +20,8 @@ def update_target_rated(params, substep, state_history, state, policy_input):
 
         #print(f"adding {params['kp'] * error } to rate")
         target_rate = state['target_rate'] + params["kp"] * error + params["ki"] * error_integral + params["kd"] * (error - prev_error)
-
-        target_rate = target_rate if policy_input["controller_enabled"] else 0  # unitless
     else:
-        target_rate = state['target_rate'] if policy_input["controller_enabled"] else 0
+        target_rate = state['target_rate']
 
     return "target_rate", target_rate
 
@@ -28,6 +30,10 @@ def update_target_rate(params, substep, state_history, state, policy_input):
     Calculate the PI controller target rate using the Kp,  Ki and Kd constants and the error states.
     """
 
+    # The controller parameters aren't read until the controller is enabled
+    if not policy_input["controller_enabled"]:
+        return "target_rate", 0
+
     if state['cumulative_time'] % params['control_period'] == 0:
         error = state["error_star"]  # unit BASE
         prev_error = state["prev_error_star"]  # unit BASE
@@ -36,10 +42,8 @@ def update_target_rate(params, substep, state_history, state, policy_input):
 
         target_rate = params["kp"] * error + params["ki"] * error_integral + params["kd"] * (error - prev_error)
         #print(f"{state['timestep']=}, {error=}, {error_integral=}, {target_rate=}")
-
-        target_rate = target_rate if policy_input["controller_enabled"] else 0  # unitless
     else:
-        target_rate = state['target_rate'] if policy_input["controller_enabled"] else 0
+        target_rate = state['target_rate']
 
     return "target_rate", target_rate
 
@@ -48,6 +52,10 @@ def update_target_rate_step(params, substep, state_history, state, policy_input)
     Calculate the PI controller target rate using the Kp,  Ki and Kd constants and the error states.
     """
 
+    # The controller parameters aren't read until the controller is enabled
+    if not policy_input["controller_enabled"]:
+        return "target_rate", 0
+
     if state['cumulative_time'] % params['control_period'] == 0:
         error = state["error_star"]  # unit BASE
         target_rate = state['target_rate']
@@ -61,10 +69,8 @@ def update_target_rate_step(params, substep, state_history, state, policy_input)
 
         # Bound per second target_rate here to (-100%, 100%)
         target_rate = max(min(target_rate, 2 - 1E-15), -2 + 1E-15)
-
-        target_rate = target_rate if policy_input["controller_enabled"] else 0  # unitless
     else:
-        target_rate = state['target_rate'] if policy_input["controller_enabled"] else 0
+        target_rate = state['target_rate']
 
     return "target_rate", target_rate
 
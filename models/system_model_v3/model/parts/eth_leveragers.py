@@ -1,4 +1,3 @@
-import pandas as pd
 from .utils import target_rate_to_apy
 from .debt_market import is_cdp_above_liquidation_ratio
 from .debt_market import wipe_to_rr_apy, draw_to_rr_apy
@@ -27,24 +26,11 @@ def p_leverage_eth(params, substep, state_history, state):
     if state["timestep"] == 1:
         if debug:
             print("Initializing ETH Leverager")
-        new_cdp = [{
-            'open': 1, # Is the CDP open or closed? True/False == 1/0 for integer/float series
-            'arbitrage': 0,
-            'time': 0, # How long the CDP has been open for
-            'locked': state['eth_leverager_eth_balance'],
-            'drawn': state['eth_leverager_rai_balance'],
-            'wiped': 0.0, # Principal debt wiped
-            'freed': 0.0, # ETH collateral freed
-            'w_wiped': 0.0, # Accrued interest wiped
-            'v_bitten': 0.0, # ETH collateral bitten (liquidated)
-            'u_bitten': 0.0, # Principal debt bitten
-            'w_bitten': 0.0, # Accrued interest bitten
-            'dripped': 0.0, # Total interest accrued
-            'owner': 'leverager' #specifies which agent code controls the cdp
-        }]
-
-        new_cdp = pd.DataFrame(new_cdp)
-        cdps = pd.concat((cdps, new_cdp), ignore_index=True)
+        cdps.open_cdp(
+            'leverager', #specifies which agent code controls the cdp
+            locked=state['eth_leverager_eth_balance'],
+            drawn=state['eth_leverager_rai_balance'],
+        )
 
         return {"cdps": cdps, **uniswap_state_delta}
 
@@ -56,14 +42,15 @@ def p_leverage_eth(params, substep, state_history, state):
 
     rr_apy = target_rate_to_apy(state['target_rate'])
     #operate only cdps that are managed by this agent
-    for index, cdp_at_start in cdps.query("open == 1").query("owner == 'leverager'").iterrows():
+    for index in cdps.select(open=1, owner='leverager'):
         RAI_delta = 0
         ETH_delta = 0
+        cdp = cdps.cdp(index)
         
         #perform actions on the SAFE only if we are above or below the threshold rates
-        above_min = is_cdp_above_liquidation_ratio(cdps.loc[index], eth_price, target_price,
+        above_min = is_cdp_above_liquidation_ratio(cdp, eth_price, target_price,
                 params["eth_leverager_target_min_liquidity_ratio"])
-        above_max = is_cdp_above_liquidation_ratio(cdps.loc[index], eth_price, target_price,
+        above_max = is_cdp_above_liquidation_ratio(cdp, eth_price, target_price,
                 params["eth_leverager_target_max_liquidity_ratio"])
 
         if not above_min or above_max:
@@ -71,15 +58,15 @@ def p_leverage_eth(params, substep, state_history, state):
             preferred_ratio = (params["eth_leverager_target_min_liquidity_ratio"] + \
                                params["eth_leverager_target_max_liquidity_ratio"])/2
 
-            drawn_total = cdps.at[index, "drawn"] - cdps.at[index, "wiped"] - cdps.at[index, "u_bitten"] 
-            locked_total = cdps.at[index, "locked"] - cdps.at[index, "freed"] - cdps.at[index, "v_bitten"]
+            drawn_total = cdp["drawn"] - cdp["wiped"] - cdp["u_bitten"]
+            locked_total = cdp["locked"] - cdp["freed"] - cdp["v_bitten"]
 
             p_uniswap = RAI_balance / ETH_balance
             d_locked = (preferred_ratio * state['target_price'] * drawn_total - locked_total * state['eth_price']) \
                      / (state['eth_price'] - preferred_ratio * state['target_price'] * p_uniswap)
             d_drawn = p_uniswap * d_locked
            
-            cdp_above_liquidation_buffer = is_cdp_above_liquidation_ratio(cdps.loc[index], eth_price,
+            cdp_above_liquidation_buffer = is_cdp_above_liquidation_ratio(cdp, eth_price,
                     target_price, preferred_ratio)
             if not cdp_above_liquidation_buffer and rr_apy > params['min_redemption_rate']:
                 # too low liquidation ratio, pump it higher
@@ -104,8 +91,8 @@ def p_leverage_eth(params, substep, state_history, state):
 
                 if freed <= locked_total and wiped <= drawn_total and wiped < RAI_balance:
 
-                    cdps.at[index, "freed"] = cdps.at[index, "freed"] + freed
-                    cdps.at[index, "wiped"] = cdps.at[index, "wiped"] + wiped
+                    cdps.free(index, freed)
+                    cdps.wipe(index, wiped)
 
                     # update uniswap
                     uniswap_state_delta['ETH_delta'] += freed
@@ -133,8 +120,8 @@ def p_leverage_eth(params, substep, state_history, state):
                 # Make sure that no balance goes negative and then perform the swap if possible.
                 # The swaps can go negative if uniswap lacks liquidity
                 if locked <= ETH_balance:
-                    cdps.at[index, "locked"] = cdps.at[index, "locked"] + locked
-                    cdps.at[index, "drawn"] = cdps.at[index, "drawn"] + drawn
+                    cdps.lock(index, locked)
+                    cdps.draw(index, drawn)
 
                     # update uniswap
                     uniswap_state_delta['ETH_delta'] -= locked
@@ -0,0 +1,59 @@
+"""
+Exogenous Monte Carlo series (ETH price, liquidity demand and token swap events), one DataFrame column per run.
+"""
+
+import importlib
+import numpy as np
+
+_registry = {}
+
+
+def exogenous_series(module, name):
+    '''
+    The ExogenousSeries for the DataFrame `name` in `module`, created once per process.
+    '''
+    key = (module, name)
+    if key not in _registry:
+        _registry[key] = ExogenousSeries(module, name)
+    return _registry[key]
+
+
+class ExogenousSeries():
+    '''
+    Used as a param in place of the `lambda run, timestep, df: df[str(run-1)].iloc[timestep]` functions, with the same call signature.
+
+    Each run's column is converted once to a read-only float64 array, which policies can also index directly using `path()`.
+    The DataFrame is looked up from its module when first needed,
+    and the series is pickled by reference, so the data isn't copied to worker processes.
+    '''
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+        self.paths = {}
+
+    def __reduce__(self):
+        return (exogenous_series, (self.module, self.name))
+
+    def __repr__(self):
+        return f'ExogenousSeries({self.module}.{self.name})'
+
+    @property
+    def df(self):
+        return getattr(importlib.import_module(self.module), self.name)
+
+    def path(self, run, trend=0):
+        '''
+        The series for a run (counted from 1), with a linear trend of `trend` times its final value added over the path
+        '''
+        path = self.paths.get((run, trend))
+        if path is None:
+            # Without a trend, the path is a view of the DataFrame, e.g. of its memory-mapped cache
+            path = self.df[str(run-1)].to_numpy(dtype=np.float64).view()
+            if trend:
+                path = path + np.arange(len(path)) / len(path) * (trend * path[-1])
+            path.flags.writeable = False
+            self.paths[(run, trend)] = path
+        return path
+
+    def __call__(self, run, timestep, trend=0):
+        return self.path(run, trend)[timestep]
@@ -1,15 +1,9 @@
-import random
 import numpy as np
 
 
 # Ensure all numpy RuntimeWarnings raise
 np.seterr(divide='raise', over='raise', under='ignore')
 
-def initialize_seed(params, substep, state_history, state):
-    if state['timestep'] == 0:
-        random.seed(a=f'{state["run"]}')
-    return {}
-
 def initialize_cdps(params, substep, state_history, state):
     if not state['cdps']:
         pass
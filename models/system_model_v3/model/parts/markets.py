@@ -1,12 +1,9 @@
-import scipy.stats as sts
 import numpy as np
-import copy
-import random
 import logging
 import math
 
 import models.system_model_v3.model.parts.uniswap as uniswap
-from .utils import print_time
+from .utils import print_time, random_stream
 
 
 def p_liquidity_demand(params, substep, state_history, state):
@@ -26,9 +23,9 @@ def p_liquidity_demand(params, substep, state_history, state):
         
         uniswap_fee = params['uniswap_fee']
 
-        swap = random.randint(0, 1)
+        swap, direction = random_stream(params, state, 'liquidity_demand').integers(0, 2, size=2)
         # Positive == swap in, or add liquidity event; negative == swap out or remove liquidity event
-        direction = 1 if random.randint(0, 1) else -1
+        direction = 1 if direction else -1
 
         UNI_delta = 0
         if swap:
@@ -144,8 +141,8 @@ def s_market_price_timestamp(params, substep, state_history, state, policy_input
 def p_market_price_twap(params, substep, state_history, state):
     """Calculates Chainlink RAI/USD TWAP """
 
-    market_price_twap_obj = copy.deepcopy(state['market_price_twap_obj'])
-    market_price_twap_obj.update_result(state)
+    # ChainlinkTWAP is immutable, so the TWAP in the state history isn't changed
+    market_price_twap_obj = state['market_price_twap_obj'].update_result(state)
     twap_value = market_price_twap_obj.median_price
 
     return {"market_price_twap": twap_value, "market_price_twap_obj": market_price_twap_obj}
@@ -2,11 +2,9 @@ import math
 import numpy as np
 import time
 import logging
-import pandas as pd
 import statistics
-from decimal import * 
 
-from .utils import approx_greater_equal_zero, assert_log, approx_eq
+from .utils import approx_greater_equal_zero, assert_log, approx_eq, target_rate_to_apy
 from .debt_market import open_cdp_draw, open_cdp_lock, draw_to_liquidation_ratio, is_cdp_above_liquidation_ratio, wipe_to_liquidation_ratio, draw_to_liquidation_ratio
 from .uniswap import get_output_price, get_input_price
 import models.system_model_v3.model.parts.failure_modes as failure
@@ -65,7 +63,7 @@ def moneyMarketStateChange(params, state, our_state, share, max_rai_balance):
 
 def p_rai_lender(params, substep, state_history, state):
     """if lend_rate + RR > 0, buy RAI and loan it out, otherwise sell RAI (RAI Lender)"""
-    APY = float(((1 + Decimal(state['target_rate'])) ** (60*60*24*365) - 1) * 100)
+    APY = target_rate_to_apy(state['target_rate'])
 
     share = -(state['compound_RAI_lend_APY'] + APY)/params['rai_lender_max_APY_diff']
     if share > 1:
@@ -85,7 +83,7 @@ def s_store_rai_lender_state(params, substep, state_history, state, policy_input
 
 def p_rai_borrower(params, substep, state_history, state):
     """if RR < 0 and borrow rate > RR, borrow RAI and sell, when not, repay and BUY"""
-    APY = float(((1 + Decimal(state['target_rate'])) ** (60*60*24*365) - 1) * 100)
+    APY = target_rate_to_apy(state['target_rate'])
 
     share = (state['compound_RAI_borrow_APY'] - APY)/params['rai_borrower_max_APY_diff']
     if share > 1:
@@ -105,7 +103,7 @@ def s_store_rai_borrower_state(params, substep, state_history, state, policy_inp
 
 def p_base_rate_trader(params, substep, state_history, state):
     """if RR > external interest rate(BASE), buy RAI, otherwise sell RAI for BASE"""
-    APY = float(((1 + Decimal(state['target_rate'])) ** (60*60*24*365) - 1) * 100)
+    APY = target_rate_to_apy(state['target_rate'])
 
     share = (state['external_BASE_APY'] - APY)/params['base_rate_trader_max_APY_diff']
     if share > 1:
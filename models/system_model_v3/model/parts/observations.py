@@ -0,0 +1,57 @@
+class Observations():
+    '''
+    Immutable window of the last `maxlen` oracle observations, used in place of a `deque(maxlen=maxlen)`.
+
+    `append()` returns a new window that shares a fixed-size buffer with this one.
+    Slots before a window's end are never overwritten, so older windows (e.g. in the state history) stay valid.
+    When the buffer is full, or a window that isn't the latest one is appended to, the window is copied to a new buffer.
+    '''
+    __slots__ = ('buffer', 'written', 'start', 'end', 'maxlen')
+
+    def __init__(self, maxlen, capacity=None):
+        assert maxlen > 0
+        capacity = capacity or 4 * maxlen
+        assert capacity > maxlen
+
+        self.buffer = [None] * capacity
+        # Number of slots written in the buffer, shared by all windows over it
+        self.written = [0]
+        self.start = 0
+        self.end = 0
+        self.maxlen = maxlen
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        length = self.end - self.start
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError(f'{index=} is out of range for {length} observations')
+        return self.buffer[self.start + index]
+
+    def __iter__(self):
+        return iter(self.buffer[self.start:self.end])
+
+    def __repr__(self):
+        return f'Observations({self.buffer[self.start:self.end]}, maxlen={self.maxlen})'
+
+    def append(self, observation):
+        buffer, written, start, end = self.buffer, self.written, self.start, self.end
+        if end != written[0] or end == len(buffer):
+            buffer = buffer[start:end] + [None] * (len(buffer) - (end - start))
+            written = [0]
+            start, end = 0, end - start
+
+        buffer[end] = observation
+        end += 1
+        written[0] = end
+
+        observations = Observations.__new__(Observations)
+        observations.buffer = buffer
+        observations.written = written
+        observations.start = start if end - start <= self.maxlen else end - self.maxlen
+        observations.end = end
+        observations.maxlen = self.maxlen
+        return observations
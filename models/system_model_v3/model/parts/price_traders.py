@@ -1,11 +1,45 @@
 import math
-import random
 import logging
-import scipy
+import numpy as np
 
 from .uniswap import get_output_price, get_input_price
+from .utils import random_stream
 import models.system_model_v3.model.parts.failure_modes as failure
 
+class PriceTraders():
+    """
+    The price trader population, stored as one array per trader attribute.
+    Iterating gives each trader as a dict, as in the list of dicts used previously.
+    Traders in the state aren't modified, policies trade on a copy from `take()`.
+    """
+    fields = ['rai_balance', 'base_balance', 'pct_bound']
+
+    def __init__(self, rai_balance, base_balance, pct_bound):
+        self.rai_balance = np.asarray(rai_balance, dtype=np.float64)
+        self.base_balance = np.asarray(base_balance, dtype=np.float64)
+        self.pct_bound = np.asarray(pct_bound, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.pct_bound)
+
+    def __getitem__(self, index):
+        return {field: getattr(self, field)[index].item() for field in PriceTraders.fields}
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def take(self, indices):
+        """
+        A copy of the traders at `indices`, in that order
+        """
+        return PriceTraders(*(getattr(self, field)[indices] for field in PriceTraders.fields))
+
+    def sorted(self):
+        """
+        A copy of the traders sorted by `pct_bound`
+        """
+        return self.take(np.argsort(self.pct_bound, kind='stable'))
+
 def init_price_traders(params, state):
     """
     Initialize all the price traders with their own rai and base balances
@@ -14,18 +48,15 @@ def init_price_traders(params, state):
     assert params['price_trader_mean_pct'] > params['price_trader_min_pct']
     assert params['price_trader_count'] > 10
 
-    price_trader_bounds = scipy.stats.norm.rvs(loc = params['price_trader_mean_pct'],
-                                              scale = params['price_trader_std_pct'],
-                                              size = params['price_trader_count'])
-    price_trader_list = []
-    for i in range(params['price_trader_count']):
-        price_trader_list.append({
-            'rai_balance': state['price_trader_rai_balance'] / params['price_trader_count'],
-            'base_balance': state['price_trader_base_balance'] / params['price_trader_count'],
-            'pct_bound': max(price_trader_bounds[i], params['price_trader_min_pct'])
-        })
-
-    return price_trader_list
+    price_trader_bounds = random_stream(params, state, 'price_traders').normal(loc = params['price_trader_mean_pct'],
+                                                                              scale = params['price_trader_std_pct'],
+                                                                              size = params['price_trader_count'])
+    count = params['price_trader_count']
+    return PriceTraders(
+        rai_balance=np.full(count, state['price_trader_rai_balance'] / params['price_trader_count']),
+        base_balance=np.full(count, state['price_trader_base_balance'] / params['price_trader_count']),
+        pct_bound=np.maximum(price_trader_bounds, params['price_trader_min_pct']),
+    )
 
 def p_trade_price(params, substep, state_history, state):
     """
@@ -34,6 +65,8 @@ def p_trade_price(params, substep, state_history, state):
     When market price goes below the market premium, buy.
     Agent behaviour is explained nicely here: https://hackmd.io/BcT6VQKESKGxSa1OxLKL_Q
 
+    The traders trade together in order of their bounds (see trade_price_sorted()),
+    or one by one in random order if `price_trader_random_order` is set.
     """
     
     uniswap_state_delta = {'RAI_delta': 0, 'ETH_delta': 0, 'UNI_delta': 0}
@@ -45,106 +78,222 @@ def p_trade_price(params, substep, state_history, state):
         price_traders = init_price_traders(params, state)
         return {'price_traders': price_traders, **uniswap_state_delta}
 
+    if params['price_trader_random_order']:
+        price_traders, RAI_delta, ETH_delta = trade_price_random_order(params, state)
+    else:
+        price_traders, RAI_delta, ETH_delta = trade_price_sorted(params, state)
+
+    uniswap_state_delta['RAI_delta'] += RAI_delta
+    uniswap_state_delta['ETH_delta'] += ETH_delta
+
+    return {'price_traders': price_traders, **uniswap_state_delta}
+
+def trade_price_sorted(params, state):
+    """
+    Trade the price traders' RAI one by one in order of increasing bound, with the same results as the sequential loop.
+
+    A trader trades while the market price is outside its bound around the redemption price,
+    until the market price reaches the redemption price or the trader runs out of balance.
+    As the bounds only widen along the sorted traders while each trade moves the market price towards
+    the redemption price, the traders that trade are a prefix of the sorted traders,
+    and until the first one that reaches the redemption price they trade all their balance.
+    The pool balances at each trader's turn in that prefix are computed at once from the products of the swaps,
+    so each trader's target is recomputed from the balances after the fees of the traders before it.
+    The remaining traders, from the one that reaches the redemption price, are traded one by one.
+    """
+    traders = state['price_traders'].sorted()
+
     RAI_balance = state['RAI_balance']
     ETH_balance = state['ETH_balance']
-    UNI_supply = state['UNI_supply']
 
     redemption_price = state['target_price'] * params['trader_market_premium']
     eth_price = state['eth_price']
     market_price = ETH_balance/RAI_balance * eth_price
     uniswap_fee = params['uniswap_fee']
+    gamma = 1 - uniswap_fee
+
+    def bound_cutoff(market_price, sell):
+        # Traders with a smaller pct_bound sell or buy at `market_price`
+        if sell:
+            return (gamma * market_price / redemption_price - 1) * 100
+        return (1 - gamma * market_price / redemption_price) * 100
+
+    sell = bound_cutoff(market_price, sell=True) > traders.pct_bound[0]
+    buy = bound_cutoff(market_price, sell=False) > traders.pct_bound[0]
+    if not (sell or buy):
+        return traders, 0, 0
+
+    # Traders that trade at the current market price, and the pool balances at their turns if they all trade all their balance
+    n_traders = np.searchsorted(traders.pct_bound, bound_cutoff(market_price, sell), side='left')
+    # Past the first trader that reaches the redemption price the balances can overshoot, but they aren't used
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if sell:
+            # RAI each trader can sell, and the pool's ETH multiplied by R / (R + gamma * capacity) by each sale
+            capacity = np.where(traders.rai_balance[:n_traders] > 0, traders.rai_balance[:n_traders], 0)
+            RAI_before = RAI_balance + np.cumsum(capacity) - capacity
+            ETH_before = ETH_balance * np.cumprod(np.concatenate([[1.0], RAI_before / (RAI_before + gamma * capacity)]))[:-1]
+        else:
+            # RAI each trader can buy at the market price at its turn, found from the traders before it,
+            # and the pool's ETH multiplied by 1 + capacity / ((R - capacity) * gamma) by each purchase
+            market_prices = np.full(n_traders, market_price)
+            capacity = None
+            while True:
+                previous_capacity = capacity
+                capacity = np.where(traders.base_balance[:n_traders] > 0,
+                                    np.floor(traders.base_balance[:n_traders] / market_prices), 0)
+                RAI_before = RAI_balance - (np.cumsum(capacity) - capacity)
+                ETH_before = ETH_balance * np.cumprod(np.concatenate([[1.0], 1 + capacity / ((RAI_before - capacity) * gamma)]))[:-1]
+                market_prices = ETH_before / RAI_before * eth_price
+                # The capacity of each trader only depends on the traders before it, so this ends after at most n_traders passes
+                if previous_capacity is not None and np.array_equal(capacity, previous_capacity, equal_nan=True):
+                    break
+        market_prices = ETH_before / RAI_before * eth_price
+
+        # RAI that moves the market price to the redemption price at each trader's turn
+        desired_eth_rai = ETH_before / RAI_before * (redemption_price / market_prices)
+        targets = np.sqrt(RAI_before * ETH_before / desired_eth_rai) - RAI_before
+        if not sell:
+            targets = -targets
 
-    updated_traders = []
+        # The traders that trade all their balance, up to the first one that doesn't trade or reaches the redemption price
+        full = (traders.pct_bound[:n_traders] < bound_cutoff(market_prices, sell)) & (capacity <= targets)
+        n_full = full.argmin() if not full.all() else n_traders
+    if n_full > 0 and np.any(targets[:n_full] <= 0): raise failure.PriceTraderConditionException(f'{targets[:n_full].min()=}')
+
+    capacity = capacity[:n_full]
+    if sell:
+        _, ETH_deltas = get_input_price(capacity, RAI_before[:n_full], ETH_before[:n_full], uniswap_fee)
+        traders.rai_balance[:n_full] -= capacity
+        RAI_delta = capacity.sum()
+    else:
+        ETH_deltas, _ = get_output_price(capacity, ETH_before[:n_full], RAI_before[:n_full], uniswap_fee)
+        traders.rai_balance[:n_full] += capacity
+        RAI_delta = -capacity.sum()
+    traders.base_balance[:n_full] -= ETH_deltas * eth_price
+    ETH_delta = ETH_deltas.sum()
+
+    # The remaining traders, until one doesn't trade at the market price, which the traders after it don't either
+    if n_full < n_traders:
+        RAI_balance, ETH_balance = RAI_before[n_full], ETH_before[n_full]
+        for i in range(n_full, len(traders)):
+            trader_RAI_delta, trader_ETH_delta = trade_price_one(params, traders, i, RAI_balance, ETH_balance, redemption_price, eth_price)
+            if trader_RAI_delta is None:
+                break
+            RAI_delta += trader_RAI_delta
+            ETH_delta += trader_ETH_delta
+            RAI_balance += trader_RAI_delta
+            ETH_balance += trader_ETH_delta
+
+    if params['debug']:
+        print(f"{'price traders selling' if sell else 'price traders buying':25} {n_full=}, {RAI_delta=:.2f}, "
+              f"{ETH_delta=:.2f}, {market_price=:.2f}, {redemption_price=:.2f}")
+
+    return traders, RAI_delta, ETH_delta
+
+def trade_price_one(params, traders, i, RAI_balance, ETH_balance, redemption_price, eth_price):
+    """
+    Trade the RAI of trader `i` at the pool balances, returning the pool's RAI and ETH deltas,
+    or (None, None) when the market price is within the trader's bound
+    """
+    market_price = ETH_balance/RAI_balance * eth_price
+    uniswap_fee = params['uniswap_fee']
+    trader_rai_balance = traders.rai_balance[i]
+    trader_base_balance = traders.base_balance[i]
+    price_trader_bound = traders.pct_bound[i] / 100
+
+    RAI_delta = 0
+    ETH_delta = 0
+    BASE_delta = 0
+
+    expensive_RAI_on_secondary_market = \
+        redemption_price * (1 + price_trader_bound) < (1 - uniswap_fee) * market_price
+    cheap_RAI_on_secondary_market = \
+        redemption_price * (1 - price_trader_bound) > (1 - uniswap_fee) * market_price
+
+    # How far to trade to the peg. 1 = all the way
+    trade_ratio = 1/1
+    if expensive_RAI_on_secondary_market and trader_rai_balance > 0:
+
+        # sell to redemption
+        desired_eth_rai = ETH_balance/RAI_balance * (redemption_price/market_price)
+        a = math.sqrt(RAI_balance * ETH_balance/desired_eth_rai) - RAI_balance
+
+        if a <= 0: raise failure.PriceTraderConditionException(f'{a=}')
+        RAI_delta = min(trader_rai_balance, a * trade_ratio)
+
+        if not RAI_delta >= 0:
+            ETH_delta = 0
+            BASE_delta = 0
+        else:
+            # Swap RAI for ETH
+            _, ETH_delta = get_input_price(RAI_delta, RAI_balance, ETH_balance, uniswap_fee)
+            if not ETH_delta < 0: raise failure.PriceTraderConditionException(f'{ETH_delta=}')
+            if params['debug']:
+                print(f"{'price trader selling':25} {RAI_delta=:.2f}, {ETH_delta=:.2f}, "
+                      f"{market_price=:.2f}, {redemption_price=:.2f}")
+            BASE_delta = ETH_delta * eth_price
+
+        traders.rai_balance[i] += -RAI_delta
+        traders.base_balance[i] += -BASE_delta
+        return RAI_delta, ETH_delta
+
+    elif cheap_RAI_on_secondary_market and trader_base_balance > 0:
+        desired_eth_rai = ETH_balance/RAI_balance * (redemption_price/market_price)
+        a = math.sqrt(RAI_balance * ETH_balance/desired_eth_rai) - RAI_balance
+
+        if a >= 0: raise failure.PriceTraderConditionException(f'{a=}')
+
+        RAI_delta = min(int(trader_base_balance / market_price), -a * trade_ratio)
+
+        if not RAI_delta > 0:
+            ETH_delta = 0
+            BASE_delta = 0
+        else:
+            ETH_delta, _ = get_output_price(RAI_delta, ETH_balance, RAI_balance, uniswap_fee)
+            if not ETH_delta > 0: raise failure.PriceTraderConditionException(f'{ETH_delta=}')
+            if params['debug']:
+                print(f"{'price trader buying':25} {RAI_delta=:.2f}, {ETH_delta=:.2f}, "
+                      f"{market_price=:.2f}, {redemption_price=:.2f}")
+            BASE_delta = ETH_delta * eth_price
+
+        traders.rai_balance[i] += RAI_delta
+        traders.base_balance[i] += -BASE_delta
+        return -RAI_delta, ETH_delta
+
+    elif expensive_RAI_on_secondary_market or cheap_RAI_on_secondary_market:
+        # Outside the bound, without the balance to trade
+        return 0, 0
+    return None, None
+
+def trade_price_random_order(params, state):
+    """
+    Trade the price traders' RAI one by one, in random order
+    """
+    RAI_balance = state['RAI_balance']
+    ETH_balance = state['ETH_balance']
+
+    redemption_price = state['target_price'] * params['trader_market_premium']
+    eth_price = state['eth_price']
+
+    total_RAI_delta = 0
+    total_ETH_delta = 0
 
     # process traders in random order
-    for price_trader in random.sample(state['price_traders'], len(state['price_traders'])):
-        trader_rai_balance = price_trader['rai_balance']
-        trader_base_balance = price_trader['base_balance']
-        price_trader_bound = price_trader['pct_bound'] / 100
-
-        updated_trader = {'rai_balance': trader_rai_balance,
-                          'base_balance': trader_base_balance,
-                          'pct_bound': price_trader['pct_bound']}
-        
-        RAI_delta = 0
-        ETH_delta = 0
-        BASE_delta = 0
-        UNI_delta = 0
-
-        expensive_RAI_on_secondary_market = \
-            redemption_price * (1 + price_trader_bound) < (1 - uniswap_fee) * market_price
-        cheap_RAI_on_secondary_market = \
-            redemption_price * (1 - price_trader_bound) > (1 - uniswap_fee) * market_price
-
-        # How far to trade to the peg. 1 = all the way
-        trade_ratio = 1/1
-        if expensive_RAI_on_secondary_market and trader_rai_balance > 0:
-
-            # sell to redemption
-            desired_eth_rai = ETH_balance/RAI_balance * (redemption_price/market_price)
-            a = math.sqrt(RAI_balance * ETH_balance/desired_eth_rai) - RAI_balance
-
-            if a <= 0: raise failure.PriceTraderConditionException(f'{a=}')
-            RAI_delta = min(trader_rai_balance, a * trade_ratio)
-
-            if not RAI_delta >= 0:
-                ETH_delta = 0
-                BASE_delta = 0
-            else:
-                # Swap RAI for ETH
-                _, ETH_delta = get_input_price(RAI_delta, RAI_balance, ETH_balance, uniswap_fee)
-                if not ETH_delta < 0: raise failure.PriceTraderConditionException(f'{ETH_delta=}')
-                if params['debug']:
-                    print(f"{'price trader selling':25} {RAI_delta=:.2f}, {ETH_delta=:.2f}, "
-                          f"{market_price=:.2f}, {redemption_price=:.2f}")
-                BASE_delta = ETH_delta * eth_price
-
-            updated_trader['rai_balance'] += -RAI_delta
-            updated_trader['base_balance'] += -BASE_delta
-
-            uniswap_state_delta['RAI_delta'] += RAI_delta
-            uniswap_state_delta['ETH_delta'] += ETH_delta
-            uniswap_state_delta['UNI_delta'] += UNI_delta
-
-            # update pool locally after each trader
-            RAI_balance += RAI_delta
-            ETH_balance += ETH_delta
-            market_price = ETH_balance/RAI_balance * eth_price
-           
-        elif cheap_RAI_on_secondary_market and trader_base_balance > 0:
-            desired_eth_rai = ETH_balance/RAI_balance * (redemption_price/market_price)
-            a = math.sqrt(RAI_balance * ETH_balance/desired_eth_rai) - RAI_balance
-
-            if a >= 0: raise failure.PriceTraderConditionException(f'{a=}')
-
-            RAI_delta = min(int(trader_base_balance / market_price), -a * trade_ratio)
-
-            if not RAI_delta > 0:
-                ETH_delta = 0
-                BASE_delta = 0
-            else:
-                ETH_delta, _ = get_output_price(RAI_delta, ETH_balance, RAI_balance, uniswap_fee)
-                if not ETH_delta > 0: raise failure.PriceTraderConditionException(f'{ETH_delta=}')
-                if params['debug']:
-                    print(f"{'price trader buying':25} {RAI_delta=:.2f}, {ETH_delta=:.2f}, "
-                          f"{market_price=:.2f}, {redemption_price=:.2f}")
-                BASE_delta = ETH_delta * eth_price
-
-            updated_trader['rai_balance'] += RAI_delta
-            updated_trader['base_balance'] += -BASE_delta
-
-            uniswap_state_delta['RAI_delta'] += -RAI_delta
-            uniswap_state_delta['ETH_delta'] += ETH_delta
-            uniswap_state_delta['UNI_delta'] += UNI_delta
-
-            # update pool locally after each trader
-            RAI_balance += -RAI_delta
-            ETH_balance += ETH_delta
-            market_price = ETH_balance/RAI_balance * eth_price
-
-        updated_traders.append(updated_trader)
-
-    return {'price_traders': updated_traders, **uniswap_state_delta}
+    n_traders = len(state['price_traders'])
+    traders = state['price_traders'].take(random_stream(params, state, 'price_traders').permutation(n_traders))
+    for i in range(n_traders):
+        RAI_delta, ETH_delta = trade_price_one(params, traders, i, RAI_balance, ETH_balance, redemption_price, eth_price)
+        if RAI_delta is None:
+            continue
+
+        total_RAI_delta += RAI_delta
+        total_ETH_delta += ETH_delta
+
+        # update pool locally after each trader
+        RAI_balance += RAI_delta
+        ETH_balance += ETH_delta
+
+    return traders, total_RAI_delta, total_ETH_delta
 
 def s_store_price_traders(params, substep, state_history, state, policy_input):
     return 'price_traders', policy_input['price_traders']
@@ -1,12 +1,40 @@
-import math
-import random
-from decimal import *
-import logging
-import scipy
+import numpy as np
 
 from .uniswap import get_output_price, get_input_price, buy_to_price, sell_to_price
+from .utils import growth_factor, random_stream
 import models.system_model_v3.model.parts.failure_modes as failure
 
+class RateTraders():
+    """
+    The rate trader population, stored as one array per trader attribute.
+    Iterating gives each trader as a dict, as in the list of dicts used previously.
+    Traders in the state aren't modified, policies trade on a copy from `take()`.
+    """
+    fields = ['rai_balance', 'base_balance', 'days', 'pct_bound', 'n_buys', 'n_sells']
+
+    def __init__(self, rai_balance, base_balance, days, pct_bound, n_buys, n_sells):
+        self.rai_balance = np.asarray(rai_balance, dtype=np.float64)
+        self.base_balance = np.asarray(base_balance, dtype=np.float64)
+        self.days = np.asarray(days, dtype=np.float64)
+        self.pct_bound = np.asarray(pct_bound, dtype=np.float64)
+        self.n_buys = np.asarray(n_buys, dtype=np.int64)
+        self.n_sells = np.asarray(n_sells, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.days)
+
+    def __getitem__(self, index):
+        return {field: getattr(self, field)[index].item() for field in RateTraders.fields}
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def take(self, indices):
+        """
+        A copy of the traders at `indices`, in that order
+        """
+        return RateTraders(*(getattr(self, field)[indices] for field in RateTraders.fields))
+
 def init_rate_traders(params, state):
     """
     Initialize all rate traders with their own entry deviation(mean and min percent) and
@@ -17,25 +45,32 @@ def init_rate_traders(params, state):
     assert params['rate_trader_mean_pct'] >= params['rate_trader_min_pct']
 
     # independently draw rate trader pct and days values from two normal distributions
-    rate_trader_bounds = scipy.stats.norm.rvs(loc=params['rate_trader_mean_pct'],
-                                              scale=params['rate_trader_std_pct'],
-                                              size=params['rate_trader_count'])
-
-    rate_trader_days = scipy.stats.norm.rvs(loc=params['rate_trader_mean_days'],
-                                            scale=params['rate_trader_std_days'],
-                                            size=params['rate_trader_count'])
-    rate_trader_list = []
-    for i in range(params['rate_trader_count']):
-        rate_trader_list.append({
-            'rai_balance': state['rate_trader_rai_balance']/params['rate_trader_count'],
-            'base_balance': state['rate_trader_base_balance']/params['rate_trader_count'],
-            'days': max(rate_trader_days[i], params['rate_trader_min_days']),
-            'pct_bound': max(rate_trader_bounds[i], params['rate_trader_min_pct']),
-            'n_buys': 0,
-            'n_sells': 0
-        })
-
-    return rate_trader_list
+    rng = random_stream(params, state, 'rate_traders')
+    rate_trader_bounds = rng.normal(loc=params['rate_trader_mean_pct'],
+                                    scale=params['rate_trader_std_pct'],
+                                    size=params['rate_trader_count'])
+
+    rate_trader_days = rng.normal(loc=params['rate_trader_mean_days'],
+                                  scale=params['rate_trader_std_days'],
+                                  size=params['rate_trader_count'])
+    count = params['rate_trader_count']
+    return RateTraders(
+        rai_balance=np.full(count, state['rate_trader_rai_balance']/params['rate_trader_count']),
+        base_balance=np.full(count, state['rate_trader_base_balance']/params['rate_trader_count']),
+        days=np.maximum(rate_trader_days, params['rate_trader_min_days']),
+        pct_bound=np.maximum(rate_trader_bounds, params['rate_trader_min_pct']),
+        n_buys=np.zeros(count),
+        n_sells=np.zeros(count),
+    )
+
+# Number of traders whose trade conditions are evaluated together, see p_trade_rate()
+trader_chunk = 64
+
+def effective_rates(target_rate, days):
+    """
+    Redemption rate compounded over each trader's timeframe
+    """
+    return growth_factor(target_rate, 60*60*24*np.asarray(days))
 
 def p_trade_rate(params, substep, state_history, state):
     """
@@ -43,6 +78,9 @@ def p_trade_rate(params, substep, state_history, state):
     Sell when the market price is greater than (future_redemption_price * (1 + deviation) * premium).
     Buy when the market price is less than (future_redemption_price * (1 - deviation) * premium).
     Agent's behaviour is explained nicely in the simulations blog series.
+
+    The traders' sell and buy conditions are evaluated for `trader_chunk` traders at once,
+    and only the traders that trade are processed one at a time.
     """
     uniswap_state_delta = {'RAI_delta': 0, 'USD_delta': 0, 'UNI_delta': 0}
     debug = params['debug']
@@ -62,46 +100,56 @@ def p_trade_rate(params, substep, state_history, state):
     eth_price = state['eth_price']
     uniswap_fee = params['uniswap_fee']
 
-    updated_traders = []
-
     # process traders in random order
-    for i, rate_trader in enumerate(random.sample(state['rate_traders'], len(state['rate_traders']))):
-        effective_rate = 0
-        try:
-            effective_rate = float((1 + Decimal(state['target_rate'])) ** Decimal(60*60*24*rate_trader['days']))
-        except (Overflow, FloatingPointError) as e:
-            raise e
-        
-        # calculate future redemption price
-        redemption_price = state['target_price'] * effective_rate * params['trader_market_premium']
-
+    rng = random_stream(params, state, 'rate_traders')
+    n_traders = len(state['rate_traders'])
+    traders = state['rate_traders'].take(rng.permutation(n_traders))
+    trade_ratios = rng.uniform(0.1, 0.5, n_traders)
+
+    # calculate future redemption price
+    redemption_prices = state['target_price'] * effective_rates(state['target_rate'], traders.days) * params['trader_market_premium']
+    rate_trader_bounds = traders.pct_bound / 100
+    expensive_prices = redemption_prices * (1 + rate_trader_bounds)
+    cheap_prices = redemption_prices * (1 - rate_trader_bounds)
+
+    # Prices at which the traders sell or buy, where traders without RAI never sell and traders without USD never buy.
+    # The traders' balances only change when they trade, after which they are passed.
+    sell_prices = np.where(traders.rai_balance > 0, expensive_prices, np.inf)
+    buy_prices = np.where(traders.base_balance > 0, cheap_prices, 0.0)
+
+    i = 0
+    while i < n_traders:
         # get latest market price
         market_price = USD_balance/RAI_balance
 
-        trader_rai_balance = rate_trader['rai_balance']
-        trader_base_balance = rate_trader['base_balance']
-        rate_trader_bound = rate_trader['pct_bound'] / 100
-
-        updated_trader = {'rai_balance': trader_rai_balance,
-                          'base_balance': trader_base_balance,
-                          'days': rate_trader['days'],
-                          'pct_bound': rate_trader['pct_bound'],
-                          'n_buys': rate_trader['n_buys'],
-                          'n_sells': rate_trader['n_sells']
-                          }
-        
+        # Next trader that sells or buys at this market price, compared from the cursor one chunk at a time,
+        # so that each trader is only compared again after a trade if it is in the same chunk
+        offset = None
+        while i < n_traders:
+            sells = sell_prices[i:i + trader_chunk] < (1 - uniswap_fee) * market_price
+            trades = sells | (buy_prices[i:i + trader_chunk] > (1 + uniswap_fee) * market_price)
+            if trades.any():
+                offset = trades.argmax()
+                break
+            i += trader_chunk
+        if offset is None:
+            break
+        sell = sells[offset]
+        i += offset
+
+        redemption_price = redemption_prices[i]
+        trader_rai_balance = traders.rai_balance[i]
+        trader_base_balance = traders.base_balance[i]
+
         RAI_delta = 0
         USD_delta = 0
         BASE_delta = 0
         UNI_delta = 0
 
-        expensive_RAI = redemption_price * (1 + rate_trader_bound) < (1 - uniswap_fee) * market_price
-        cheap_RAI = redemption_price * (1 - rate_trader_bound) > (1 + uniswap_fee) * market_price
-
         # How far to trade to the effective redemption price. 1 = all the way
-        trade_ratio = random.uniform(0.1, 0.5)
+        trade_ratio = trade_ratios[i]
         #trade_ratio = 1.0
-        if expensive_RAI and trader_rai_balance > 0:
+        if sell:
             # sell rai to redemption price
             if debug:
                 print(f"{timestep=}, {USD_balance=},{RAI_balance=}, {market_price=:.6f}, {redemption_price=:.6f}")
@@ -129,10 +177,10 @@ def p_trade_rate(params, substep, state_history, state):
                     print(f"{'rate trader selling':25} {RAI_delta=:.2f}, {USD_delta=:.2f}, "
                           f"{market_price=:.6f}, {redemption_price=:.6f}")
                 BASE_delta = USD_delta
-                updated_trader['n_sells'] += 1
+                traders.n_sells[i] += 1
 
-            updated_trader['rai_balance'] -= RAI_delta
-            updated_trader['base_balance'] -= BASE_delta
+            traders.rai_balance[i] -= RAI_delta
+            traders.base_balance[i] -= BASE_delta
 
             uniswap_state_delta['RAI_delta'] += RAI_delta
             uniswap_state_delta['USD_delta'] += USD_delta
@@ -143,7 +191,7 @@ def p_trade_rate(params, substep, state_history, state):
             USD_balance += USD_delta
             #print(f"after trade market_price: {USD_balance/RAI_balance:.6f}")
            
-        elif cheap_RAI and trader_base_balance > 0:
+        else:
             # buy rai to redemption price
             if debug:
                 print(f"{timestep=}, {USD_balance=}, {RAI_balance=}, {market_price=:.6f}, {redemption_price=:.6f}")
@@ -178,10 +226,10 @@ def p_trade_rate(params, substep, state_history, state):
                     print(f"{'rate trader buying':25} {RAI_delta=:.2f}, {USD_delta=:.2f}, "
                           f"{market_price=:.2f}, {redemption_price=:.2f}")
                 BASE_delta = USD_delta
-                updated_trader['n_buys'] += 1
+                traders.n_buys[i] += 1
 
-            updated_trader['rai_balance'] += RAI_delta
-            updated_trader['base_balance'] -= BASE_delta
+            traders.rai_balance[i] += RAI_delta
+            traders.base_balance[i] -= BASE_delta
 
             uniswap_state_delta['RAI_delta'] -= RAI_delta
             uniswap_state_delta['USD_delta'] += USD_delta
@@ -192,9 +240,9 @@ def p_trade_rate(params, substep, state_history, state):
             USD_balance += USD_delta
             #print(f"after trade market_price: {USD_balance/RAI_balance:.6f}")
 
-        updated_traders.append(updated_trader)
+        i += 1
 
-    return {'rate_traders': updated_traders, **uniswap_state_delta}
+    return {'rate_traders': traders, **uniswap_state_delta}
 
 def s_store_rate_traders(params, substep, state_history, state, policy_input):
     return 'rate_traders', policy_input['rate_traders']
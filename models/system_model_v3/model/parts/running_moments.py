@@ -0,0 +1,77 @@
+import math
+
+
+class RunningMoments():
+    """
+    Running mean and variance of a series, updated in O(1) per value.
+
+    By default the moments are over all values. With `window`, they are over the last `window` values,
+    and with `alpha` they are exponentially weighted with smoothing factor `alpha`.
+
+    Instances are immutable: `update()` returns new moments, so they can be stored in the state.
+    """
+    def __init__(self, window=None, alpha=None):
+        assert window is None or window > 1
+        assert alpha is None or 0 < alpha <= 1
+        assert window is None or alpha is None
+
+        self.window = window
+        self.alpha = alpha
+
+        self.count = 0
+        self.mean = 0
+        # Sum of squared deviations from the mean, or the variance for exponentially weighted moments
+        self.m2 = 0
+
+        # Values in the window, `values[start:start + count]`. The list is append-only and shared with older moments
+        self.values = []
+        self.start = 0
+
+    @property
+    def variance(self):
+        if self.alpha is not None:
+            return self.m2
+        return self.m2 / (self.count - 1) if self.count > 1 else 0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def update(self, value):
+        moments = RunningMoments.__new__(RunningMoments)
+        moments.__dict__.update(self.__dict__)
+
+        if self.alpha is not None:
+            if self.count == 0:
+                moments.mean = value
+            else:
+                delta = value - self.mean
+                moments.mean = self.mean + self.alpha * delta
+                moments.m2 = (1 - self.alpha) * (self.m2 + self.alpha * delta**2)
+            moments.count += 1
+            return moments
+
+        # Welford's algorithm
+        moments.count += 1
+        delta = value - moments.mean
+        moments.mean += delta / moments.count
+        moments.m2 += delta * (value - moments.mean)
+
+        if self.window is not None:
+            end = self.start + self.count
+            if len(self.values) != end or end > 2 * self.window:
+                # These moments were already updated, or the list is mostly outside the window: start a new list
+                moments.values = self.values[self.start:end]
+                moments.start = 0
+            moments.values.append(value)
+
+            if moments.count > self.window:
+                # Remove the oldest value
+                removed = moments.values[moments.start]
+                moments.start += 1
+                moments.count -= 1
+                delta = removed - moments.mean
+                moments.mean -= delta / moments.count
+                moments.m2 -= delta * (removed - moments.mean)
+
+        return moments
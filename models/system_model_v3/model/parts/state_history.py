@@ -0,0 +1,50 @@
+from collections import deque
+
+
+def history_depth(partial_state_update_blocks):
+    '''
+    The number of previous timesteps the blocks read from the state history,
+    the largest `history` declared by a block, or None if any block doesn't declare it.
+    '''
+    depths = [psub.get('history') for psub in partial_state_update_blocks]
+    if None in depths:
+        return None
+    return max(depths, default=0)
+
+
+class StateHistory():
+    '''
+    A bounded replacement for the list of substates per timestep passed to policies and state updates as `state_history`.
+
+    Only the initial state, `state_history[0]`, and the last `depth` timesteps are kept,
+    so memory doesn't grow with the number of timesteps. `len()` and indices are the same as for the full list.
+    '''
+    def __init__(self, initial_substates, depth=None):
+        assert depth is None or depth >= 0
+
+        self.depth = depth
+        self.initial_substates = initial_substates
+        self.recent = deque([], depth)
+        self.length = 1
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not isinstance(index, int):
+            raise TypeError(f'{index=}: StateHistory only supports integer indices')
+
+        position = index + self.length if index < 0 else index
+        if not 0 <= position < self.length:
+            raise IndexError(f'{index=} is out of range for {self.length} timesteps')
+        if position == 0:
+            return self.initial_substates
+
+        offset = position - (self.length - len(self.recent))
+        if offset < 0:
+            raise IndexError(f'{index=} is older than the declared history of {self.depth} timesteps')
+        return self.recent[offset]
+
+    def append(self, substates):
+        self.recent.append(substates)
+        self.length += 1
@@ -0,0 +1,48 @@
+"""
+Seconds per run of the lean engine with and without compile_blocks, including the time to compile the blocks,
+with every key recorded and with a RecordingSpec of a few keys, for each number of timesteps:
+
+    python -m models.system_model_v3.model.parts.tests.benchmark_block_compiler [timesteps ...]
+"""
+import experiments.system_model_v3.lean_engine as lean_engine
+from experiments.system_model_v3.recording import RecordingSpec
+from models.system_model_v3.model.params.init import params
+from models.system_model_v3.model.partial_state_update_blocks import partial_state_update_blocks
+from models.system_model_v3.model.state_variables.init import state_variables
+import models.system_model_v3.model.parts.block_compiler as block_compiler
+
+import statistics
+import sys
+import time
+
+repeats = 5
+recordings = {
+    'all keys': True,
+    'few keys': RecordingSpec(['target_price', 'market_price', 'market_price_twap', 'target_rate'], every=24),
+}
+
+
+def run_seconds(params, timesteps, record, compile_blocks):
+    # A cold compile, as in a new process
+    block_compiler._function_node.cache_clear()
+    block_compiler._function_tree.cache_clear()
+    block_compiler._cached_state_reads.cache_clear()
+    start = time.time()
+    lean_engine.run(state_variables, partial_state_update_blocks, params, timesteps, record=record,
+                    compile_blocks=compile_blocks)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    timesteps_list = [int(timesteps) for timesteps in sys.argv[1:]] or [500, 2000, 8000]
+    subset_params = {key: value[:1] for key, value in params.items()}
+
+    for timesteps in timesteps_list:
+        for name, record in recordings.items():
+            seconds = {False: [], True: []}
+            # Interleaved, so that both see the same machine load
+            for _ in range(repeats):
+                for compile_blocks in (False, True):
+                    seconds[compile_blocks].append(run_seconds(subset_params, timesteps, record, compile_blocks))
+            plain, compiled = statistics.median(seconds[False]), statistics.median(seconds[True])
+            print(f'{timesteps:6} timesteps, {name:8}: {plain:7.3f} s, compiled {compiled:7.3f} s ({compiled / plain - 1:+.1%})')
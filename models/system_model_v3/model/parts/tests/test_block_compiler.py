@@ -0,0 +1,114 @@
+import experiments.system_model_v3.lean_engine as lean_engine
+from experiments.system_model_v3.recording import RecordingSpec
+from models.system_model_v3.model.parts.block_compiler import compile_blocks, history_reads, state_reads
+from typing import NamedTuple
+
+class Counter(NamedTuple):
+    count: int = 0
+
+    def update(self, state):
+        return self._replace(count=self.count + self.step(state))
+
+    def step(self, state):
+        return state['y']
+
+initial_state = {'x': 1.0, 'y': 0.0, 'z': 0.0, 'total': 0.0, 'counter': Counter()}
+
+def read_key(state, key):
+    return state[f'{key}']
+
+def p_x(params, substep, state_history, state):
+    return {'x': state['x'] + 1}
+
+def s_x(params, substep, state_history, state, policy_input):
+    return 'x', policy_input['x']
+
+def s_y(params, substep, state_history, state, policy_input):
+    return 'y', read_key(state, 'x') * 2
+
+def s_y_twice(params, substep, state_history, state, policy_input):
+    return 'y', state.get('x') * 3
+
+def s_z(params, substep, state_history, state, policy_input):
+    return 'z', state['x'] - 1
+
+def s_total(params, substep, state_history, state, policy_input):
+    return 'total', state['total'] + state['y'] + state['z']
+
+def s_unknown(params, substep, state_history, state, policy_input):
+    return 'z', sum(state.values())
+
+def s_x_change(params, substep, state_history, state, policy_input):
+    return 'z', state['x'] - state_history[-1][-1]['x']
+
+def s_counter(params, substep, state_history, state, policy_input):
+    return 'counter', state['counter'].update(state)
+
+def p_free(params, substep, state_history, state):
+    for substate in state_history[-2]:
+        substate['y'] = None
+    return {}
+
+blocks = [
+    {'policies': {'x': p_x}, 'variables': {'x': s_x}},
+    {'policies': {}, 'variables': {'y': s_y}},
+    {'policies': {}, 'variables': {'y': s_y_twice, 'z': s_z}},
+    {'policies': {}, 'variables': {'total': s_total}},
+]
+
+
+def test_state_reads():
+    assert state_reads(p_x) == {'x'}
+    assert state_reads(s_y) == {'x'}
+    assert state_reads(s_y_twice) == {'x'}
+    assert state_reads(s_total) == {'total', 'y', 'z'}
+    assert state_reads(s_unknown) is None
+    assert state_reads(s_counter) is None
+    assert state_reads(s_counter, state_types={'counter': Counter}) == {'counter', 'y'}
+
+
+def test_history_reads():
+    assert history_reads(s_x_change) == {'x'}
+    assert history_reads(s_total) == set()
+    # Only written
+    assert history_reads(p_free) == set()
+
+
+def test_compile_blocks():
+    compiled = compile_blocks(blocks)
+    # The first update of y is overwritten before it's read, and the y and z updates don't read each other,
+    # but the total reads them
+    assert [list(psub['variables']) for psub in compiled] == [['x'], ['y', 'z'], ['total']]
+
+    expected, _ = lean_engine.run(initial_state, blocks, {}, 10)
+    results, _ = lean_engine.run(initial_state, compiled, {}, 10)
+    for row in [*expected, *results]:
+        del row['substep']
+    assert results == expected
+
+    # Blocks that may read anything aren't merged
+    unknown = [blocks[0], {'policies': {}, 'variables': {'y': s_y}}, {'policies': {}, 'variables': {'z': s_unknown}}]
+    assert len(compile_blocks(unknown)) == 3
+
+
+def test_compile_blocks_unread():
+    history_blocks = [*blocks, {'policies': {}, 'variables': {'counter': s_counter}}]
+    record = RecordingSpec(['x', 'total'])
+    expected, _ = lean_engine.run(initial_state, history_blocks, {}, 10, record=record)
+    results, _ = lean_engine.run(initial_state, history_blocks, {}, 10, record=record, compile_blocks=True)
+    for row in [*expected, *results]:
+        del row['substep']
+    assert results == expected
+
+    # The counter isn't recorded or read, and z is read by the total
+    compiled = compile_blocks(history_blocks, initial_state, {'x', 'total'})
+    assert [list(psub['variables']) for psub in compiled] == [['x'], ['y', 'z'], ['total']]
+    # The recorded counter reads y, and without the initial state it may read any key, so nothing is dropped
+    compiled = compile_blocks(history_blocks, initial_state, {'x', 'counter'})
+    assert [list(psub['variables']) for psub in compiled] == [['x'], ['y'], ['counter']]
+    compiled = compile_blocks(history_blocks, live_keys={'x', 'counter'})
+    assert [list(psub['variables']) for psub in compiled] == [['x'], ['y', 'z'], ['total'], ['counter']]
+    # z is read from the state history
+    compiled = compile_blocks([*history_blocks, {'policies': {}, 'variables': {'z': s_x_change}}], initial_state, {'total'})
+    assert 'x' in compiled[0]['variables']
+
@@ -16,6 +16,9 @@ n_updates = 40
 cumulative_times = [0,3600,7200,10800,14400,18000,21600,25200,28800,32400,36000,39600,43200,46800,50400,54000,57600,61200,64800,68400,72000,75600,79200,82800,86400,90000,93600,97200,100800,104400,108000,111600,115200,118800,122400,126000,129600,133200,136800,140400,144000,147600,151200,154800,158400,162000,165600,169200,172800,176400,180000,183600,187200,190800,194400,198000,201600,205200,208800,212400,216000,219600,223200,226800,230400,234000,237600,241200,244800,248400,252000,255600,259200,262800,266400,270000,273600,277200,280800,284400,288000,291600,295200,298800,302400,306000,309600,313200,316800,320400,324000,327600,331200,334800,338400,342000,345600,349200,352800,356400,360000,363600,367200,370800,374400,378000,381600,385200,388800,392400,396000,399600][:n_updates]
 rai_prices = [2.87,2.79,2.63,2.51,3.19,3.26,2.9,2.86,2.76,3.4,3.23,2.75,2.97,2.6,2.82,2.86,3.33,2.52,3.45,2.57,3.5,2.51,3.08,3.34,2.61,2.72,3.05,3.38,3.28,3.37,2.56,3.07,3.03,3.45,3.43,2.93,3.19,2.83,3.4,2.73,2.95,2.73,2.68,2.74,2.57,2.56,2.64,3.2,2.8,2.76,2.8,3.3,2.9,2.64,3.46,3.38,3.01,3.47,2.74,3.07,3.38,2.72,3.03,2.64,2.76,3.16,2.51,2.59,3.0,2.69,2.69,2.74,2.98,3.4,3.25,3.45,2.9,2.56,3.3,3.14,2.67,2.54,2.58,2.6,2.86,3.14,2.76,2.53,2.58,3.01,2.95,2.65,2.67,3.21,2.81,2.84,3.13,3.29,2.64,2.69,2.71,2.69,2.76,3.03,2.71,2.53,2.84,2.57,2.6,2.59,2.74,3.48][:n_updates]
 
+# Median prices from the mutable, deque based implementation
+median_prices = [0, 11.16, 11.16, 11.16, 11.16, 6.05, 6.05, 6.05, 6.05, 4.725, 4.725, 4.725, 4.725, 4.016666666666667, 4.016666666666667, 4.016666666666667, 4.016666666666667, 2.945, 2.945, 2.945, 2.945, 2.7575, 2.7575, 2.7575, 2.7575, 2.5875, 2.5875, 2.5875, 2.5875, 2.78, 2.78, 2.78, 2.78, 3.0125, 3.0125, 3.0125, 3.0125, 3.0925, 3.0925, 3.0925]
+
 #@pytest.mark.skip('tmp')
 class TestChainlinkTWAP:
     def _test_deepcopy_speed(self):
@@ -25,7 +28,7 @@ class TestChainlinkTWAP:
                    'market_price': rai_prices[i], 'cumulative_time': cumulative_times[i]} for i in range(len(cumulative_times))]
         s = time.time()
         for state in states:
-            twap.update_result(state)
+            twap = twap.update_result(state)
             copy.deepcopy(twap)
         print(f"took {time.time() - s} secs")
 
@@ -37,6 +40,24 @@ class TestChainlinkTWAP:
         for i, state in enumerate(states):
             #rai_usd = state['ETH_balance'] / state['RAI_balance'] * state['eth_price']
             #print(f"{i=}, new state {state}")
-            twap.update_result(state)
+            twap = twap.update_result(state)
             print(f"{i=}, {twap.chainlink_observations}, {twap.median_price=}")
+            assert twap.median_price == pytest.approx(median_prices[i], rel=1e-15)
+
+    def test_immutable(self):
+        twap = ChainlinkTWAP(granularity=4, window_size=16*3600, max_window_size=21*3600)
+
+        states = [{'market_price_timestamp': cumulative_times[i],
+                   'market_price': rai_prices[i], 'cumulative_time': cumulative_times[i]} for i in range(len(cumulative_times))]
+        history = [twap]
+        for state in states:
+            history.append(history[-1].update_result(state))
+
+        # Updating an earlier TWAP again gives the same results, and leaves the later TWAPs unchanged
+        for i in [0, 7, 21]:
+            twap = history[i]
+            for j, state in enumerate(states[i:]):
+                twap = twap.update_result(state)
+                assert twap.median_price == median_prices[i + j]
+        assert [twap.median_price for twap in history[1:]] == median_prices
 
@@ -0,0 +1,86 @@
+import copy
+import random
+import numpy as np
+import pytest
+import experiments.system_model_v3.engine as bounded_engine
+import experiments.system_model_v3.lean_engine as lean_engine
+from experiments.system_model_v3.checkpoint import Checkpointer
+from experiments.system_model_v3.recording import RecordingSpec
+from models.system_model_v3.model.parts.utils import random_stream
+
+initial_state = {'x': 0.0, 'y': 0.0, 'noise': 0.0, 'global_noise': 0.0, 'items': np.zeros(2)}
+
+def p_a(params, substep, state_history, state):
+    if state['timestep'] == params['fail_at']:
+        raise RuntimeError('Killed')
+    return {'a': params['a']}
+
+def s_x(params, substep, state_history, state, policy_input):
+    return 'x', state['x'] * 0.9 + policy_input['a'] + state_history[-2][-1]['y'] if len(state_history) > 1 else 1.0
+
+def s_y(params, substep, state_history, state, policy_input):
+    return 'y', np.sqrt(state['x'])
+
+def s_noise(params, substep, state_history, state, policy_input):
+    return 'noise', random_stream(params, state, 'noise').random()
+
+def s_global_noise(params, substep, state_history, state, policy_input):
+    return 'global_noise', random.random() + np.random.random() if params['global_noise'] else 0.0
+
+def s_items(params, substep, state_history, state, policy_input):
+    return 'items', state['items'] + state['x']
+
+blocks = [
+    {'history': 2, 'policies': {'a': p_a}, 'variables': {'x': s_x, 'noise': s_noise, 'global_noise': s_global_noise}},
+    {'history': 1, 'policies': {}, 'variables': {'y': s_y, 'items': s_items}},
+]
+
+
+def _run(engine, params, checkpoint, record=True):
+    random.seed(1)
+    np.random.seed(1)
+    return engine.run(initial_state, blocks, params, 20, runs=2, record=record, checkpoint=checkpoint)
+
+
+@pytest.mark.parametrize('engine', [bounded_engine, lean_engine])
+@pytest.mark.parametrize('record', [True, False, RecordingSpec(['x'], every=3, reducers={'y': 'mean'})])
+def test_resume_is_identical(tmp_path, engine, record):
+    params = {'a': [1.0, 3.0], 'fail_at': [None], 'rng_seed': [0], 'global_noise': [False]}
+    expected, _ = _run(engine, params, None, record)
+
+    checkpoint = Checkpointer(str(tmp_path), every=4)
+    _, exceptions = _run(engine, {**params, 'fail_at': [None, 11]}, checkpoint, record)
+    assert [exception['exception'] is None for exception in exceptions] == [True, False] * 2
+
+    # The completed runs are loaded from their final checkpoint, and the failed runs resume from timestep 8
+    random.seed(2)
+    np.random.seed(2)
+    results, exceptions = engine.run(initial_state, blocks, params, 20, runs=2, record=record, checkpoint=checkpoint)
+    assert [exception['exception'] for exception in exceptions] == [None] * 4
+    assert len(results) == len(expected)
+    for row, expected_row in zip(results, expected):
+        assert row.keys() == expected_row.keys()
+        for key, value in row.items():
+            assert np.array_equal(value, expected_row[key]), key
+
+
+def test_results_after_snapshot_are_dropped(tmp_path):
+    # A single run, so that the global random states are the same when it's resumed
+    params = {'a': [1.0], 'fail_at': [None], 'rng_seed': [0], 'global_noise': [True]}
+    expected, _ = _run(lean_engine, params, None)
+
+    checkpoint = Checkpointer(str(tmp_path), every=4)
+    _run(lean_engine, {**params, 'fail_at': [11]}, checkpoint)
+    # A run killed after appending its results but before replacing the snapshot
+    run_checkpoint = checkpoint.run_checkpoint(0, 0, 1)
+    with open(run_checkpoint.results_path, 'ab') as file:
+        file.write(b'\x80\x05]\x94.')
+
+    random.seed(2)
+    np.random.seed(2)
+    results, _ = lean_engine.single_run(0, 20, 0, 0, copy.deepcopy(initial_state), blocks, {key: value[0] for key, value in params.items()},
+                                        checkpoint=checkpoint)[:2]
+    assert [row['timestep'] for row in results] == list(range(21))
+    for row, expected_row in zip(results, expected):
+        for key, value in row.items():
+            assert np.array_equal(value, expected_row[key]), key
@@ -0,0 +1,51 @@
+import sys
+import types
+import pandas as pd
+import pytest
+import experiments.system_model_v3.lean_engine as lean_engine
+from models.system_model_v3.model.parts.exogenous import exogenous_series
+
+distributed = pytest.importorskip('distributed')
+import experiments.system_model_v3.dask_backend as dask_backend
+
+# Exogenous DataFrame looked up by the ExogenousSeries, scattered to the workers instead of loaded there
+exogenous_df = pd.DataFrame({'0': [1.0, 2.0, 3.0] * 10, '1': [2.0, 4.0, 8.0] * 10})
+
+initial_state = {'x': 0.0}
+
+def p_a(params, substep, state_history, state):
+    if state['timestep'] == params['fail_at']:
+        raise ValueError('Failed')
+    return {'a': params['a'] * params['series'](state['run'], state['timestep'])}
+
+def s_x(params, substep, state_history, state, policy_input):
+    return 'x', state['x'] + policy_input['a']
+
+blocks = [
+    {'history': 1, 'policies': {'a': p_a}, 'variables': {'x': s_x}},
+]
+params = {'a': [1.0, 2.0, 3.0], 'fail_at': [None, 4, None], 'series': [exogenous_series(__name__, 'exogenous_df')]}
+
+
+def test_dask_backend():
+    expected, expected_exceptions = lean_engine.run(initial_state, blocks, params, 20, runs=2)
+    with distributed.LocalCluster(n_workers=2, threads_per_worker=1, processes=False, dashboard_address=None) as cluster, \
+            distributed.Client(cluster) as client:
+        frames, exceptions = dask_backend.run(client, initial_state, blocks, params, 20, runs=2)
+
+    assert len(frames) == 6
+    assert pd.concat(frames, ignore_index=True).to_dict('records') == expected
+    assert [(exception['run'], exception['subset'], repr(exception['exception'])) for exception in exceptions] == \
+        [(exception['run'], exception['subset'], repr(exception['exception'])) for exception in expected_exceptions]
+
+
+def test_exogenous_data():
+    series = exogenous_series(__name__, 'exogenous_df')
+    assert dask_backend.exogenous_data([{'a': 1.0, 'series': series}])[(__name__, 'exogenous_df')] is exogenous_df
+
+
+def test_install_exogenous_data(monkeypatch):
+    module = types.ModuleType('exogenous_module')
+    monkeypatch.setitem(sys.modules, 'exogenous_module', module)
+    dask_backend._install_exogenous_data({('exogenous_module', 'df'): exogenous_df})
+    assert exogenous_series('exogenous_module', 'df').df is exogenous_df
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+from models.system_model_v3.model.state_variables.data_cache import read_csv_cached
+
+
+def write_csv(path, seed):
+    df = pd.DataFrame(np.random.default_rng(seed).lognormal(5, 0.2, size=(100, 4)), columns=['0', '1', '2', '3'])
+    df.to_csv(path, compression='gzip')
+    return pd.read_csv(path, compression='gzip', index_col=0)
+
+
+def test_read_csv_cached(tmp_path, monkeypatch):
+    path = str(tmp_path / 'eth_values_mc.csv.gz')
+    cache_directory = str(tmp_path / 'cache')
+    expected = write_csv(path, 0)
+
+    df = read_csv_cached(path, cache_directory)
+    pd.testing.assert_frame_equal(df, expected)
+
+    # The second read is from the cache only
+    def read_csv(*args, **kwargs):
+        raise AssertionError('read_csv called')
+    monkeypatch.setattr(pd, 'read_csv', read_csv)
+    df = read_csv_cached(path, cache_directory)
+    pd.testing.assert_frame_equal(df, expected)
+    assert not df['2'].to_numpy().flags.writeable
+    monkeypatch.undo()
+
+    # A changed CSV is cached again
+    expected = write_csv(path, 1)
+    pd.testing.assert_frame_equal(read_csv_cached(path, cache_directory), expected)
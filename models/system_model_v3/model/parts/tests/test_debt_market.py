@@ -0,0 +1,314 @@
+import pytest
+import numpy as np
+import models.system_model_v3.model.parts.failure_modes as failure
+from models.system_model_v3.model.parts.debt_market import CDPLedger, cdp_columns, cdp_float_columns, cohort_trades, batch_trades, \
+    resync_period, s_update_principal_debt, p_rebalance_cdps, is_cdp_above_liquidation_ratio, wipe_to_liquidation_ratio, \
+    draw_to_liquidation_ratio, wipe_to_rr_apy, draw_to_rr_apy
+from models.system_model_v3.model.parts.uniswap import get_output_price, get_input_price
+from models.system_model_v3.model.parts.utils import target_rate_to_apy
+
+
+def make_ledger():
+    cdps = CDPLedger.from_records([{'open': 1, 'arbitrage': 0, 'time': 0, 'locked': 0.0, 'drawn': 0.0, 'wiped': 0.0,
+                                    'freed': 0.0, 'w_wiped': 0.0, 'v_bitten': 0.0, 'u_bitten': 0.0,
+                                    'w_bitten': 0.0, 'dripped': 0.0, 'owner': ''}])
+    for i in range(20):
+        cdps.open_cdp('debt_market', locked=10.0 + i, drawn=1000.0)
+    cdps.open_cdp('leverager', locked=5.0, drawn=300.0)
+    return cdps
+
+
+class TestCDPLedger:
+    def test_open_and_select(self):
+        cdps = make_ledger()
+        assert len(cdps) == 22
+        assert list(cdps.select(owner='leverager')) == [21]
+        assert len(cdps.select(open=1, owner=('debt_market', 'leverager'))) == 21
+        assert len(cdps.select(owner='apt_model')) == 0
+        assert cdps['locked'].sum() == sum(10.0 + i for i in range(20)) + 5.0
+
+    def test_actions(self):
+        cdps = make_ledger()
+        cdps.lock(1, 2.0)
+        cdps.free(1, 1.0)
+        cdps.draw(1, 100.0)
+        cdps.wipe(1, 50.0)
+        assert cdps.collateral([1])[0] == 11.0
+        assert cdps.debt([1])[0] == 1050.0
+
+        cdps.bite(2, v_bite=8.0, free=3.0, u_bite=1000.0, w_bite=0.0)
+        cdp = cdps.cdp(2)
+        assert cdp['open'] == 0
+        assert cdp['owner'] == 'debt_market'
+        assert cdps.collateral([2])[0] == 0
+        assert 2 not in cdps.select(open=1)
+
+    def test_copy_is_independent(self):
+        cdps = make_ledger()
+        copied = cdps.copy()
+        copied.draw(1, 100.0)
+        copied.open_cdp('apt_model', locked=1.0, drawn=1.0)
+        assert cdps['drawn'][1] == 1000.0
+        assert len(cdps) == 22 and len(copied) == 23
+        assert 'apt_model' not in cdps.owners
+
+    def test_growth_keeps_indices(self):
+        cdps = CDPLedger(capacity=2)
+        indices = [cdps.open_cdp('debt_market', locked=float(i), drawn=0.0) for i in range(100)]
+        assert indices == list(range(100))
+        assert np.array_equal(cdps['locked'], np.arange(100, dtype=float))
+
+    def test_to_dataframe(self):
+        cdps = make_ledger()
+        df = cdps.to_dataframe()
+        assert list(df.columns) == cdp_columns
+        assert len(df) == 22
+        assert df.iloc[-1]['owner'] == 'leverager'
+        assert len(df.query("open == 1 and owner == 'debt_market'")) == 20
+
+    def test_drip(self):
+        cdps = make_ledger()
+        stability_fee, timedelta = 1e-8, 3600
+        accrual = cdps.accrual(stability_fee, timedelta)
+        dripped = cdps.drip(stability_fee, timedelta)
+        assert dripped.interest == pytest.approx(accrual)
+        assert dripped['dripped'].sum() == pytest.approx(accrual)
+        assert cdps['dripped'].sum() == 0
+
+        # Principal debt wiped later leaves the accrued interest unchanged
+        dripped = dripped.copy()
+        dripped.wipe(1, 500.0)
+        assert dripped.cdp(1)['dripped'] == pytest.approx(1000.0 * ((1 + stability_fee) ** timedelta - 1))
+
+        # A bite settles all of the CDP's interest
+        w_bite = dripped.cdp(2)['dripped']
+        dripped.bite(2, v_bite=1.0, free=0.0, u_bite=1000.0, w_bite=w_bite)
+        assert dripped.cdp(2)['dripped'] == 0
+        assert dripped.accrual(stability_fee, timedelta) < accrual
+
+    def test_unsafe(self):
+        cdps = make_ledger()
+        arbitrage_cdp = cdps.open_cdp('apt_model', locked=1.0, drawn=1000.0, arbitrage=1)
+
+        def scan(cdps, eth_price, target_price, liquidation_ratio):
+            candidates = cdps.select(open=1, arbitrage=0)
+            return candidates[cdps.collateral(candidates) * eth_price < cdps.debt(candidates) * target_price * liquidation_ratio]
+
+        rng = np.random.default_rng(0)
+        for step in range(50):
+            cdps = cdps.copy()
+            # Change a few CDPs per step, and most of them every 10 steps
+            changed = rng.choice(np.arange(1, 21), size=15 if step % 10 == 0 else 2, replace=False)
+            for index in changed:
+                if cdps.cdp(index)['open']:
+                    cdps.draw(index, rng.uniform(0, 100))
+                    cdps.free(index, rng.uniform(0, 0.5))
+            eth_price = rng.uniform(200, 500)
+            unsafe = cdps.unsafe(eth_price, 3.14, 1.45)
+            assert list(unsafe) == list(scan(cdps, eth_price, 3.14, 1.45))
+            assert arbitrage_cdp not in unsafe
+            for index in unsafe[:1]:
+                cdps.bite(index, v_bite=0.0, free=0.0, u_bite=cdps.debt([index])[0], w_bite=0.0)
+
+    def test_totals(self):
+        cdps = make_ledger()
+        cdps.lock(1, 2.0)
+        cdps.free(3, 1.5)
+        cdps.draw(4, 10.0)
+        cdps.wipe(5, 20.0)
+        cdps.bite(6, v_bite=8.0, free=2.0, u_bite=1000.0, w_bite=0.0)
+        cdps = cdps.drip(1e-8, 3600).copy()
+        cdps.wipe(7, 30.0)
+        for key in ['locked', 'freed', 'v_bitten', 'drawn', 'wiped', 'u_bitten', 'w_wiped', 'w_bitten', 'dripped']:
+            assert cdps.total(key) == pytest.approx(cdps[key].sum(), rel=1e-12)
+
+    def test_resync_totals(self):
+        rng = np.random.default_rng(0)
+        cdps = CDPLedger()
+        indices = [cdps.open_cdp('debt_market', locked=10.0, drawn=drawn) for drawn in rng.uniform(1e5, 1e6, 20)]
+        for _ in range(5):
+            for index in indices:
+                cdps.wipe(index, rng.uniform(0, 0.1) * cdps.debt([index])[0])
+        # The running total is rounded differently from the column sum
+        assert cdps.total('wiped') != np.sum(cdps['wiped'])
+
+        for _ in range(resync_period):
+            cdps = cdps.drip(1e-8, 3600)
+        for key in cdp_float_columns:
+            assert cdps.total(key) == np.sum(cdps[key] * cdps['count'])
+
+    def test_settled_principal_debt(self):
+        rng = np.random.default_rng(10)
+        cdps = CDPLedger()
+        indices = [cdps.open_cdp('debt_market', locked=10.0, drawn=drawn) for drawn in rng.uniform(1e5, 1e6, 20)]
+        for _ in range(5):
+            for index in indices:
+                cdps.wipe(index, rng.uniform(0, 0.1) * cdps.debt([index])[0])
+        for index in indices:
+            cdps.bite(index, v_bite=0.0, free=cdps.collateral([index])[0], u_bite=cdps.debt([index])[0], w_bite=0.0)
+        cdps.resync_totals()
+
+        # The debt of every CDP is settled exactly, but the difference of the column sums is a couple of ulps below zero
+        assert list(cdps.debt()) == [0.0] * 20
+        state = {'rai_drawn': cdps.total('drawn'), 'rai_wiped': cdps.total('wiped'), 'rai_bitten': cdps.total('u_bitten')}
+        assert -1e-8 < state['rai_drawn'] - state['rai_wiped'] - state['rai_bitten'] < -1e-10
+        s_update_principal_debt({}, 0, [], state, {})
+
+    @pytest.mark.parametrize('wipe', [True, False])
+    @pytest.mark.parametrize('goal_price', [None, 3.0, 3.2])
+    def test_cohort_trades(self, wipe, goal_price):
+        USD_balance, RAI_balance, amount, count = 3.1e6, 1e6, 500.0, 100
+
+        trades, USD_delta, RAI_delta = cohort_trades(wipe, amount, count, USD_balance, RAI_balance, 0.003, goal_price)
+        assert sum(members for members, _ in trades) == count
+
+        # Same trades one member at a time
+        sequential = []
+        sequential_USD_delta = sequential_RAI_delta = 0
+        for _ in range(count):
+            [(_, trade)], USD_trade, RAI_trade = cohort_trades(wipe, amount, 1, USD_balance + sequential_USD_delta,
+                                                               RAI_balance + sequential_RAI_delta, 0.003, goal_price)
+            sequential.append(trade)
+            sequential_USD_delta += USD_trade
+            sequential_RAI_delta += RAI_trade
+
+        assert np.allclose([trade for members, trade in trades for _ in range(members)], sequential, rtol=1e-9, atol=1e-9)
+        assert USD_delta == pytest.approx(sequential_USD_delta, rel=1e-9)
+        assert RAI_delta == pytest.approx(sequential_RAI_delta, rel=1e-9)
+
+    def test_cohort_split(self):
+        cdps = CDPLedger()
+        index = cdps.open_cdp('debt_market', locked=10.0, drawn=1000.0, count=200)
+        cdps.open_cdp('leverager', locked=5.0, drawn=300.0)
+        new_index = cdps.split(index, 50)
+        cdps.wipe(new_index, 100.0)
+
+        assert cdps.total('drawn') == 200 * 1000.0 + 300.0
+        assert cdps.total('wiped') == 50 * 100.0
+        assert list(cdps.select(open=1)) == [index, new_index, 1]
+        df = cdps.to_dataframe(expand=True)
+        assert len(df) == 201
+        assert list(df['wiped'][:150]) == [0.0] * 150
+        assert list(df['wiped'][150:200]) == [100.0] * 50
+
+    @pytest.mark.parametrize('seed', range(5))
+    @pytest.mark.parametrize('capped', [False, True])
+    def test_batch_trades(self, seed, capped):
+        rng = np.random.default_rng(seed)
+        rows = 40
+        USD_balance, RAI_balance = 3.1e6, 1e6
+        wipes = rng.uniform(size=rows) < 0.5
+        amounts = rng.uniform(0, 1000, size=rows)
+        counts = rng.integers(1, 6, size=rows)
+        goal_prices = np.where(wipes, rng.uniform(3.1, 3.15), rng.uniform(3.05, 3.1)) if capped else None
+
+        trades, USD_delta, RAI_delta = batch_trades(wipes, amounts, counts, USD_balance, RAI_balance, 0.003, goal_prices)
+
+        # Same trades one member at a time
+        sequential_USD_delta = sequential_RAI_delta = 0
+        for i in range(rows):
+            member_trades = [trade for members, trade in trades[i] for _ in range(members)]
+            assert len(member_trades) == counts[i]
+            for trade in member_trades:
+                [(_, expected)], USD_trade, RAI_trade = cohort_trades(wipes[i], amounts[i], 1, USD_balance + sequential_USD_delta,
+                                                                      RAI_balance + sequential_RAI_delta, 0.003,
+                                                                      None if goal_prices is None else goal_prices[i])
+                assert trade == pytest.approx(expected, rel=1e-9, abs=1e-6)
+                sequential_USD_delta += USD_trade
+                sequential_RAI_delta += RAI_trade
+        assert USD_delta == pytest.approx(sequential_USD_delta, rel=1e-9)
+        assert RAI_delta == pytest.approx(sequential_RAI_delta, rel=1e-9)
+
+
+def sequential_rebalance_cdps(params, state, cdps):
+    """
+    The original p_rebalance_cdps() loop, one SAFE at a time over the `cdps` DataFrame
+    """
+    eth_price = state["eth_price"]
+    target_price = state["target_price"]
+    liquidation_ratio = params["liquidation_ratio"]
+    liquidation_buffer = params["liquidation_buffer"]
+
+    RAI_balance = state['RAI_balance']
+    USD_balance = state['USD_balance']
+    uniswap_fee = params['uniswap_fee']
+
+    total_RAI_delta = 0
+    total_USD_delta = 0
+
+    rr_apy = target_rate_to_apy(state['target_rate'])
+
+    for index, cdp in cdps.query("open == 1 and (owner == 'debt_market' or owner == 'apt_model')").iterrows():
+        if cdp['arbitrage'] == 1:
+            liquidation_buffer = 1.0
+            continue
+
+        cdp_above_liquidation_buffer = is_cdp_above_liquidation_ratio(
+            cdp, eth_price, target_price, liquidation_ratio * liquidation_buffer
+        )
+
+        if not cdp_above_liquidation_buffer and rr_apy > params['min_redemption_rate']:
+            wipe_to_liq = wipe_to_liquidation_ratio(
+                cdp, eth_price, target_price, liquidation_ratio * liquidation_buffer, params["raise_on_assert"]
+            )
+            if params['max_redemption_rate'] == float("inf") or params['kp'] == 0:
+                wipe = wipe_to_liq
+            else:
+                wipe_apy = wipe_to_rr_apy(params['min_redemption_rate'], USD_balance, RAI_balance, eth_price, state, params)
+                wipe = min(wipe_to_liq, wipe_apy)
+
+            USD_delta, _ = get_output_price(wipe, USD_balance, RAI_balance, uniswap_fee)
+            if not USD_delta >= 0: raise failure.InvalidSecondaryMarketDeltaException(f'{USD_delta=}')
+            USD_balance += USD_delta
+            RAI_balance -= wipe
+            total_RAI_delta -= wipe
+            total_USD_delta += USD_delta
+            cdps.at[index, "wiped"] = cdps.at[index, "wiped"] + wipe
+
+        elif cdp_above_liquidation_buffer and rr_apy < params['max_redemption_rate']:
+            draw_to_liq = draw_to_liquidation_ratio(
+                cdp, eth_price, target_price, liquidation_ratio * liquidation_buffer, params["raise_on_assert"]
+            )
+            if params['max_redemption_rate'] == float("inf") or params['kp'] == 0:
+                draw = draw_to_liq
+            else:
+                draw_apy = draw_to_rr_apy(params['max_redemption_rate'], USD_balance, RAI_balance, eth_price, state, params)
+                draw = min(draw_to_liq, draw_apy)
+
+            _, USD_delta = get_input_price(draw, RAI_balance, USD_balance, uniswap_fee)
+            if not USD_delta <= 0: raise failure.InvalidSecondaryMarketDeltaException(f'{USD_delta=}')
+            USD_balance += USD_delta
+            RAI_balance += draw
+            total_RAI_delta += draw
+            total_USD_delta += USD_delta
+            cdps.at[index, "drawn"] = cdps.at[index, "drawn"] + draw
+
+    return cdps, total_RAI_delta, total_USD_delta
+
+
+@pytest.mark.parametrize('kp, USD_balance', [(0, 3.1e6), (5e-8, 3.579e6), (5e-8, 2.881e6)])
+def test_rebalance_cdps_matches_sequential(kp, USD_balance):
+    rng = np.random.default_rng(1)
+    cdps = CDPLedger()
+    cdps.open_cdp('leverager', locked=5.0, drawn=300.0)
+    for i in range(30):
+        # Cohorts and single SAFEs, with the arbitrage CDP part way through
+        if i == 20:
+            cdps.open_cdp('apt_model', locked=100.0, drawn=1000.0, arbitrage=1)
+        cdps.open_cdp('debt_market', locked=10.0, drawn=rng.uniform(200, 500), count=int(rng.integers(1, 4)))
+    params = {'debug': False, 'raise_on_assert': True, 'liquidation_ratio': 1.45, 'liquidation_buffer': 2.0,
+              'uniswap_fee': 0.003, 'kp': kp, 'min_redemption_rate': -50, 'max_redemption_rate': 50}
+    state = {'timestep': 2, 'cdps': cdps, 'eth_price': 300.0, 'target_price': 3.14, 'target_rate': 0.0,
+             'RAI_balance': 1e6, 'USD_balance': USD_balance}
+
+    original = cdps.to_dataframe(expand=True)
+    expected, RAI_delta, USD_delta = sequential_rebalance_cdps(params, state, original.copy())
+    result = p_rebalance_cdps(params, 0, [], state)
+    df = result['cdps'].to_dataframe(expand=True)
+
+    # Some SAFEs wipe and some draw
+    assert (expected['wiped'] > 0).any() and (expected['drawn'] > original['drawn']).any()
+    assert np.allclose(df['wiped'], expected['wiped'], rtol=1e-9, atol=1e-9)
+    assert np.allclose(df['drawn'], expected['drawn'], rtol=1e-9, atol=1e-9)
+    assert result['RAI_delta'] == pytest.approx(RAI_delta, rel=1e-9)
+    assert result['USD_delta'] == pytest.approx(USD_delta, rel=1e-9)
@@ -0,0 +1,50 @@
+import copy
+import experiments.system_model_v3.engine as bounded_engine
+import experiments.system_model_v3.lean_engine as lean_engine
+
+initial_state = {'x': 0.0, 'y': 0.0, 'items': [], 'seen': None}
+
+def p_a(params, substep, state_history, state):
+    return {'a': params['a']}
+
+def p_ab(params, substep, state_history, state):
+    return {'a': 2.0, 'b': [state['timestep']]}
+
+def s_x(params, substep, state_history, state, policy_input):
+    return 'x', state['x'] + policy_input['a'] + len(policy_input['b'])
+
+def p_items(params, substep, state_history, state):
+    items = state['items']
+    items.append(state['x'])
+    return {'items': items}
+
+def s_items(params, substep, state_history, state, policy_input):
+    policy_input['items'].append(state['substep'])
+    return 'items', policy_input['items']
+
+def s_y(params, substep, state_history, state, policy_input):
+    return 'y', state['x'] * 2 + state_history[-1][-1]['x']
+
+def s_seen(params, substep, state_history, state, policy_input):
+    return 'seen', (state['timestep'], state['substep'], state['y'])
+
+blocks = [
+    {'history': 1, 'policies': {'a': p_a, 'ab': p_ab}, 'variables': {'x': s_x}},
+    {'history': 1, 'policies': {'items': p_items}, 'variables': {'items': s_items}},
+    {'history': 1, 'policies': {}, 'variables': {'y': s_y, 'seen': s_seen}},
+]
+
+
+def test_lean_engine():
+    params = {'a': [1.0, 3.0]}
+    expected, _ = bounded_engine.run(initial_state, blocks, params, 10, runs=2)
+    results, exceptions = lean_engine.run(initial_state, blocks, params, 10, runs=2)
+    assert results == expected
+    assert len(results) == 4 * 11
+    assert [exception['exception'] for exception in exceptions] == [None] * 4
+
+
+def test_lean_engine_invalid_key():
+    results, error, _ = lean_engine.single_run(0, 10, 0, 0, copy.deepcopy(initial_state),
+                                               [{'policies': {}, 'variables': {'z': s_y}}], {'a': 1.0})
+    assert isinstance(error, KeyError)
@@ -0,0 +1,28 @@
+import copy
+import pickle
+import pytest
+import numpy as np
+import pandas as pd
+from models.system_model_v3.model.parts.exogenous import exogenous_series
+
+df = pd.DataFrame(np.random.default_rng(0).lognormal(5, 0.2, size=(50, 3)), columns=['0', '1', '2'])
+
+
+@pytest.mark.parametrize('trend', [0, 0.5, -1])
+def test_matches_dataframe(trend):
+    series = exogenous_series(__name__, 'df')
+    for run in [1, 2, 3]:
+        for timestep in range(len(df)):
+            expected = df[str(run-1)].iloc[timestep] + (timestep/len(df[str(run-1)]) * (trend * df[str(run-1)].iloc[-1]))
+            assert series(run, timestep, trend) == expected
+    assert series.path(2, trend).dtype == np.float64
+    assert not series.path(2, trend).flags.writeable
+
+
+def test_shared_by_reference():
+    series = exogenous_series(__name__, 'df')
+    path = series.path(1)
+    assert exogenous_series(__name__, 'df') is series
+    assert pickle.loads(pickle.dumps(series)) is series
+    assert copy.deepcopy({'eth_price': [series]})['eth_price'][0] is series
+    assert series.path(1) is path
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from models.system_model_v3.model.state_variables.historical_state import data_files
+
+# Cold import budget for the model definition, in seconds
+import_time_budget = 1.0
+
+repository = os.path.abspath(os.path.join(os.path.dirname(__file__), *[os.pardir] * 5))
+
+script = '''
+import json, sys, time
+start = time.perf_counter()
+import models.system_model_v3.model.params.init
+import models.system_model_v3.model.partial_state_update_blocks
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': [name for name in ('pandas', 'scipy.stats') if name in sys.modules]}))
+'''
+
+# Records the exogenous DataFrames loaded by importing an experiment entry point
+entry_point_script = '''
+import json, sys
+import models.system_model_v3.model.state_variables.historical_state as historical_state
+loaded = set()
+load = historical_state.load
+def recording_load(name):
+    loaded.add(name)
+    return load(name)
+historical_state.load = recording_load
+import {module}
+print(json.dumps(sorted(loaded)))
+'''
+
+
+def test_model_import_is_cheap():
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=repository)
+    result = json.loads(output)
+
+    # The params and blocks don't load the data files, pandas or scipy.stats
+    assert result['modules'] == []
+    assert result['elapsed'] < import_time_budget
+
+
+@pytest.mark.parametrize('module', ['experiments.system_model_v3.run', 'experiments.system_model_v3.recommended_params'])
+def test_experiment_import_loads_only_initial_eth_price(module):
+    for dependency in ['radcad', 'dill', 'pyarrow']:
+        pytest.importorskip(dependency)
+    if not all(os.path.exists(os.path.join(repository, path)) for path in data_files.values()):
+        pytest.skip('The Monte Carlo data files are not available')
+
+    output = subprocess.check_output([sys.executable, '-c', entry_point_script.format(module=module)], cwd=repository)
+
+    # The initial state needs the first ETH price, the other DataFrames are loaded by the runs
+    assert json.loads(output.splitlines()[-1]) == ['eth_price_df']
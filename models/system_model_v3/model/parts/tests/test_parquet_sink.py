@@ -0,0 +1,53 @@
+import pytest
+import experiments.system_model_v3.lean_engine as lean_engine
+from models.system_model_v3.model.parts.rate_traders import RateTraders
+
+pytest.importorskip('pyarrow')
+from experiments.system_model_v3.parquet_sink import ParquetSink, load_results
+
+initial_state = {'x': 0.0, 'metrics': {}, 'traders': RateTraders([], [], [], [], [], [])}
+
+def p_a(params, substep, state_history, state):
+    return {'a': params['a']}
+
+def s_x(params, substep, state_history, state, policy_input):
+    return 'x', state['x'] + policy_input['a']
+
+def s_metrics(params, substep, state_history, state, policy_input):
+    return 'metrics', {'x': state['x'], 'nested': {'double': state['x'] * 2}}
+
+def s_traders(params, substep, state_history, state, policy_input):
+    count = state['timestep'] % 3
+    return 'traders', RateTraders([state['x']] * count, [1.0] * count, [2.0] * count, [3.0] * count, [0] * count, [0] * count)
+
+blocks = [
+    {'history': 1, 'policies': {'a': p_a}, 'variables': {'x': s_x, 'metrics': s_metrics, 'traders': s_traders}},
+]
+params = {'a': [1.0, 3.0]}
+
+
+def test_parquet_sink(tmp_path):
+    expected, _ = lean_engine.run(initial_state, blocks, params, 10, runs=2)
+    sink = ParquetSink(str(tmp_path))
+    results, exceptions = lean_engine.run(initial_state, blocks, params, 10, runs=2, sink=sink)
+    sink.write_exceptions(exceptions)
+    assert results == []
+
+    df = load_results(str(tmp_path))
+    assert len(df) == len(expected)
+    assert set(df.columns) == {'simulation', 'subset', 'run', 'substep', 'timestep', 'x'}
+    for row in expected:
+        loaded = df[(df.subset == row['subset']) & (df.run == row['run']) & (df.timestep == row['timestep'])]
+        assert loaded.x.item() == row['x']
+
+    df = load_results(str(tmp_path), runs=[2], subsets=[1], columns=['x'])
+    assert list(df.columns) == ['subset', 'run', 'timestep', 'x']
+    assert list(df.timestep) == list(range(11))
+    assert list(df.x) == [row['x'] for row in expected if (row['run'], row['subset']) == (2, 1)]
+
+    metrics = load_results(str(tmp_path), 'metrics', runs=[1], subsets=[0])
+    assert list(metrics['nested.double']) == [row['metrics']['nested']['double'] for row in expected[1:11]]
+
+    traders = load_results(str(tmp_path), 'traders', runs=[1], subsets=[0])
+    rows = [(row['timestep'], item, trader['rai_balance']) for row in expected[:11] for item, trader in enumerate(row['traders'])]
+    assert list(zip(traders.timestep, traders.item, traders.rai_balance)) == rows
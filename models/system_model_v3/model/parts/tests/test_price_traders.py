@@ -0,0 +1,101 @@
+import math
+import numpy as np
+import pytest
+import models.system_model_v3.model.parts.price_traders as price_traders
+from models.system_model_v3.model.parts.price_traders import PriceTraders, p_trade_price
+from models.system_model_v3.model.parts.uniswap import get_input_price, get_output_price
+
+params = {'debug': False, 'uniswap_fee': 0.003, 'trader_market_premium': 1.0, 'rng_seed': 0}
+
+
+def sequential_trade_price(params, state):
+    """
+    The traders trading one by one in order of the bounds, as the loop p_trade_price used before trade_price_sorted
+    """
+    RAI_balance = state['RAI_balance']
+    ETH_balance = state['ETH_balance']
+    redemption_price = state['target_price'] * params['trader_market_premium']
+    eth_price = state['eth_price']
+    market_price = ETH_balance/RAI_balance * eth_price
+    uniswap_fee = params['uniswap_fee']
+
+    total_RAI_delta = 0
+    total_ETH_delta = 0
+    traders = state['price_traders'].sorted()
+    for i in range(len(traders)):
+        trader_rai_balance = traders.rai_balance[i]
+        trader_base_balance = traders.base_balance[i]
+        price_trader_bound = traders.pct_bound[i] / 100
+
+        expensive_RAI_on_secondary_market = redemption_price * (1 + price_trader_bound) < (1 - uniswap_fee) * market_price
+        cheap_RAI_on_secondary_market = redemption_price * (1 - price_trader_bound) > (1 - uniswap_fee) * market_price
+
+        if expensive_RAI_on_secondary_market and trader_rai_balance > 0:
+            desired_eth_rai = ETH_balance/RAI_balance * (redemption_price/market_price)
+            a = math.sqrt(RAI_balance * ETH_balance/desired_eth_rai) - RAI_balance
+            RAI_delta = min(trader_rai_balance, a)
+            _, ETH_delta = get_input_price(RAI_delta, RAI_balance, ETH_balance, uniswap_fee)
+
+            traders.rai_balance[i] += -RAI_delta
+            traders.base_balance[i] += -ETH_delta * eth_price
+            total_RAI_delta += RAI_delta
+            total_ETH_delta += ETH_delta
+            RAI_balance += RAI_delta
+            ETH_balance += ETH_delta
+            market_price = ETH_balance/RAI_balance * eth_price
+        elif cheap_RAI_on_secondary_market and trader_base_balance > 0:
+            desired_eth_rai = ETH_balance/RAI_balance * (redemption_price/market_price)
+            a = math.sqrt(RAI_balance * ETH_balance/desired_eth_rai) - RAI_balance
+            RAI_delta = min(int(trader_base_balance / market_price), -a)
+            ETH_delta = 0
+            if RAI_delta > 0:
+                ETH_delta, _ = get_output_price(RAI_delta, ETH_balance, RAI_balance, uniswap_fee)
+
+            traders.rai_balance[i] += RAI_delta
+            traders.base_balance[i] += -ETH_delta * eth_price
+            total_RAI_delta += -RAI_delta
+            total_ETH_delta += ETH_delta
+            RAI_balance += -RAI_delta
+            ETH_balance += ETH_delta
+            market_price = ETH_balance/RAI_balance * eth_price
+
+    return traders, total_RAI_delta, total_ETH_delta
+
+
+@pytest.mark.parametrize('market_price', [2.5, 2.9, 3.1, 3.5])
+@pytest.mark.parametrize('balance', [10, 1000, 1e6])
+@pytest.mark.parametrize('base_balance', [1e3, 1e4, 1e6])
+def test_trade_price(monkeypatch, market_price, balance, base_balance):
+    rng = np.random.default_rng(0)
+    count = 50
+    traders = PriceTraders(rai_balance=np.where(rng.random(count) < 0.2, 0.0, balance),
+                           # The RAI the traders can buy changes between the traders' turns
+                           base_balance=np.where(rng.random(count) < 0.2, 0.0, rng.uniform(0.5, 1.5, count) * base_balance),
+                           pct_bound=rng.uniform(1, 10, count))
+    eth_price = 2000
+    state = {'subset': 0, 'run': 1, 'timestep': 2, 'RAI_balance': 1e6, 'ETH_balance': 1e6 * market_price / eth_price, 'UNI_supply': 1e6,
+             'eth_price': eth_price, 'target_price': 3.0, 'price_traders': traders}
+
+    result = p_trade_price({**params, 'price_trader_random_order': False}, 0, [], state)
+
+    # The same as trading one by one in order of the bounds
+    expected_traders, expected_RAI_delta, expected_ETH_delta = sequential_trade_price(params, state)
+    assert result['RAI_delta'] == pytest.approx(expected_RAI_delta, rel=1e-9, abs=1e-9)
+    assert result['ETH_delta'] == pytest.approx(expected_ETH_delta, rel=1e-9, abs=1e-12)
+    np.testing.assert_allclose(result['price_traders'].rai_balance, expected_traders.rai_balance, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(result['price_traders'].base_balance, expected_traders.base_balance, rtol=1e-9, atol=1e-9)
+    assert result['price_traders'].rai_balance.sum() + result['RAI_delta'] == pytest.approx(traders.rai_balance.sum())
+
+    # So is trading in random order, in the order of the bounds
+    class InOrder():
+        def permutation(self, n):
+            return np.arange(n)
+    monkeypatch.setattr(price_traders, 'random_stream', lambda params, state, stream: InOrder())
+    random_order = p_trade_price({**params, 'price_trader_random_order': True}, 0, [], {**state, 'price_traders': traders.sorted()})
+    assert random_order['RAI_delta'] == expected_RAI_delta
+    assert random_order['ETH_delta'] == expected_ETH_delta
+    np.testing.assert_array_equal(random_order['price_traders'].rai_balance, expected_traders.rai_balance)
+    np.testing.assert_array_equal(random_order['price_traders'].base_balance, expected_traders.base_balance)
+
+    # The state's traders are unchanged
+    assert np.all(state['price_traders'].rai_balance[state['price_traders'].rai_balance > 0] == balance)
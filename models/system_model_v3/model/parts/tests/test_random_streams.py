@@ -0,0 +1,26 @@
+import numpy as np
+from models.utils.random_streams import generator, reset
+
+
+def test_generator():
+    draws = generator(0, 0, 1, 'rate_traders', 5).random(10)
+
+    # Drawing from other streams, runs and timesteps in between doesn't change the draws
+    generator(0, 0, 1, 'rate_traders', 6).random(100)
+    generator(0, 0, 2, 'rate_traders', 5).random(100)
+    generator(0, 0, 1, 'liquidity_demand', 5).random(100)
+    assert np.array_equal(generator(0, 0, 1, 'rate_traders', 5).random(10), draws)
+
+    # Every stream, run, subset, seed and timestep has its own draws
+    for key in [(1, 0, 1, 'rate_traders', 5), (0, 1, 1, 'rate_traders', 5), (0, 0, 2, 'rate_traders', 5),
+                (0, 0, 1, 'price_traders', 5), (0, 0, 1, 'rate_traders', 4)]:
+        assert not np.any(np.isin(generator(*key).random(10), draws))
+
+
+def test_generator_calls():
+    draws = generator(0, 0, 1, 'rate_traders', 7).random(10)
+
+    # Another call in the same timestep continues with other draws, and a replay of the timestep gets the same draws again
+    assert not np.any(np.isin(generator(0, 0, 1, 'rate_traders', 7).random(10), draws))
+    reset()
+    assert np.array_equal(generator(0, 0, 1, 'rate_traders', 7).random(10), draws)
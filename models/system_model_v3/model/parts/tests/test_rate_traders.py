@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import models.system_model_v3.model.parts.rate_traders as rate_traders
+from models.system_model_v3.model.parts.rate_traders import RateTraders, p_trade_rate
+from models.system_model_v3.model.parts.utils import random_stream
+from models.utils import random_streams
+from models.system_model_v3.model.parts.uniswap import get_output_price, get_input_price, buy_to_price, sell_to_price
+
+params = {'debug': False, 'uniswap_fee': 0.003, 'trader_market_premium': 1.0, 'rng_seed': 0}
+
+
+def trade_rate(traders, state):
+    # Traders as dicts, processed one by one
+    rng = random_stream(params, state, 'rate_traders')
+    order = rng.permutation(len(traders))
+    trade_ratios = rng.uniform(0.1, 0.5, len(traders))
+    RAI_balance = state['RAI_balance']
+    USD_balance = state['USD_balance']
+    fee = params['uniswap_fee']
+    updated_traders = []
+    for i, trader in enumerate(traders[i] for i in order):
+        trader = dict(trader)
+        redemption_price = state['target_price'] * (1 + state['target_rate']) ** (86400 * trader['days'])
+        market_price = USD_balance/RAI_balance
+        bound = trader['pct_bound'] / 100
+        trade_ratio = trade_ratios[i]
+        if redemption_price * (1 + bound) < (1 - fee) * market_price and trader['rai_balance'] > 0:
+            RAI_delta = min(trader['rai_balance'], sell_to_price(USD_balance, RAI_balance, redemption_price, market_price) * trade_ratio)
+            if RAI_delta > 0:
+                _, USD_delta = get_input_price(RAI_delta, RAI_balance, USD_balance, fee)
+                trader['rai_balance'] -= RAI_delta
+                trader['base_balance'] -= USD_delta
+                trader['n_sells'] += 1
+                RAI_balance += RAI_delta
+                USD_balance += USD_delta
+        elif redemption_price * (1 - bound) > (1 + fee) * market_price and trader['base_balance'] > 0:
+            _, rai_delta_all = get_input_price(trader['base_balance'], USD_balance, RAI_balance, fee)
+            RAI_delta = min(-rai_delta_all, buy_to_price(USD_balance, RAI_balance, redemption_price, market_price) * trade_ratio)
+            if RAI_delta > 0:
+                USD_delta, _ = get_output_price(RAI_delta, USD_balance, RAI_balance, fee)
+                trader['rai_balance'] += RAI_delta
+                trader['base_balance'] -= USD_delta
+                trader['n_buys'] += 1
+                RAI_balance -= RAI_delta
+                USD_balance += USD_delta
+        updated_traders.append(trader)
+    return updated_traders, RAI_balance - state['RAI_balance'], USD_balance - state['USD_balance']
+
+
+@pytest.mark.parametrize('trader_chunk', [64, 3])
+def test_trade_rate(trader_chunk, monkeypatch):
+    monkeypatch.setattr(rate_traders, 'trader_chunk', trader_chunk)
+    rng = np.random.default_rng(0)
+    count = 50
+    traders = RateTraders(rai_balance=np.where(rng.random(count) < 0.2, 0.0, 1000.0),
+                          base_balance=np.where(rng.random(count) < 0.2, 0.0, 3000.0),
+                          days=np.zeros(count), pct_bound=rng.uniform(1, 10, count),
+                          n_buys=np.zeros(count), n_sells=np.zeros(count))
+    for market_price in [2.5, 3.0, 3.5]:
+        state = {'subset': 0, 'run': 1, 'timestep': 2, 'RAI_balance': 1e6, 'USD_balance': 1e6 * market_price, 'UNI_supply': 1e6,
+                 'eth_price': 2000, 'target_price': 3.0, 'target_rate': 0, 'rate_traders': traders}
+
+        # Both draw from the start of the stream at the timestep
+        random_streams.reset()
+        expected, RAI_delta, USD_delta = trade_rate(list(traders), state)
+        random_streams.reset()
+        result = p_trade_rate(params, 0, [], state)
+        assert list(result['rate_traders']) == expected
+        assert result['RAI_delta'] == pytest.approx(RAI_delta)
+        assert result['USD_delta'] == pytest.approx(USD_delta)
+        assert sum(trader['n_buys'] + trader['n_sells'] for trader in expected) > 0
+        traders = result['rate_traders']
+
+    # The state's traders are unchanged
+    assert list(state['rate_traders']) != list(traders)
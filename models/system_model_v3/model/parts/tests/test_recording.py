@@ -0,0 +1,58 @@
+import math
+import pytest
+import experiments.system_model_v3.engine as bounded_engine
+import experiments.system_model_v3.lean_engine as lean_engine
+from experiments.system_model_v3.recording import RecordingSpec
+
+initial_state = {'x': 0.0, 'y': 0.0}
+
+def p_a(params, substep, state_history, state):
+    return {'a': params['a']}
+
+def s_x(params, substep, state_history, state, policy_input):
+    return 'x', state['x'] + policy_input['a'] * (-1) ** state['timestep']
+
+def s_y(params, substep, state_history, state, policy_input):
+    return 'y', state['x'] * 2
+
+blocks = [
+    {'history': 1, 'policies': {'a': p_a}, 'variables': {'x': s_x}},
+    {'history': 1, 'policies': {}, 'variables': {'y': s_y}},
+]
+params = {'a': [1.0, 3.0]}
+
+
+@pytest.mark.parametrize('engine', [bounded_engine, lean_engine])
+def test_recording_spec(engine):
+    full, _ = engine.run(initial_state, blocks, params, 10, runs=2)
+    spec = RecordingSpec(['y'], every=4, reducers={'x': ['mean', 'min', 'max', 'last']})
+    results, _ = engine.run(initial_state, blocks, params, 10, runs=2, record=spec)
+
+    # Initial state, timesteps 4 and 8, and the final timestep of each run
+    assert [row['timestep'] for row in results] == [0, 4, 8, 10] * 4
+    assert set(results[1]) == {'simulation', 'subset', 'run', 'substep', 'timestep', 'y',
+                               'x_mean', 'x_min', 'x_max', 'x_last'}
+    for row in results:
+        states = [state for state in full if (state['run'], state['subset']) == (row['run'], row['subset'])]
+        end = row['timestep']
+        start = 0 if end == 0 else end - 4 if end % 4 == 0 else end - end % 4
+        window = [state['x'] for state in states if (start < state['timestep'] <= end) or state['timestep'] == end]
+        assert row['y'] == states[end]['y']
+        assert row['x_last'] == states[end]['x']
+        assert row['x_mean'] == pytest.approx(sum(window) / len(window))
+        assert row['x_min'] == min(window)
+        assert row['x_max'] == max(window)
+
+
+def test_recording_defaults():
+    full, _ = lean_engine.run(initial_state, blocks, params, 10)
+    assert lean_engine.run(initial_state, blocks, params, 10, record=RecordingSpec())[0] == full
+
+    final, _ = lean_engine.run(initial_state, blocks, params, 10, record=False)
+    assert lean_engine.run(initial_state, blocks, params, 10, record=RecordingSpec(every=math.inf))[0] == final
+    assert [row['timestep'] for row in final] == [0, 10, 0, 10]
+
+
+def test_unknown_reducer():
+    with pytest.raises(ValueError):
+        RecordingSpec(reducers={'x': 'median'})
@@ -0,0 +1,76 @@
+import statistics
+import pytest
+import numpy as np
+import pandas as pd
+from models.system_model_v3.model.parts.running_moments import RunningMoments
+from models.system_model_v3.model.parts.apt_model import p_resolve_expected_market_price
+
+
+values = list(np.random.default_rng(0).lognormal(5, 0.5, size=500))
+
+
+def test_cumulative():
+    moments = RunningMoments()
+    for i, value in enumerate(values):
+        moments = moments.update(value)
+        if i % 50 == 1:
+            assert moments.count == i + 1
+            assert moments.mean == pytest.approx(statistics.mean(values[:i + 1]), rel=1e-12)
+            assert moments.variance == pytest.approx(statistics.variance(values[:i + 1]), rel=1e-9)
+
+
+@pytest.mark.parametrize('window', [2, 7, 100])
+def test_window(window):
+    series = pd.Series(values)
+    means = series.rolling(window, min_periods=1).mean()
+    variances = series.rolling(window, min_periods=2).var()
+
+    moments = RunningMoments(window=window)
+    for i, value in enumerate(values):
+        moments = moments.update(value)
+        assert moments.count == min(i + 1, window)
+        assert moments.mean == pytest.approx(means[i], rel=1e-9)
+        if i > 0:
+            assert moments.variance == pytest.approx(variances[i], rel=1e-6)
+
+
+def test_ewm():
+    series = pd.Series(values)
+    means = series.ewm(alpha=0.1, adjust=False).mean()
+
+    moments = RunningMoments(alpha=0.1)
+    for i, value in enumerate(values):
+        moments = moments.update(value)
+        assert moments.mean == pytest.approx(means[i], rel=1e-12)
+
+
+def test_immutable():
+    moments = RunningMoments(window=3)
+    for value in [1.0, 2.0, 3.0, 4.0]:
+        moments = moments.update(value)
+
+    # Branching from the same moments keeps both branches independent
+    first = moments.update(10.0)
+    second = moments.update(-10.0)
+    assert moments.mean == pytest.approx(3.0)
+    assert first.mean == pytest.approx(17.0 / 3)
+    assert second.mean == pytest.approx(-3.0 / 3)
+    assert first.update(0.0).mean == pytest.approx(14.0 / 3)
+
+
+def test_apt_price_means():
+    params = {'debug': False, 'interest_rate': 1.0, 'beta_1': 1.0, 'beta_2': 0.0,
+              'apt_moments_window': None, 'apt_moments_alpha': None}
+    state = {'eth_price': values[0], 'market_price': 3.0, 'liquidity_demand': 1, 'liquidity_demand_mean': 1,
+             'eth_price_moments': RunningMoments(), 'market_price_moments': RunningMoments()}
+    state_history = [[dict(state)]]
+    for value in values[1:100]:
+        signals = p_resolve_expected_market_price(params, 0, state_history, state)
+        state.update(eth_price_moments=signals['eth_price_moments'], market_price_moments=signals['market_price_moments'])
+
+        # The means are over the final states of all previous timesteps, as the full state history
+        eth_prices = [substates[-1]['eth_price'] for substates in state_history]
+        assert state['eth_price_moments'].mean == pytest.approx(statistics.mean(eth_prices), rel=1e-12)
+        assert state['market_price_moments'].count == len(state_history)
+        state['eth_price'] = value
+        state_history.append([dict(state)])
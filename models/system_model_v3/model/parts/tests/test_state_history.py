@@ -0,0 +1,40 @@
+import pytest
+from models.system_model_v3.model.parts.state_history import StateHistory, history_depth
+
+
+def test_state_history_matches_list():
+    full = [[{'timestep': 0}]]
+    history = StateHistory(full[0], depth=4)
+    for timestep in range(1, 20):
+        substates = [{'timestep': timestep}]
+        full.append(substates)
+        history.append(substates)
+
+        assert len(history) == len(full)
+        assert history[0] is full[0]
+        for index in range(1, min(4, timestep) + 1):
+            assert history[-index] is full[-index]
+            assert history[len(full) - index] is full[-index]
+
+    with pytest.raises(IndexError):
+        history[-5]
+    with pytest.raises(IndexError):
+        history[20]
+
+
+def test_unbounded_state_history():
+    history = StateHistory([{'timestep': 0}])
+    for timestep in range(1, 10):
+        history.append([{'timestep': timestep}])
+    assert [history[index][-1]['timestep'] for index in range(len(history))] == list(range(10))
+
+
+def test_history_depth():
+    assert history_depth([{'history': 2}, {'history': 0}, {'history': 4}]) == 4
+    assert history_depth([{'history': 2}, {}]) is None
+    assert history_depth([]) == 0
+
+
+def test_partial_state_update_blocks_declare_history():
+    from models.system_model_v3.model.partial_state_update_blocks import partial_state_update_blocks
+    assert history_depth(partial_state_update_blocks) == 4
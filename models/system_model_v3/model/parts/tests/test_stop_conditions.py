@@ -0,0 +1,115 @@
+import math
+import pickle
+import pytest
+import experiments.system_model_v3.engine as bounded_engine
+import experiments.system_model_v3.lean_engine as lean_engine
+import experiments.system_model_v3.warm_up as warm_up
+from experiments.system_model_v3.checkpoint import Checkpointer
+import models.system_model_v3.model.parts.failure_modes as failure
+from experiments.system_model_v3.stop_conditions import RunStopped, OnException, OutOfBounds, Diverges, redemption_apy
+
+initial_state = {'price': 1.0, 'reference': 1.0, 'balance': 10.0}
+
+def s_price(params, substep, state_history, state, policy_input):
+    return 'price', state['price'] * params['growth']
+
+def s_balance(params, substep, state_history, state, policy_input):
+    balance = state['balance'] - params['spend']
+    if balance < 0:
+        raise failure.NegativeBalanceException(balance)
+    return 'balance', balance
+
+blocks = [
+    {'policies': {}, 'variables': {'price': s_price}},
+    {'policies': {}, 'variables': {'balance': s_balance}},
+]
+params = {'growth': [1.0, 1.1, 1.0], 'spend': [0.0, 0.0, 3.0]}
+
+
+@pytest.mark.parametrize('engine', [bounded_engine, lean_engine])
+def test_stop_conditions(engine):
+    stop_conditions = [OnException(failure.NegativeBalanceException), OutOfBounds('price', upper=2)]
+    results, exceptions = engine.run(initial_state, blocks, params, 20, stop_conditions=stop_conditions)
+
+    assert exceptions[0]['exception'] is None
+    assert len([row for row in results if row['subset'] == 0]) == 21
+
+    # 1.1 ** 8 > 2
+    stop = exceptions[1]['exception']
+    assert isinstance(stop, RunStopped)
+    assert stop.timestep == 8 and stop.state['timestep'] == 8
+    assert 'price' in stop.reason
+    assert exceptions[1]['traceback'] is None
+    assert [row['timestep'] for row in results if row['subset'] == 1] == list(range(9))
+
+    # The balance would be negative in timestep 4, so the run stops with timestep 3
+    stop = exceptions[2]['exception']
+    assert isinstance(stop, RunStopped)
+    assert stop.timestep == 4 and stop.state['timestep'] == 3 and stop.state['balance'] == 1.0
+    assert isinstance(stop.__cause__, failure.NegativeBalanceException)
+    assert results[-1] == stop.state
+
+
+def test_stop_conditions_recording():
+    stop_conditions = [OutOfBounds('price', upper=2)]
+    results, _ = lean_engine.run(initial_state, blocks, params, 20, record=False, stop_conditions=stop_conditions)
+    assert [row['timestep'] for row in results if row['subset'] == 1] == [0, 8]
+
+
+def test_unhandled_exceptions():
+    results, exceptions = lean_engine.run(initial_state, blocks, params, 20, stop_conditions=[OnException(OverflowError)])
+    assert isinstance(exceptions[2]['exception'], failure.NegativeBalanceException)
+    assert exceptions[2]['traceback'] is not None
+
+    # Stopped runs aren't raised
+    lean_engine.run(initial_state, blocks, {'growth': [2.0], 'spend': [0.0]}, 5, raise_exceptions=True,
+                    stop_conditions=[OutOfBounds('price', upper=2)])
+    with pytest.raises(failure.NegativeBalanceException):
+        lean_engine.run(initial_state, blocks, params, 20, raise_exceptions=True)
+
+
+def test_out_of_bounds():
+    condition = OutOfBounds('price', 0.5, 2)
+    assert condition.reason({'price': 1.0}, {}) is None
+    assert condition.reason({'price': 0.1}, {}) is not None
+    assert condition.reason({'price': math.nan}, {}) is not None
+
+    condition = OutOfBounds(redemption_apy, -99, 1e4)
+    assert condition.reason({'target_rate': 0}, {}) is None
+    assert 'redemption_apy' in condition.reason({'target_rate': 1e-6}, {})
+
+
+def test_diverges():
+    condition = Diverges('price', 'reference', 0.5, timesteps=3)
+    memory = {}
+    for price in [1.0, 2.0, 2.0, 1.2, 2.0, 2.0]:
+        assert condition.reason({'price': price, 'reference': 1.0}, memory) is None
+    assert condition.reason({'price': 2.0, 'reference': 1.0}, memory) is not None
+    # Another run
+    assert condition.reason({'price': 2.0, 'reference': 1.0}, {}) is None
+
+
+@pytest.mark.parametrize('engine', [bounded_engine, lean_engine])
+def test_diverges_resumed(tmp_path, engine):
+    # 1.1 ** 5 > 1.5, so the price diverges from timestep 5, and the run stops in timestep 7
+    stop_conditions = [Diverges('price', 'reference', 0.5, timesteps=3)]
+    diverging = {'growth': [1.1], 'spend': [0.0]}
+    _, exceptions = engine.run(initial_state, blocks, diverging, 20, stop_conditions=stop_conditions)
+    assert exceptions[0]['exception'].timestep == 7
+
+    # Resumed from the checkpoint at the end of timestep 6, two timesteps into the streak
+    checkpoint = Checkpointer(str(tmp_path), every=2)
+    engine.run(initial_state, blocks, diverging, 6, checkpoint=checkpoint, stop_conditions=stop_conditions)
+    _, exceptions = engine.run(initial_state, blocks, diverging, 20, checkpoint=checkpoint, stop_conditions=stop_conditions)
+    assert exceptions[0]['exception'].timestep == 7
+
+    # Forked from a warm-up of 6 timesteps
+    _, exceptions = warm_up.run(initial_state, blocks, {'growth': [1.1], 'spend': [0.0, 0.1]}, 20, 6,
+                                single_run=engine.single_run, stop_conditions=stop_conditions)
+    assert [exception['exception'].timestep for exception in exceptions] == [7, 7]
+
+
+def test_run_stopped_pickles():
+    stop = pickle.loads(pickle.dumps(RunStopped('price out of bounds', 8, {'price': 2.1})))
+    assert (stop.reason, stop.timestep, stop.state) == ('price out of bounds', 8, {'price': 2.1})
+    assert repr(stop) == "RunStopped('price out of bounds', 8)"
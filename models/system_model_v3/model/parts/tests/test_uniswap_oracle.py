@@ -35,6 +35,9 @@ eth_balances = [x[0] for x in data]
 rai_balances = [x[1] for x in data]
 eth_prices = [x[2] for x in data]
 
+# Median prices from the mutable, deque based implementation
+median_prices = [0, 0, 0, 0, 0, 0, 0, 0, 3.627964889271712, 3.627964889271712, 3.627964889271712, 3.627964889271712, 3.49122639682476, 3.49122639682476, 3.49122639682476, 3.49122639682476, 3.2077092753548544, 3.2077092753548544]
+
 #@pytest.mark.skip('tmp')
 class TestUniswapOracle:
     def test_deepcopy_speed(self):
@@ -44,7 +47,7 @@ class TestUniswapOracle:
                    'eth_price': eth_prices[i], 'cumulative_time': cumulative_times[i]} for i in range(len(cumulative_times))]
         s = time.time()
         for state in states:
-            o.update_result(state)
+            o = o.update_result(state)
             copy.deepcopy(o)
         print(f"took {time.time() - s} secs")
 
@@ -55,8 +58,27 @@ class TestUniswapOracle:
                    'eth_price': eth_prices[i], 'cumulative_time': cumulative_times[i]} for i in range(len(cumulative_times))]
         for i, state in enumerate(states):
             rai_usd = state['ETH_balance'] / state['RAI_balance'] * state['eth_price']
-            o.update_result(state)
+            o = o.update_result(state)
             #print(o.converter_feed_observations)
             #print(o.uniswap_observations)
             print(f"{i=}, {rai_usd=}, {o.median_price=}")
+            assert o.median_price == pytest.approx(median_prices[i], rel=1e-15)
+
+    def test_immutable(self):
+        o = UniswapOracle(granularity=4, window_size=16*3600, max_window_size=21*3600)
+
+        states = [{'RAI_balance': rai_balances[i], 'ETH_balance': eth_balances[i],
+                   'eth_price': eth_prices[i], 'cumulative_time': cumulative_times[i]} for i in range(len(cumulative_times))]
+        history = [o]
+        for state in states:
+            history.append(history[-1].update_result(state))
+
+        # Updating an earlier oracle again gives the same results, and leaves the later oracles unchanged
+        for i in [0, 5, 11]:
+            o = history[i]
+            for j, state in enumerate(states[i:]):
+                o = o.update_result(state)
+                assert o.median_price == median_prices[i + j]
+        assert [o.median_price for o in history[1:]] == median_prices
+        assert history[0].updates == 0 and len(history[0].uniswap_observations) == 0
 
@@ -0,0 +1,35 @@
+from decimal import Decimal
+import numpy as np
+import pytest
+from models.constants import SPY
+from models.system_model_v3.model.parts.utils import growth_factor, target_rate_to_apy, apy_to_target_rate
+
+
+@pytest.mark.parametrize('rate', [0, 1e-9, -1e-9, 3.2e-8, -5e-7])
+@pytest.mark.parametrize('seconds', [0, 3600, 86400 * 2.5, SPY])
+def test_growth_factor(rate, seconds):
+    expected = (1 + Decimal(rate)) ** Decimal(seconds)
+    assert growth_factor(rate, seconds) == pytest.approx(float(expected), rel=1e-13)
+    assert growth_factor(rate, seconds, minus_one=True) == pytest.approx(float(expected - 1), rel=1e-9, abs=1e-300)
+
+
+def test_growth_factor_overflow():
+    # exp() would overflow, the factor is computed with Decimal
+    assert growth_factor(1e-3, 1e6) == float('inf')
+    assert growth_factor(-1e-3, 1e6) == 0
+    # Just inside the range of exp(), on the float path
+    assert growth_factor(1e-4, 7e6) == pytest.approx(float((1 + Decimal(1e-4)) ** Decimal(7e6)), rel=1e-12)
+
+
+def test_growth_factor_array():
+    seconds = np.array([0, 3600, 86400 * 2.5, SPY, 1e6, 7e6])
+    for rate in [3.2e-8, 1e-3, -1e-3]:
+        factors = growth_factor(rate, seconds)
+        assert factors.shape == seconds.shape
+        assert list(factors) == [growth_factor(rate, value) for value in seconds]
+
+
+def test_apy():
+    assert target_rate_to_apy(0) == 0
+    assert target_rate_to_apy(apy_to_target_rate(2)) == pytest.approx(2, rel=1e-9)
+    assert target_rate_to_apy(apy_to_target_rate(-20)) == pytest.approx(-20, rel=1e-9)
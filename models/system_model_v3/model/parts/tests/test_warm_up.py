@@ -0,0 +1,84 @@
+import numpy as np
+import experiments.system_model_v3.engine as bounded_engine
+import experiments.system_model_v3.lean_engine as lean_engine
+import experiments.system_model_v3.warm_up as warm_up
+from experiments.system_model_v3.recording import RecordingSpec
+from models.system_model_v3.model.parts.utils import random_stream
+
+initial_state = {'x': 1.0, 'rate': 0.0, 'calls': 0}
+calls = []
+
+def p_enabled(params, substep, state_history, state):
+    return {'enabled': state['timestep'] > params['enable_time']}
+
+def s_rate(params, substep, state_history, state, policy_input):
+    if not policy_input['enabled']:
+        return 'rate', 0.0
+    return 'rate', params['kp'] * (1 - state['x'])
+
+def s_x(params, substep, state_history, state, policy_input):
+    calls.append(state['timestep'])
+    noise = random_stream(params, state, 'noise').normal(0, params['volatility'])
+    return 'x', state['x'] * (1 + state['rate'] + noise)
+
+blocks = [
+    {'history': 1, 'policies': {'enabled': p_enabled}, 'variables': {'rate': s_rate}},
+    {'history': 1, 'policies': {}, 'variables': {'x': s_x}},
+]
+params = {
+    'rng_seed': [0],
+    'enable_time': [5],
+    'kp': [0.1, 0.2, 0.1, 0.5],
+    'volatility': [0.01, 0.01, 0.02, 0.01],
+}
+
+
+def s_x_shared(params, substep, state_history, state, policy_input):
+    # Subsets 1 and 3 draw with subset 0 in the warm-up, which they are forked from
+    if state['timestep'] <= 5 and state['subset'] in (1, 3):
+        state = dict(state, subset=0)
+    return s_x(params, substep, state_history, state, policy_input)
+
+shared_blocks = [blocks[0], {'history': 1, 'policies': {}, 'variables': {'x': s_x_shared}}]
+
+
+def test_subsets_draw_differently():
+    results, _ = lean_engine.run(initial_state, blocks, params, 5)
+    x = {(row['subset'], row['timestep']): row['x'] for row in results}
+    # Subsets 0 and 1 only differ in `kp`, which isn't used until timestep 5
+    assert all(x[(0, timestep)] != x[(1, timestep)] for timestep in range(1, 6))
+
+
+def test_warm_up_is_shared():
+    expected, expected_exceptions = lean_engine.run(initial_state, shared_blocks, params, 20, runs=2)
+    calls.clear()
+    results, exceptions = warm_up.run(initial_state, blocks, params, 20, warm_up_timesteps=5, runs=2)
+    assert results == expected
+    assert [exception['subset'] for exception in exceptions] == [exception['subset'] for exception in expected_exceptions]
+
+    # Only `volatility` is read in the warm-up, so subsets 0, 1 and 3 share one
+    assert len(calls) == 2 * (2 * 5 + 4 * 15)
+
+
+def test_warm_up_recording():
+    spec = RecordingSpec(['x'], every=3, reducers={'rate': ['mean', 'max']})
+    expected, _ = bounded_engine.run(initial_state, blocks, params, 20, record=spec)
+    results, _ = warm_up.run(initial_state, blocks, params, 20, warm_up_timesteps=7, record=spec,
+                             single_run=bounded_engine.single_run)
+    assert results == expected
+
+
+def test_traced_params():
+    param_set = {'a': 1, 'b': np.zeros(2), 'c': 3}
+    traced = warm_up.TracedParams(param_set)
+    traced['a']
+    traced.get('d')
+    assert traced.reads == {'a', 'd'}
+    dict(**traced)
+    assert traced.reads == {'a', 'b', 'c', 'd'}
+
+    assert warm_up.shares_warm_up(param_set, {'a': 1, 'b': np.ones(2)}, {'a', 'd'}) is True
+    assert warm_up.shares_warm_up(param_set, {'a': 1, 'b': np.ones(2), 'd': None}, {'a', 'd'}) is False
+    assert warm_up.shares_warm_up(param_set, {'a': 1.0, 'b': param_set['b']}, {'a', 'b'}) is False
+    assert warm_up.shares_warm_up(param_set, {'a': 1, 'b': np.zeros(2)}, {'a', 'b'}) is False
+    assert warm_up.shares_warm_up(param_set, {'a': 1, 'b': param_set['b']}, {'a', 'b'}) is True
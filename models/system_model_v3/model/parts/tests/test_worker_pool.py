@@ -0,0 +1,54 @@
+import time
+import experiments.system_model_v3.lean_engine as lean_engine
+from experiments.system_model_v3.recording import RecordingSpec
+from experiments.system_model_v3.worker_pool import WorkerPool, job_order
+
+initial_state = {'x': 0.0, 'slept': 0.0}
+
+def p_a(params, substep, state_history, state):
+    if state['timestep'] == params['fail_at']:
+        raise ValueError('Failed')
+    return {'a': params['a']}
+
+def s_x(params, substep, state_history, state, policy_input):
+    return 'x', state['x'] + policy_input['a'] * state['run']
+
+def s_slept(params, substep, state_history, state, policy_input):
+    time.sleep(params['sleep'])
+    return 'slept', state['slept'] + params['sleep']
+
+blocks = [
+    {'history': 1, 'policies': {'a': p_a}, 'variables': {'x': s_x, 'slept': s_slept}},
+]
+params = {'a': [1.0, 2.0, 3.0], 'sleep': [0.0, 0.002, 0.0], 'fail_at': [None, None, 5]}
+
+
+def test_worker_pool():
+    expected, expected_exceptions = lean_engine.run(initial_state, blocks, params, 20, runs=3)
+    with WorkerPool(initial_state, blocks, params, processes=2) as pool:
+        results, exceptions = pool.run(20, runs=3, expected_cost=lambda param_set, run: param_set['sleep'])
+        assert 1 <= len(pool.utilisation) <= 2
+        assert all(0 < utilisation <= 1 for utilisation in pool.utilisation.values())
+
+        # The workers are reused
+        assert pool.run(20, runs=3)[0] == expected
+
+    assert results == expected
+    assert [(exception['run'], exception['subset'], repr(exception['exception'])) for exception in exceptions] == \
+        [(exception['run'], exception['subset'], repr(exception['exception'])) for exception in expected_exceptions]
+
+
+def test_worker_pool_compile_blocks():
+    record = RecordingSpec(['x'])
+    expected, _ = lean_engine.run(initial_state, blocks, params, 20, runs=2, record=record)
+    with WorkerPool(initial_state, blocks, params, processes=2, compile_blocks=True) as pool:
+        # The unrecorded slept isn't updated
+        assert pool.run(20, runs=2, record=record)[0] == expected
+        assert max(row['slept'] for row in pool.run(20, runs=2, record=True)[0]) > 0
+
+
+def test_job_order():
+    param_sweep = [{'cost': 1}, {'cost': 3}, {'cost': 2}]
+    assert job_order(param_sweep, 2) == [(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1)]
+    assert job_order(param_sweep, 2, lambda param_set, run: param_set['cost'] * (run + 1)) == \
+        [(1, 1), (2, 1), (1, 0), (2, 0), (0, 1), (0, 0)]
@@ -1,4 +1,3 @@
-import scipy.stats as sts
 import datetime as dt
 import numpy as np
 
@@ -1,5 +1,7 @@
-from collections import namedtuple, deque
+from collections import namedtuple
 import math
+
+from models.system_model_v3.model.parts.observations import Observations
 '''
 Reflexer implementation: https://github.com/reflexer-labs/geb-uniswap-median/blob/master/src/UniswapConsecutiveSlotsPriceFeedMedianizer.sol
 See https://uniswap.org/docs/v2/core-concepts/oracles/
@@ -9,6 +11,14 @@ UniswapObservation = namedtuple('UniswapObservation', ['timestamp', 'price_0_cum
 ConverterFeedObservation = namedtuple('ConverterFeedObservation', ['timestamp', 'time_adjusted_price'])
 
 class UniswapOracle():
+    '''
+    Immutable: `update_result()` returns the updated oracle, sharing the observation buffers with this one,
+    so the oracle can be stored in the state without copying it.
+    '''
+    __slots__ = ('default_amount_in', 'target_token', 'denomination_token', 'granularity', 'window_size', 'max_window_size',
+                 'last_update_time', 'updates', 'period_size', 'median_price', 'uniswap_observations',
+                 'converter_feed_observations', 'converter_price_cumulative', 'price_0_cumulative', 'price_1_cumulative')
+
     def __init__(self, granularity=5, window_size=15*3600, max_window_size=21*3600):
         self.default_amount_in = 1
         self.target_token = 'rai'
@@ -25,8 +35,8 @@ class UniswapOracle():
         
         #self.uniswap_observations = []
         #self.converted_feed_observations = []
-        self.uniswap_observations = deque([], granularity+1)
-        self.converter_feed_observations = deque([], granularity+1)
+        self.uniswap_observations = Observations(granularity+1)
+        self.converter_feed_observations = Observations(granularity+1)
         self.converter_price_cumulative = 0
 
         self.price_0_cumulative = 0
@@ -44,6 +54,12 @@ class UniswapOracle():
         else:
             return self.updates - int(self.granularity)
 
+    def _replace(self, **changes):
+        oracle = UniswapOracle.__new__(UniswapOracle)
+        for key in UniswapOracle.__slots__:
+            setattr(oracle, key, changes[key] if key in changes else getattr(self, key))
+        return oracle
+
     def get_first_observations_in_window(self):
         '''
         earliest_observation_index = self.earliest_observation_index()
@@ -54,22 +70,30 @@ class UniswapOracle():
         return self.uniswap_observations[0], self.converter_feed_observations[0]
 
     def update_observations(self, state, time_elapsed_since_latest, uniswap_price_0_cumulative, uniswap_price_1_cumulative):
+        '''
+        Returns the oracle with the new observations, before updating the median price
+        '''
         now = state['cumulative_time']
         price_feed_value = state['eth_price']
         new_time_adjusted_price = price_feed_value * time_elapsed_since_latest
             
-        self.converter_feed_observations.append(
-            ConverterFeedObservation(now, new_time_adjusted_price)
-        )
-        self.uniswap_observations.append(
-            UniswapObservation(now, uniswap_price_0_cumulative, uniswap_price_1_cumulative)
+        oracle = self._replace(
+            converter_feed_observations=self.converter_feed_observations.append(
+                ConverterFeedObservation(now, new_time_adjusted_price)
+            ),
+            uniswap_observations=self.uniswap_observations.append(
+                UniswapObservation(now, uniswap_price_0_cumulative, uniswap_price_1_cumulative)
+            ),
+            price_0_cumulative=uniswap_price_0_cumulative,
+            price_1_cumulative=uniswap_price_1_cumulative,
         )
             
-        if self.updates >= self.granularity:
-            _, first_converter_feed_observation = self.get_first_observations_in_window()
-            self.converter_price_cumulative -= first_converter_feed_observation.time_adjusted_price
+        if oracle.updates >= oracle.granularity:
+            _, first_converter_feed_observation = oracle.get_first_observations_in_window()
+            oracle.converter_price_cumulative -= first_converter_feed_observation.time_adjusted_price
             
-        self.converter_price_cumulative += new_time_adjusted_price
+        oracle.converter_price_cumulative += new_time_adjusted_price
+        return oracle
 
 
     def uniswap_compute_amount_out(self, price_cumulative_start, price_cumulative_end, time_elapsed, amount_in):
@@ -117,15 +141,17 @@ class UniswapOracle():
         time_elapsed_since_latest = (now - last_update_time) if len(self.uniswap_observations) == 0 else (now - self.uniswap_observations[len(self.uniswap_observations) - 1].timestamp)
         
         if len(self.uniswap_observations) > 0 and not time_elapsed_since_latest >= self.period_size:
-            return
+            return self
 
         # See https://github.com/Uniswap/uniswap-v2-periphery/blob/master/contracts/libraries/UniswapV2OracleLibrary.sol
-        self.price_0_cumulative += (state['ETH_balance'] / state['RAI_balance']) * time_elapsed_since_latest
-        self.price_1_cumulative += (state['RAI_balance'] / state['ETH_balance']) * time_elapsed_since_latest
-        uniswap_price_0_cumulative, uniswap_price_1_cumulative = (self.price_0_cumulative, self.price_1_cumulative) # currentCumulativePrices() returns prices eth/rai & rai/eth
+        price_0_cumulative = self.price_0_cumulative + (state['ETH_balance'] / state['RAI_balance']) * time_elapsed_since_latest
+        price_1_cumulative = self.price_1_cumulative + (state['RAI_balance'] / state['ETH_balance']) * time_elapsed_since_latest
+        uniswap_price_0_cumulative, uniswap_price_1_cumulative = (price_0_cumulative, price_1_cumulative) # currentCumulativePrices() returns prices eth/rai & rai/eth
 
-        self.update_observations(state, time_elapsed_since_latest, uniswap_price_0_cumulative, uniswap_price_1_cumulative)
+        oracle = self.update_observations(state, time_elapsed_since_latest, uniswap_price_0_cumulative, uniswap_price_1_cumulative)
 
-        self.median_price = self.get_median_price(state, uniswap_price_0_cumulative, uniswap_price_1_cumulative)
-        self.last_update_time = now
-        self.updates += 1
+        # The oracle isn't shared until it's returned, so it's updated in place here
+        oracle.median_price = oracle.get_median_price(state, uniswap_price_0_cumulative, uniswap_price_1_cumulative)
+        oracle.last_update_time = now
+        oracle.updates += 1
+        return oracle
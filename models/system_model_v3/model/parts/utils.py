@@ -1,10 +1,12 @@
 from decimal import Decimal
 import numpy as np
-import pandas as pd
 import math
+import sys
 import logging
 import time
 from functools import wraps
+from models.constants import SPY
+from models.utils import random_streams
 import models.system_model_v3.model.parts.failure_modes as failure
 
 
@@ -12,7 +14,33 @@ def apy_to_target_rate(apy):
     return float((Decimal(apy) / 100  + 1) **(Decimal('1')/(Decimal('31536000'))) - 1)
 
 def target_rate_to_apy(target_rate):
-    return (((1 + Decimal(target_rate)) ** (60*60*24*365)) -1) * 100
+    return growth_factor(target_rate, SPY, minus_one=True) * 100
+
+# Largest log growth that exp() can represent; beyond it growth_factor() is computed with Decimal
+max_log_growth = math.log(sys.float_info.max)
+
+def growth_factor(rate, seconds, minus_one=False):
+    """
+    (1 + rate) ** seconds for a per second `rate`, minus one if `minus_one`.
+    `seconds` can be an array, e.g. the timeframes of all agents, for an array of factors.
+    """
+    seconds = np.asarray(seconds, dtype=float)
+    exponent = seconds * math.log1p(rate) if rate > -1 else np.full(seconds.shape, np.inf)
+    with np.errstate(over='ignore'):
+        factor = np.array(np.expm1(exponent) if minus_one else np.exp(exponent))
+    # Beyond the range of exp(), computed with Decimal
+    for index in np.argwhere(np.abs(exponent) >= max_log_growth):
+        index = tuple(index)
+        decimal_factor = (1 + Decimal(rate)) ** Decimal(seconds[index])
+        factor[index] = float(decimal_factor - 1 if minus_one else decimal_factor)
+    return float(factor) if factor.ndim == 0 else factor
+
+def random_stream(params, state, stream):
+    """
+    Random number generator of `stream` at the current subset, run and timestep, see models/utils/random_streams.py.
+    The subsets forked from a shared warm-up drew with the subset of the warm-up until then (see experiments/system_model_v3/warm_up.py).
+    """
+    return random_streams.generator(params['rng_seed'], state['subset'], state['run'], stream, state['timestep'])
 
 def print_time(f):
     """
@@ -37,6 +65,7 @@ def s_update_sim_metrics(params, substep, state_history, state, policy_input):
     return 'sim_metrics', sim_metrics
 
 def save_partial_results(params, substep, state_history, state):
+    import pandas as pd
     partial_results: pd.DataFrame = pd.read_pickle(params['partial_results'])
     partial_results = partial_results.append(state, ignore_index=True)
     partial_results.to_pickle(params['partial_results'])
@@ -0,0 +1,60 @@
+"""Binary cache of the presimulated CSV data, shared by all processes through memory mapping."""
+
+import hashlib
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+# models/system_model_v3/data/cache, wherever the process is run from, unless set by the RAI_DATA_CACHE environment variable
+cache_directory = os.environ.get(
+    'RAI_DATA_CACHE',
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'data', 'cache'))
+)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def _save(path, array):
+    # Written to a temporary file first, so that other processes never load a partial file
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+    os.replace(temporary_path, path)
+
+def read_csv_cached(path, cache_directory=cache_directory):
+    '''
+    `pd.read_csv(path, index_col=0)` for a CSV of float columns,
+    cached as column-major .npy files keyed by the hash of the CSV file.
+
+    The DataFrame is backed by a read-only memory map of the cache, so its pages are shared between processes.
+    '''
+    stem = os.path.basename(path).split('.')[0]
+    cache_path = os.path.join(cache_directory, f'{stem}-{file_hash(path)}')
+
+    try:
+        values = np.load(f'{cache_path}.values.npy', mmap_mode='r')
+        index = np.load(f'{cache_path}.index.npy')
+        columns = np.load(f'{cache_path}.columns.npy')
+    except (OSError, ValueError):
+        df = pd.read_csv(path, index_col=0)
+        if not all(dtype == np.float64 for dtype in df.dtypes):
+            return df
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+            _save(f'{cache_path}.values.npy', np.asfortranarray(df.to_numpy()))
+            _save(f'{cache_path}.index.npy', df.index.to_numpy())
+            _save(f'{cache_path}.columns.npy', df.columns.to_numpy(dtype=str))
+        except OSError as e:
+            logging.warning(f'Failed to cache {path}: {e}')
+            return df
+        values = np.load(f'{cache_path}.values.npy', mmap_mode='r')
+        index = np.load(f'{cache_path}.index.npy')
+        columns = np.load(f'{cache_path}.columns.npy')
+
+    return pd.DataFrame(values, index=index, columns=list(columns), copy=False)
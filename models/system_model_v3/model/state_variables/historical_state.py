@@ -1,22 +1,27 @@
-import pandas as pd
-import numpy as np
+from functools import lru_cache
 """Retrieve presimulated chain actions such as eth price, token swapping, liquidity demand and such."""
 
-#eth_price_df = pd.read_csv('models/system_model_v3/data/eth_values_gold.csv.gz', 
-#eth_price_df = pd.read_csv('models/system_model_v3/data/eth.constant.csv.gz', 
-eth_price_df = pd.read_csv('models/system_model_v3/data/eth_values_mc.csv.gz', 
-                           compression='gzip',
-                           index_col=0)
+# The DataFrames are module attributes loaded on first access (see __getattr__), so that importing the model doesn't read the data.
+# The Monte Carlo CSVs are parsed once and cached in models/system_model_v3/data/cache, see data_cache.py
+data_files = {
+    #'eth_price_df': 'models/system_model_v3/data/eth_values_gold.csv.gz',
+    #'eth_price_df': 'models/system_model_v3/data/eth.constant.csv.gz',
+    'eth_price_df': 'models/system_model_v3/data/eth_values_mc.csv.gz',
+    #Liquidity adds and removes to uniswap ETH/RAI pool
+    'liquidity_demand_pct_df': 'models/system_model_v3/data/liquidity_pct_mc.csv.gz',
+    #token trades in and out of the uniswap ETH/RAi pool
+    'token_swap_pct_df': 'models/system_model_v3/data/buy_sell_pct_mc.csv.gz',
+}
 
-# Set the initial ETH price state
-eth_price = eth_price_df["0"].iloc[0]
+@lru_cache(maxsize=None)
+def load(name):
+    from models.system_model_v3.model.state_variables.data_cache import read_csv_cached
+    return read_csv_cached(data_files[name])
 
-#Liquidity adds and removes to uniswap ETH/RAI pool
-liquidity_demand_pct_df = pd.read_csv('models/system_model_v3/data/liquidity_pct_mc.csv.gz',
-                                      compression='gzip',
-                                      index_col=0)
-
-#token trades in and out of the uniswap ETH/RAi pool
-token_swap_pct_df = pd.read_csv('models/system_model_v3/data/buy_sell_pct_mc.csv.gz',
-                                compression='gzip',
-                                index_col=0)
+def __getattr__(name):
+    if name in data_files:
+        return load(name)
+    # Set the initial ETH price state
+    if name == 'eth_price':
+        return load('eth_price_df')["0"].iloc[0]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
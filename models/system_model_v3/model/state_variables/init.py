@@ -11,6 +11,7 @@ from models.system_model_v3.model.state_variables.system import stability_fee, t
 from models.system_model_v3.model.state_variables.historical_state import eth_price
 from models.system_model_v3.model.parts.uniswap_oracle import UniswapOracle
 from models.system_model_v3.model.parts.chainlink_twap import ChainlinkTWAP
+from models.system_model_v3.model.parts.running_moments import RunningMoments
 
 import datetime as dt
 
@@ -33,7 +34,7 @@ state_variables = {
     'liquidity_demand_mean': 1, # net transfer in or out of RAI tokens in the RAI-USD pool
     
     # CDP states
-    'cdps': cdps, # A dataframe of CDPs (both open and closed)
+    'cdps': cdps, # A CDPLedger of CDPs (both open and closed), see debt_market.py
     # ETH collateral states
     'eth_collateral': 0, # "Q"; total ETH collateral in the CDP system i.e. locked - freed - bitten
     'eth_locked': 0, # total ETH locked into CDPs
@@ -76,6 +77,8 @@ state_variables = {
     'eth_gross_return': 0,
     'expected_market_price': target_price, # root of non-arbitrage condition
     'expected_debt_price': target_price, # predicted "debt" price, the intrinsic value of RAI according to the debt market activity and state
+    'eth_price_moments': RunningMoments(), # running mean of ETH price over previous timesteps
+    'market_price_moments': RunningMoments(), # running mean of market price over previous timesteps
     
     # Price trader
     'price_trader_rai_balance': price_trader_rai_balance,
@@ -20,6 +20,7 @@ def open_cdp_lock(lock, eth_price, target_price, liquidation_ratio):
 
 from models.system_model_v3.model.state_variables.historical_state import eth_price
 from models.system_model_v3.model.state_variables.system import target_price
+from models.system_model_v3.model.parts.debt_market import CDPLedger
 import pandas as pd
 import scipy
 
@@ -116,4 +117,4 @@ cdp = {
     'owner': '' #specifies which agent code controls the cdp
 }
 
-cdps = pd.DataFrame([cdp])
+cdps = CDPLedger.from_records([cdp])
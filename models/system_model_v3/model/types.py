@@ -1,5 +1,14 @@
 from typing import Dict, TypedDict, List
 
+import numpy as np
+
+from models.system_model_v3.model.parts.chainlink_twap import ChainlinkTWAP
+from models.system_model_v3.model.parts.debt_market import CDPLedger
+from models.system_model_v3.model.parts.price_traders import PriceTraders
+from models.system_model_v3.model.parts.rate_traders import RateTraders
+from models.system_model_v3.model.parts.running_moments import RunningMoments
+from models.system_model_v3.model.parts.uniswap_oracle import UniswapOracle
+
 
 Seconds = int
 Height = int
@@ -23,6 +32,11 @@ Run = int
 Timestep = int
 Gwei = int
 
+# Types of state and signal values that are never modified in place:
+# immutable values, and the model's objects that are replaced rather than modified once they are in the state
+immutable_types = {int, float, bool, str, type(None), np.float64, np.int64, np.bool_,
+                   ChainlinkTWAP, CDPLedger, PriceTraders, RateTraders, RunningMoments, UniswapOracle}
+
 class CDP_Metric(TypedDict):
     cdp_count: int
     open_cdp_count: int
@@ -0,0 +1,49 @@
+'''
+Counter based random number streams.
+
+Each (seed, subset, run, stream) has its own Philox key, and each timestep its own counter,
+so the draws of a stream at a timestep don't depend on the draws of other streams, runs or timesteps,
+or on which process runs them.
+'''
+import zlib
+from functools import lru_cache
+import numpy as np
+
+# The latest timestep at which each (seed, subset, run, stream) was got, and how many times, see generator()
+_calls = {}
+
+@lru_cache(maxsize=256)
+def stream_generator(seed, subset, run, stream):
+    '''
+    Generator with the Philox key of the stream, reused for all timesteps, and the key
+    '''
+    key = np.random.SeedSequence([seed, subset, run, zlib.crc32(stream.encode())]).generate_state(2, np.uint64)
+    return np.random.Generator(np.random.Philox(key=key)), key
+
+def reset():
+    '''
+    Forget the calls of generator(), e.g. at the start of a run, so that a replayed timestep gets the same draws
+    '''
+    _calls.clear()
+
+def generator(seed, subset, run, stream, timestep):
+    '''
+    Generator of the stream at the timestep.
+    Each call for the stream in the same timestep continues from its own counter, so it doesn't repeat the draws of the previous calls.
+    The generator is shared, so draw from it before getting the stream's generator at another timestep.
+    '''
+    stream_key = (seed, subset, run, stream)
+    latest_timestep, calls = _calls.get(stream_key, (None, 0))
+    calls = calls + 1 if latest_timestep == timestep else 0
+    _calls[stream_key] = (timestep, calls)
+
+    rng, key = stream_generator(*stream_key)
+    rng.bit_generator.state = {
+        'bit_generator': 'Philox',
+        'state': {'counter': np.array([0, timestep, calls, 0], dtype=np.uint64), 'key': key},
+        'buffer': np.zeros(4, dtype=np.uint64),
+        'buffer_pos': 4,
+        'has_uint32': 0,
+        'uinteger': 0,
+    }
+    return rng
@@ -79,6 +79,13 @@ experiment_timestamp
 df_raw = pd.read_hdf(experiment_results, experiment_results_key)
 df_raw.tail()
 
+# %%
+# Results saved with `run_experiment(..., parquet_directory=...)` can be loaded by run and column instead,
+# e.g. the columns plotted below, without the CDP and trader side tables:
+# from experiments.system_model_v3.parquet_sink import load_results
+# df_raw = load_results('experiments/system_model_v3/recommended_params_mc/experiment_results',
+#                       columns=['timestamp', 'eth_price', 'target_price', 'market_price', 'target_rate'])
+
 # %% [markdown]
 # ## Post process
 